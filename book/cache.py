@@ -0,0 +1,41 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from library_service.versions import get_version, invalidate
+
+CATALOG_VERSION = "book:catalog"
+
+
+def get_catalog_version() -> int:
+    """Current catalog version, part of the key of every cached response"""
+    return get_version(CATALOG_VERSION)
+
+
+def invalidate_catalog() -> None:
+    """Drop every cached catalog response after a book write"""
+    invalidate(CATALOG_VERSION)
+
+
+def cache_catalog_response(view_method):
+    """Serve successful responses of a catalog view from the cache"""
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = f"book:response:{get_catalog_version()}:{url}"
+
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.BOOK_CACHE_TIMEOUT)
+        return response
+
+    return wrapper
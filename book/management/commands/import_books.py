@@ -0,0 +1,57 @@
+import sys
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from book.services import (
+    IMPORT_FORMATS,
+    import_books,
+    import_format,
+    read_rows,
+)
+
+
+class Command(BaseCommand):
+    """Django command to upsert books from a CSV or JSONL feed"""
+
+    help = (  # noqa: VNE003
+        "Stream a CSV or JSONL book feed in batches and upsert every book "
+        "on its title and author."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Feed file, or - for stdin.")
+        parser.add_argument(
+            "--file-format",
+            choices=IMPORT_FORMATS,
+            help="Defaults to the extension of the feed file.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["file_format"] or import_format(path)
+        if file_format is None:
+            raise CommandError(
+                "Cannot tell the feed format, pass --file-format."
+            )
+
+        try:
+            stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+        except OSError as error:
+            raise CommandError(error)
+
+        started = time.perf_counter()
+        with stream:
+            report = import_books(
+                read_rows(stream, file_format), options["batch_size"]
+            )
+        elapsed = time.perf_counter() - started
+
+        for error in report.errors:
+            self.stderr.write(error)
+        self.stdout.write(
+            f"rows={report.rows} imported={report.imported} "
+            f"invalid={report.invalid} elapsed={elapsed:.2f}s "
+            f"throughput={report.rows / elapsed:.0f} rows/s"
+        )
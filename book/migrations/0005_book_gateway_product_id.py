@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0004_book_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="gateway_product_id",
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
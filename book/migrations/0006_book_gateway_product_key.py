@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:30
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0005_book_gateway_product_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="gateway_product_key",
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        # Every book needs its own key, a field default would be shared.
+        migrations.RunSQL(
+            "UPDATE book_book SET gateway_product_key = gen_random_uuid()",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="book",
+            name="gateway_product_key",
+            field=models.UUIDField(
+                default=uuid.uuid4, editable=False, unique=True
+            ),
+        ),
+    ]
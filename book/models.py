@@ -1,4 +1,70 @@
+import uuid
+
+from django.contrib.postgres.functions import RandomUUID
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorField,
+    TrigramWordSimilarity,
+)
 from django.db import models
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, Collate, Upper
+
+from book.cache import invalidate_catalog
+from library_service.querysets import TimestampedQuerySet
+
+
+class BookQuerySet(TimestampedQuerySet):
+    def update(self, **kwargs):
+        if "title" in kwargs:
+            # Renamed books get a new gateway product on their next checkout
+            kwargs.setdefault("gateway_product_id", "")
+            kwargs.setdefault("gateway_product_key", RandomUUID())
+        rows = super().update(**kwargs)
+        if rows:
+            invalidate_catalog()
+        return rows
+
+    def bulk_create(self, books, *args, **kwargs):
+        books = super().bulk_create(books, *args, **kwargs)
+        invalidate_catalog()
+        return books
+
+    def take_copy(self):
+        """Take one copy of every in-stock book, return the number taken"""
+        return self.filter(inventory__gt=0).update(
+            inventory=F("inventory") - 1
+        )
+
+    def return_copy(self):
+        """Put one copy of every book back, return the number returned"""
+        return self.update(inventory=F("inventory") + 1)
+
+    def search(self, text):
+        """Books matching a web-style full-text query, annotated with rank"""
+        query = SearchQuery(text, config="english", search_type="websearch")
+        return self.filter(search_vector=query).annotate(
+            rank=Cast(SearchRank(F("search_vector"), query), FloatField())
+        )
+
+    def title_prefix(self, text):
+        """Books whose title starts with the text, case-insensitively"""
+        return (
+            self.alias(title_key=Collate(Upper("title"), "C"))
+            .filter(title_key__startswith=text.upper())
+            .order_by("title_key")
+        )
+
+    def title_similar(self, text):
+        """Books with a title word close to the text, best match first"""
+        return (
+            self.alias(upper_title=Upper("title"))
+            .filter(upper_title__trigram_word_similar=text)
+            .annotate(similarity=TrigramWordSimilarity(text, Upper("title")))
+            .order_by("-similarity", "title")
+        )
 
 
 class Book(models.Model):
@@ -11,10 +77,32 @@ class Book(models.Model):
     cover = models.CharField(max_length=64, choices=CoverChoices.choices)
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    search_vector = SearchVectorField(null=True, editable=False)
+    gateway_product_id = models.CharField(
+        max_length=255, blank=True, editable=False
+    )
+    # Idempotency key of the product creation, replaced with the product
+    gateway_product_key = models.UUIDField(
+        default=uuid.uuid4, unique=True, editable=False
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         ordering = ["title"]
         unique_together = ("title", "author")
+        indexes = [
+            models.Index(fields=["title", "id"], name="book_title_id_idx"),
+            models.Index(
+                Collate(Upper("title"), "C"), name="book_title_prefix_idx"
+            ),
+            GinIndex(fields=["search_vector"], name="book_search_vector_idx"),
+            GinIndex(
+                OpClass(Upper("title"), name="gin_trgm_ops"),
+                name="book_title_trgm_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.title
@@ -1,8 +1,37 @@
 from rest_framework import serializers
 from book.models import Book
+from book.services import IMPORT_FORMATS, import_format
 
 
 class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ("id", "title", "author", "cover", "inventory", "daily_fee")
+
+
+class BookAutocompleteSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ("id", "title", "author")
+
+
+class BookImportSerializer(serializers.Serializer):
+    books_file = serializers.FileField()
+    file_format = serializers.ChoiceField(
+        choices=IMPORT_FORMATS, required=False
+    )
+
+    def validate(self, data):
+        data.setdefault("file_format", import_format(data["books_file"].name))
+        if data["file_format"] is None:
+            raise serializers.ValidationError(
+                {"file_format": "Cannot tell the format of the file."}
+            )
+        return data
+
+
+class BookImportReportSerializer(serializers.Serializer):
+    rows = serializers.IntegerField()
+    imported = serializers.IntegerField()
+    invalid = serializers.IntegerField()
+    errors = serializers.ListField(child=serializers.CharField())
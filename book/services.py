@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import IO, Iterable, Iterator
+
+from django.core.exceptions import ValidationError
+
+from book.models import Book
+
+IMPORT_FORMATS = ("csv", "jsonl")
+IMPORT_FIELDS = ("title", "author", "cover", "inventory", "daily_fee")
+IMPORT_MAX_ERRORS = 20
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    imported: int = 0
+    invalid: int = 0
+    errors: list[str] = field(default_factory=list)
+
+    def add_error(self, row: int, message: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(f"Row {row}: {message}")
+
+
+def import_format(filename: str) -> str | None:
+    """Import format from a file name, None when it is not supported"""
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "ndjson":
+        return "jsonl"
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def read_rows(stream: IO[bytes], file_format: str) -> Iterator[dict | str]:
+    """
+    Yield the records of a CSV or JSONL byte stream one at a time.
+
+    A record that cannot be parsed is yielded as an error message.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        yield from csv.DictReader(text)
+        return
+
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield f"Invalid JSON: {error}"
+            continue
+        yield record if isinstance(record, dict) else "Not a JSON object"
+
+
+def import_books(
+    records: Iterable[dict | str], batch_size: int = 1000
+) -> ImportReport:
+    """
+    Upsert books on (title, author) in batches of ``batch_size`` records.
+
+    Existing books get the cover, inventory and daily fee of the record.
+    Only one batch is held in memory, and the last of several records
+    with the same title and author within a batch wins.
+    """
+    report = ImportReport()
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        books = {}
+        for record in batch:
+            report.rows += 1
+            try:
+                book = _book_from_record(record)
+            except ValidationError as error:
+                report.add_error(report.rows, "; ".join(error.messages))
+                continue
+            books[(book.title, book.author)] = book
+
+        Book.objects.bulk_create(
+            books.values(),
+            update_conflicts=True,
+            unique_fields=["title", "author"],
+            update_fields=["cover", "inventory", "daily_fee", "updated_at"],
+        )
+        report.imported += len(books)
+    return report
+
+
+def _book_from_record(record: dict | str) -> Book:
+    if isinstance(record, str):
+        raise ValidationError(record)
+
+    values, errors = {}, []
+    for name in IMPORT_FIELDS:
+        value = record.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        try:
+            values[name] = Book._meta.get_field(name).clean(value, None)
+        except ValidationError as error:
+            errors.extend(f"{name}: {message}" for message in error.messages)
+    if errors:
+        raise ValidationError(errors)
+    return Book(**values)
@@ -0,0 +1,28 @@
+import uuid
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from book.cache import invalidate_catalog
+from book.models import Book
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_catalog_on_book_change(**kwargs):
+    invalidate_catalog()
+
+
+@receiver(pre_save, sender=Book)
+def forget_gateway_product_on_rename(instance, **kwargs):
+    """A renamed book gets a new gateway product on its next checkout"""
+    if instance.pk is None or not instance.gateway_product_id:
+        return
+    title = (
+        Book.objects.filter(pk=instance.pk)
+        .values_list("title", flat=True)
+        .first()
+    )
+    if title is not None and title != instance.title:
+        instance.gateway_product_id = ""
+        instance.gateway_product_key = uuid.uuid4()
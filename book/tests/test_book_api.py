@@ -1,4 +1,10 @@
+import io
+import tempfile
+
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
 from django.urls import reverse
 from django.test import TestCase
 from rest_framework import status
@@ -6,8 +12,19 @@ from rest_framework.test import APIClient
 
 from book.models import Book
 from book.serializers import BookSerializer
+from book.services import import_books, read_rows
 
 BOOK_URL = reverse("book:book-list")
+AUTOCOMPLETE_URL = reverse("book:book-autocomplete")
+IMPORT_URL = reverse("book:book-import-books")
+
+FEED_CSV = (
+    "title,author,cover,inventory,daily_fee\n"
+    "Test Title,Test Author,soft,3,1.25\n"
+    "New Title,New Author,hard,7,2.00\n"
+    "Bad Title,Bad Author,paper,-1,x\n"
+    "New Title,New Author,hard,8,2.50\n"
+)
 
 
 def create_user(**params):
@@ -32,6 +49,7 @@ def detail_url(book_id):
 
 class UnauthenticatedBookApiTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
 
     def test_list_book(self):
@@ -49,6 +67,293 @@ class UnauthenticatedBookApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, serializer.data)
 
+    def test_list_book_paginated_by_title_and_id(self):
+        for index in range(5):
+            sample_book(title="Same Title", author=f"Author {index}")
+        sample_book(title="A Title")
+        sample_book(title="Z Title")
+        expected = list(
+            Book.objects.order_by("title", "id").values_list("id", flat=True)
+        )
+
+        seen = []
+        url = f"{BOOK_URL}?page_size=2"
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", res.data)
+            seen.extend(book["id"] for book in res.data["results"])
+            url = res.data["next"]
+
+        self.assertEqual(seen, expected)
+
+    def test_list_book_previous_page(self):
+        for index in range(5):
+            sample_book(title="Same Title", author=f"Author {index}")
+
+        first = self.client.get(BOOK_URL, {"page_size": 2})
+        second = self.client.get(first.data["next"])
+        back = self.client.get(second.data["previous"])
+
+        self.assertIsNone(first.data["previous"])
+        self.assertEqual(back.data["results"], first.data["results"])
+        self.assertEqual(back.data["next"], first.data["next"])
+
+    def test_list_book_invalid_cursor(self):
+        res = self.client.get(BOOK_URL, {"cursor": "not-a-cursor"})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookSearchApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dune = sample_book(title="Dune", author="Frank Herbert")
+        self.children = sample_book(
+            title="Children of Dune", author="Frank Herbert"
+        )
+        self.about = sample_book(title="Dreaming", author="Dune Fan")
+        sample_book(title="Hyperion", author="Dan Simmons")
+
+    def test_search_ranks_title_matches_first(self):
+        res = self.client.get(BOOK_URL, {"search": "dune"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [book["id"] for book in res.data["results"]]
+        self.assertEqual(ids[-1], self.about.id)
+        self.assertCountEqual(ids, [self.dune.id, self.children.id, self.about.id])
+
+    def test_search_matches_author_and_stems(self):
+        res = self.client.get(BOOK_URL, {"search": "herbert's dunes"})
+
+        ids = {book["id"] for book in res.data["results"]}
+        self.assertEqual(ids, {self.dune.id, self.children.id})
+
+    def test_search_walks_pages(self):
+        expected = [
+            book.id for book in Book.objects.search("dune").order_by("-rank", "id")
+        ]
+
+        seen = []
+        url = f"{BOOK_URL}?search=dune&page_size=1"
+        while url:
+            res = self.client.get(url)
+            seen.extend(book["id"] for book in res.data["results"])
+            url = res.data["next"]
+
+        self.assertEqual(seen, expected)
+
+    def test_search_vector_follows_title_changes(self):
+        self.dune.title = "Arrakis"
+        self.dune.save()
+
+        res = self.client.get(BOOK_URL, {"search": "arrakis"})
+
+        self.assertEqual(
+            [book["id"] for book in res.data["results"]], [self.dune.id]
+        )
+
+    def test_autocomplete_prefix(self):
+        res = self.client.get(AUTOCOMPLETE_URL, {"search": "chil"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data,
+            [{"id": self.children.id, "title": "Children of Dune", "author": "Frank Herbert"}],
+        )
+
+    def test_autocomplete_tolerates_typos(self):
+        res = self.client.get(AUTOCOMPLETE_URL, {"search": "hyperon"})
+
+        self.assertEqual([book["title"] for book in res.data], ["Hyperion"])
+
+    def test_autocomplete_empty_search(self):
+        res = self.client.get(AUTOCOMPLETE_URL)
+
+        self.assertEqual(res.data, [])
+
+
+class BookCacheApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = create_user(
+            email="test@admin.com", password="testpass", is_staff=True
+        )
+        self.book = sample_book()
+
+    def test_list_and_detail_served_from_cache(self):
+        self.client.get(BOOK_URL)
+        self.client.get(detail_url(self.book.id))
+
+        with self.assertNumQueries(0):
+            list_res = self.client.get(BOOK_URL)
+            detail_res = self.client.get(detail_url(self.book.id))
+
+        self.assertEqual(list_res.data["results"][0]["id"], self.book.id)
+        self.assertEqual(detail_res.data["id"], self.book.id)
+
+    def test_cache_keyed_by_query(self):
+        sample_book(title="Another Title")
+        self.client.get(BOOK_URL)
+
+        res = self.client.get(BOOK_URL, {"search": "another"})
+
+        self.assertEqual(len(res.data["results"]), 1)
+
+    def test_book_write_invalidates_cache(self):
+        self.client.get(BOOK_URL)
+        self.client.get(detail_url(self.book.id))
+
+        self.client.force_authenticate(self.admin)
+        self.client.patch(detail_url(self.book.id), {"inventory": 3})
+        self.client.post(
+            BOOK_URL,
+            {
+                "title": "New Title",
+                "author": "New Author",
+                "cover": "hard",
+                "inventory": 10,
+                "daily_fee": "10.5",
+            },
+        )
+
+        self.assertEqual(
+            self.client.get(detail_url(self.book.id)).data["inventory"], 3
+        )
+        self.assertEqual(len(self.client.get(BOOK_URL).data["results"]), 2)
+
+    def test_inventory_update_invalidates_cache(self):
+        self.client.get(detail_url(self.book.id))
+
+        Book.objects.filter(pk=self.book.pk).take_copy()
+
+        res = self.client.get(detail_url(self.book.id))
+        self.assertEqual(res.data["inventory"], self.book.inventory - 1)
+
+    def test_etag_follows_catalog_version(self):
+        etag = self.client.get(BOOK_URL)["ETag"]
+
+        res = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Book.objects.filter(pk=self.book.pk).take_copy()
+
+        res = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res["ETag"], etag)
+
+    def test_not_found_not_cached(self):
+        url = detail_url(self.book.id + 1)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        sample_book(id=self.book.id + 1, title="Late Title")
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class BookImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = create_user(
+            email="test@admin.com", password="testpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        self.book = sample_book()
+
+    def test_import_csv_upserts_on_title_and_author(self):
+        upload = SimpleUploadedFile("feed.csv", FEED_CSV.encode())
+
+        res = self.client.post(IMPORT_URL, {"books_file": upload})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["rows"], 4)
+        self.assertEqual(res.data["imported"], 2)
+        self.assertEqual(res.data["invalid"], 1)
+        self.assertIn("Row 3", res.data["errors"][0])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 3)
+        self.assertEqual(str(self.book.daily_fee), "1.25")
+        self.assertEqual(self.book.cover, "soft")
+        new_book = Book.objects.get(title="New Title")
+        self.assertEqual(new_book.inventory, 8)
+
+    def test_import_jsonl(self):
+        feed = (
+            '{"title": "New Title", "author": "New Author", "cover": "hard",'
+            ' "inventory": 2, "daily_fee": "1.00"}\n'
+            "\n"
+            "not json\n"
+        )
+        upload = SimpleUploadedFile("feed.jsonl", feed.encode())
+
+        res = self.client.post(IMPORT_URL, {"books_file": upload})
+
+        self.assertEqual(res.data["imported"], 1)
+        self.assertEqual(res.data["invalid"], 1)
+        self.assertTrue(Book.objects.filter(title="New Title").exists())
+
+    def test_import_unknown_format(self):
+        upload = SimpleUploadedFile("feed.xml", b"<books/>")
+
+        res = self.client.post(IMPORT_URL, {"books_file": upload})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_staff_only(self):
+        self.client.force_authenticate(
+            create_user(email="test@test.com", password="testpass")
+        )
+        upload = SimpleUploadedFile("feed.csv", FEED_CSV.encode())
+
+        res = self.client.post(IMPORT_URL, {"books_file": upload})
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_one_query_per_batch(self):
+        feed = "title,author,cover,inventory,daily_fee\n" + "".join(
+            f"Title {index},Author,soft,1,1.00\n" for index in range(10)
+        )
+        records = read_rows(io.BytesIO(feed.encode()), "csv")
+
+        with self.assertNumQueries(4):
+            report = import_books(records, batch_size=3)
+
+        self.assertEqual(report.imported, 10)
+        self.assertEqual(Book.objects.count(), 11)
+
+    def test_export_books(self):
+        res = self.client.get(reverse("book:book-export"))
+
+        content = b"".join(res.streaming_content).decode()
+        self.assertEqual(
+            content.splitlines(),
+            [
+                "id,title,author,cover,inventory,daily_fee",
+                f"{self.book.id},Test Title,Test Author,hard,10,10.50",
+            ],
+        )
+
+    def test_imported_books_are_searchable(self):
+        upload = SimpleUploadedFile("feed.csv", FEED_CSV.encode())
+        self.client.post(IMPORT_URL, {"books_file": upload})
+
+        res = self.client.get(BOOK_URL, {"search": "new"})
+
+        self.assertEqual(len(res.data["results"]), 1)
+
+    def test_import_books_command(self):
+        with tempfile.NamedTemporaryFile(suffix=".csv") as feed:
+            feed.write(FEED_CSV.encode())
+            feed.flush()
+            out, err = io.StringIO(), io.StringIO()
+
+            call_command("import_books", feed.name, stdout=out, stderr=err)
+
+        self.assertIn("rows=4 imported=2 invalid=1", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        self.assertIn("Row 3", err.getvalue())
+        self.assertEqual(Book.objects.count(), 2)
+
 
 class AuthenticatedBookApiTests(TestCase):
     def setUp(self):
@@ -125,3 +430,65 @@ class AdminBookApiTests(TestCase):
         response = self.client.delete(url)
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class BookQueryCountTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            "test@admin.com", "testpass", is_staff=True
+        )
+        for index in range(5):
+            sample_book(title=f"Title {index}")
+
+    def test_list_queries(self):
+        with self.assertNumQueries(1):
+            res = self.client.get(BOOK_URL)
+        self.assertEqual(len(res.data["results"]), 5)
+
+    def test_search_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get(BOOK_URL, {"search": "title"})
+
+    def test_autocomplete_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get(AUTOCOMPLETE_URL, {"search": "ti"})
+
+    def test_autocomplete_fuzzy_queries(self):
+        with self.assertNumQueries(2):
+            self.client.get(AUTOCOMPLETE_URL, {"search": "tit"})
+
+    def test_retrieve_queries(self):
+        book = Book.objects.first()
+        with self.assertNumQueries(1):
+            self.client.get(detail_url(book.id))
+
+    def test_create_queries(self):
+        self.client.force_authenticate(self.admin)
+        payload = {
+            "title": "New Title",
+            "author": "New Author",
+            "cover": "hard",
+            "inventory": 10,
+            "daily_fee": "10.5",
+        }
+        with self.assertNumQueries(2):
+            self.client.post(BOOK_URL, payload)
+
+    def test_update_queries(self):
+        self.client.force_authenticate(self.admin)
+        book = Book.objects.first()
+        with self.assertNumQueries(3):
+            self.client.patch(detail_url(book.id), {"inventory": 3})
+
+    def test_delete_queries(self):
+        self.client.force_authenticate(self.admin)
+        book = Book.objects.first()
+        with self.assertNumQueries(4):
+            self.client.delete(detail_url(book.id))
+
+    def test_not_modified_queries(self):
+        etag = self.client.get(BOOK_URL)["ETag"]
+        with self.assertNumQueries(0):
+            res = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
@@ -1,15 +1,119 @@
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.response import Response
 
+from book.cache import cache_catalog_response, get_catalog_version
 from book.models import Book
-from book.serializers import BookSerializer
+from book.serializers import (
+    BookAutocompleteSerializer,
+    BookImportReportSerializer,
+    BookImportSerializer,
+    BookSerializer,
+)
+from book.services import import_books, read_rows
+from library_service.conditional import conditional_get
+from library_service.exports import export_response
+from library_service.pagination import KeysetPagination
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_FUZZY_MIN_LENGTH = 3
+
+
+class BookPagination(KeysetPagination):
+    ordering = ("title", "id")
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get("search"):
+            return ("-rank", "id")
+        return super().get_ordering(request, queryset, view)
 
 
 class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+    queryset = Book.objects.defer("search_vector")
     serializer_class = BookSerializer
+    pagination_class = BookPagination
+
+    def get_queryset(self):
+        queryset = self.queryset
+        search = self.request.query_params.get("search")
+
+        if search and self.action == "list":
+            queryset = queryset.search(search)
+
+        return queryset
+
+    @conditional_get
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_validators(self):
+        return get_catalog_version(), None
+
+    def get_serializer_class(self):
+        if self.action == "autocomplete":
+            return BookAutocompleteSerializer
+        if self.action == "import_books":
+            return BookImportSerializer
+        return BookSerializer
 
     def get_permissions(self):
-        if self.action in ["list", "retrieve"]:
+        if self.action in ["list", "retrieve", "autocomplete"]:
             return [AllowAny()]
         return [IsAdminUser()]
+
+    @action(methods=["GET"], detail=False, url_path="autocomplete")
+    @conditional_get
+    @cache_catalog_response
+    def autocomplete(self, request):
+        """
+        Titles starting with ?search=, topped up with typo-tolerant matches.
+
+        The prefix lookup is an index range scan, the trigram lookup only
+        runs when there are not enough prefix matches.
+        """
+        search = request.query_params.get("search", "").strip()
+        if not search:
+            return Response([])
+
+        queryset = Book.objects.only("id", "title", "author")
+        books = list(queryset.title_prefix(search)[:AUTOCOMPLETE_LIMIT])
+        if (
+            len(books) < AUTOCOMPLETE_LIMIT
+            and len(search) >= AUTOCOMPLETE_FUZZY_MIN_LENGTH
+        ):
+            books += queryset.title_similar(search).exclude(
+                pk__in=[book.pk for book in books]
+            )[: AUTOCOMPLETE_LIMIT - len(books)]
+
+        serializer = self.get_serializer(books, many=True)
+        return Response(serializer.data)
+
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="import",
+        parser_classes=(MultiPartParser,),
+    )
+    def import_books(self, request):
+        """Upsert books from an uploaded CSV or JSONL feed"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        upload = serializer.validated_data["books_file"]
+        report = import_books(
+            read_rows(upload.file, serializer.validated_data["file_format"])
+        )
+        return Response(BookImportReportSerializer(report).data)
+
+    @action(methods=["GET"], detail=False, url_path="export")
+    def export(self, request):
+        """Stream the whole catalog as CSV or NDJSON"""
+        return export_response(request, "books")
@@ -0,0 +1,92 @@
+from datetime import date
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from borrowing.models import Borrowing
+from library_service.versions import invalidate, model_version
+from payment.models import Payment
+
+ARCHIVE_BATCH_SIZE = 1000
+
+DELETE_OUTBOX = """
+DELETE FROM payment_paymentoutbox
+WHERE payment_id IN (
+    SELECT id FROM payment_payment WHERE borrowing_id = ANY(%(ids)s)
+)
+"""
+
+MOVE_BORROWINGS = """
+WITH moved AS (
+    DELETE FROM borrowing_borrowing WHERE id = ANY(%(ids)s)
+    RETURNING id, borrow_date, expected_return_date, actual_return_date,
+        book_id, user_id, daily_fee, price, updated_at
+)
+INSERT INTO borrowing_archivedborrowing (
+    id, borrow_date, expected_return_date, actual_return_date,
+    book_id, user_id, daily_fee, price, updated_at, archived_at
+)
+SELECT moved.*, %(now)s FROM moved
+"""
+
+MOVE_PAYMENTS = """
+WITH moved AS (
+    DELETE FROM payment_payment WHERE borrowing_id = ANY(%(ids)s)
+    RETURNING id, status, type, borrowing_id, session_url, session_id,
+        session_expires_at, checkout_group, money_to_pay, created_at,
+        updated_at
+)
+INSERT INTO payment_archivedpayment (
+    id, status, type, borrowing_id, session_url, session_id,
+    session_expires_at, checkout_group, money_to_pay, created_at,
+    updated_at
+)
+SELECT * FROM moved
+"""
+
+
+def archive_borrowings(
+        returned_before: date,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> tuple[int, int]:
+    """
+    Move borrowings returned before a date, with their payments, to the
+    archive tables.
+
+    Borrowings with a pending payment stay live. Every batch is moved by
+    DELETE ... RETURNING into an INSERT in its own transaction, and rows
+    locked by another worker are skipped. The raw SQL bypasses the model
+    signals, so the live versions are bumped here.
+    Return the (borrowings, payments) counts.
+    """
+    archivable = (
+        Borrowing.objects.filter(actual_return_date__lt=returned_before)
+        .exclude(
+            Exists(
+                Payment.objects.filter(
+                    borrowing=OuterRef("pk"), status="PENDING"
+                )
+            )
+        )
+        .order_by("pk")
+    )
+    borrowings = payments = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            ids = list(
+                archivable.select_for_update(skip_locked=True).values_list(
+                    "pk", flat=True
+                )[:batch_size]
+            )
+            if not ids:
+                break
+            params = {"ids": ids, "now": timezone.now()}
+            cursor.execute(DELETE_OUTBOX, params)
+            cursor.execute(MOVE_BORROWINGS, params)
+            borrowings += cursor.rowcount
+            cursor.execute(MOVE_PAYMENTS, params)
+            payments += cursor.rowcount
+            invalidate(model_version(Borrowing))
+            invalidate(model_version(Payment))
+    return borrowings, payments
@@ -0,0 +1,94 @@
+import functools
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from borrowing.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADERS = ("Location", "Retry-After")
+
+
+def idempotent(view_method):
+    """
+    Run a write at most once per Idempotency-Key header and user.
+
+    The first request stores its response, and retries with the same key
+    and body get that response back without running the view again. The
+    key is claimed in the transaction the view runs in, so a concurrent
+    duplicate waits for the first request and is then answered with its
+    response. An error raised by the view rolls the claim back, so the key
+    may be retried with a corrected body, and a 202 response is not final,
+    so it is not stored either.
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"detail": f"{IDEMPOTENCY_HEADER} is too long."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        request_hash = hashlib.sha256(
+            b"\n".join(
+                (request.method.encode(), request.path.encode(), request.body)
+            )
+        ).hexdigest()
+        with transaction.atomic():
+            record, _ = IdempotencyKey.objects.get_or_create(
+                user=request.user,
+                key=key,
+                defaults={"request_hash": request_hash},
+            )
+            record = IdempotencyKey.objects.select_for_update().get(
+                pk=record.pk
+            )
+            expired = record.created_at < timezone.now() - timedelta(
+                seconds=settings.IDEMPOTENCY_KEY_TTL
+            )
+            if expired:
+                record.request_hash = request_hash
+                record.response_status = None
+                record.created_at = timezone.now()
+            elif record.request_hash != request_hash:
+                return Response(
+                    {
+                        "detail": f"{IDEMPOTENCY_HEADER} was already used "
+                        f"for a different request."
+                    },
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            elif record.response_status is not None:
+                return Response(
+                    record.response_body,
+                    status=record.response_status,
+                    headers={
+                        **record.response_headers,
+                        "Idempotent-Replayed": "true",
+                    },
+                )
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_202_ACCEPTED:
+                record.delete()
+                return response
+            record.response_status = response.status_code
+            record.response_body = getattr(response, "data", None)
+            record.response_headers = {
+                header: response[header]
+                for header in REPLAYED_HEADERS
+                if response.has_header(header)
+            }
+            record.save()
+        return response
+
+    return wrapper
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from borrowing.archive import ARCHIVE_BATCH_SIZE, archive_borrowings
+
+
+class Command(BaseCommand):
+    """Django command to move old returned borrowings to the archive"""
+
+    help = (  # noqa: VNE003
+        "Move borrowings returned more than --older-than days ago, with "
+        "their payments, to the archive tables in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.BORROWING_ARCHIVE_AFTER_DAYS,
+            help="Age in days of the return date.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=ARCHIVE_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        returned_before = timezone.now().date() - timedelta(
+            options["older_than"]
+        )
+        started = time.perf_counter()
+        borrowings, payments = archive_borrowings(
+            returned_before, options["batch_size"]
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Archived {borrowings} borrowings and {payments} payments "
+            f"returned before {returned_before} in {elapsed:.2f}s."
+        )
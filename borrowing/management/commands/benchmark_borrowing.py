@@ -0,0 +1,215 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import Borrowing
+
+
+class Command(BaseCommand):
+    """Django command to benchmark concurrent borrows of a single book"""
+
+    help = (  # noqa: VNE003
+        "Run many concurrent clients borrowing and returning the same book "
+        "and report throughput and inventory consistency."
+    )
+    strategies = {
+        "conditional": ("_borrow_conditional", "_return_conditional"),
+        "read-modify-write": (
+            "_borrow_read_modify_write",
+            "_return_read_modify_write",
+        ),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=20)
+        parser.add_argument("--copies", type=int, default=500)
+        parser.add_argument(
+            "--attempts",
+            type=int,
+            default=50,
+            help="Borrow attempts made by every client.",
+        )
+        parser.add_argument(
+            "--returns",
+            action="store_true",
+            help="Return every successful borrowing right away.",
+        )
+        parser.add_argument(
+            "--racing-returns",
+            action="store_true",
+            help="Then have every client return every borrowing at once.",
+        )
+        parser.add_argument(
+            "--strategy",
+            choices=tuple(self.strategies),
+            default="conditional",
+            help="read-modify-write reproduces the old book.save() and "
+            "borrowing.save() paths.",
+        )
+
+    def handle(self, *args, **options):
+        user, _ = get_user_model().objects.get_or_create(
+            email="benchmark-borrowing@library.local"
+        )
+        book = Book.objects.create(
+            title=f"Benchmark {time.time_ns()}",
+            author="Benchmark",
+            cover=Book.CoverChoices.SOFT,
+            inventory=options["copies"],
+            daily_fee="1.00",
+        )
+        borrow, return_ = (
+            getattr(self, name)
+            for name in self.strategies[options["strategy"]]
+        )
+
+        results = {
+            "borrowed": 0,
+            "rejected": 0,
+            "returned": 0,
+            "return_rejected": 0,
+            "errors": 0,
+        }
+        lock = threading.Lock()
+
+        def borrow_client(counts):
+            for _ in range(options["attempts"]):
+                try:
+                    borrowing = borrow(book.pk, user)
+                except Exception:
+                    counts["errors"] += 1
+                    continue
+                if borrowing is None:
+                    counts["rejected"] += 1
+                    continue
+                counts["borrowed"] += 1
+                if options["returns"]:
+                    self._count_return(return_, borrowing, counts)
+
+        def return_client(counts):
+            for borrowing in Borrowing.objects.filter(
+                book=book, actual_return_date__isnull=True
+            ):
+                self._count_return(return_, borrowing, counts)
+
+        elapsed = self._run(options["clients"], borrow_client, results, lock)
+        if options["racing_returns"]:
+            elapsed += self._run(
+                options["clients"], return_client, results, lock
+            )
+
+        book.refresh_from_db()
+        active = Borrowing.objects.filter(
+            book=book, actual_return_date__isnull=True
+        ).count()
+        expected = options["copies"] - active
+        operations = sum(results.values())
+
+        self.stdout.write(
+            f"strategy={options['strategy']} clients={options['clients']} "
+            f"copies={options['copies']}"
+        )
+        self.stdout.write(
+            f"borrowed={results['borrowed']} rejected={results['rejected']} "
+            f"returned={results['returned']} "
+            f"return_rejected={results['return_rejected']} "
+            f"errors={results['errors']} "
+            f"elapsed={elapsed:.2f}s "
+            f"throughput={operations / elapsed:.0f} ops/s"
+        )
+        self.stdout.write(
+            f"inventory={book.inventory} active_borrowings={active} "
+            f"expected_inventory={expected}"
+        )
+        if book.inventory == expected:
+            self.stdout.write(self.style.SUCCESS("Inventory is consistent."))
+        else:
+            self.stdout.write(self.style.ERROR("Inventory is inconsistent!"))
+
+        book.delete()
+
+    @staticmethod
+    def _borrow_conditional(book_id, user):
+        with transaction.atomic():
+            if not Book.objects.filter(pk=book_id).take_copy():
+                return None
+            return Borrowing.objects.create(
+                book_id=book_id,
+                user=user,
+                expected_return_date=timezone.now().date() + timedelta(7),
+            )
+
+    @staticmethod
+    def _borrow_read_modify_write(book_id, user):
+        with transaction.atomic():
+            book = Book.objects.get(pk=book_id)
+            if book.inventory == 0:
+                return None
+            borrowing = Borrowing.objects.create(
+                book=book,
+                user=user,
+                expected_return_date=timezone.now().date() + timedelta(7),
+            )
+            book.inventory -= 1
+            book.save()
+            return borrowing
+
+    @staticmethod
+    def _run(clients, work, results, lock):
+        """Run the work in concurrent clients, return the elapsed seconds"""
+        barrier = threading.Barrier(clients)
+
+        def client():
+            counts = dict.fromkeys(results, 0)
+            barrier.wait()
+            try:
+                work(counts)
+            finally:
+                connection.close()
+                with lock:
+                    for key, value in counts.items():
+                        results[key] += value
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    @staticmethod
+    def _count_return(return_, borrowing, counts):
+        try:
+            returned = return_(borrowing)
+        except Exception:
+            counts["errors"] += 1
+            return
+        counts["returned" if returned else "return_rejected"] += 1
+
+    @staticmethod
+    def _return_conditional(borrowing):
+        with transaction.atomic():
+            if not Borrowing.objects.filter(
+                pk=borrowing.pk, actual_return_date__isnull=True
+            ).update(actual_return_date=timezone.now().date()):
+                return False
+            Book.objects.filter(pk=borrowing.book_id).return_copy()
+            return True
+
+    @staticmethod
+    def _return_read_modify_write(borrowing):
+        with transaction.atomic():
+            borrowing = Borrowing.objects.get(pk=borrowing.pk)
+            if borrowing.actual_return_date:
+                return False
+            Book.objects.filter(pk=borrowing.book_id).return_copy()
+            borrowing.actual_return_date = timezone.now().date()
+            borrowing.save(update_fields=["actual_return_date"])
+            return True
@@ -0,0 +1,194 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.db.models import (
+    DateField,
+    DateTimeField,
+    DurationField,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    Value,
+)
+from django.db.models.functions import Cast, Mod
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import Borrowing
+from payment.models import Payment
+
+BENCHMARKED_INDEXES = {
+    Borrowing: (
+        "borrowing_user_date_id_idx",
+        "borrowing_active_user_idx",
+        "borrowing_active_id_idx",
+    ),
+    Payment: (
+        "payment_pending_borrowing_idx",
+        "payment_status_type_id_idx",
+        "payment_created_id_idx",
+    ),
+}
+
+
+class Command(BaseCommand):
+    """Django command to compare borrowing and payment query plans"""
+
+    help = (  # noqa: VNE003
+        "Seed borrowings and payments, then show the plan and latency of "
+        "the API queries with and without the access pattern indexes. "
+        "Everything runs in one transaction that is rolled back; dropping "
+        "the indexes locks the tables, so use a database without traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--borrowings", type=int, default=200_000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.perf_counter()
+            user, borrowing = self._seed(options)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            self.stdout.write(
+                f"Seeded {options['borrowings']} borrowings and payments "
+                f"in {time.perf_counter() - started:.1f}s."
+            )
+
+            queries = self._queries(user, borrowing)
+            after = self._measure(queries, options["repeat"])
+
+            savepoint = transaction.savepoint()
+            with connection.schema_editor() as editor:
+                for model, names in BENCHMARKED_INDEXES.items():
+                    for index in model._meta.indexes:
+                        if index.name in names:
+                            editor.remove_index(model, index)
+            before = self._measure(queries, options["repeat"])
+            transaction.savepoint_rollback(savepoint)
+
+            for name in queries:
+                self.stdout.write(
+                    self.style.MIGRATE_HEADING(
+                        f"{name}: {before[name][0]:.2f}ms -> "
+                        f"{after[name][0]:.2f}ms"
+                    )
+                )
+                self.stdout.write(f"before:\n{before[name][1]}")
+                self.stdout.write(f"after:\n{after[name][1]}")
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _seed(options):
+        today = timezone.now().date()
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(
+                email=f"benchmark-queries-{number}@library.local",
+                password="!",
+            )
+            for number in range(options["users"])
+        )
+        book = Book.objects.create(
+            title=f"Benchmark {time.time_ns()}",
+            author="Benchmark",
+            cover=Book.CoverChoices.SOFT,
+            inventory=options["borrowings"],
+            daily_fee="1.00",
+        )
+
+        total, batch_size = options["borrowings"], options["batch_size"]
+        for start in range(0, total, batch_size):
+            numbers = range(start, min(start + batch_size, total))
+            borrowings = Borrowing.objects.bulk_create(
+                Borrowing(
+                    book=book,
+                    user=users[number % len(users)],
+                    expected_return_date=today + timedelta(14),
+                    actual_return_date=(
+                        today + timedelta(10) if number % 20 else None
+                    ),
+                    daily_fee=book.daily_fee,
+                    price="15.00",
+                )
+                for number in numbers
+            )
+            Payment.objects.bulk_create(
+                Payment(
+                    borrowing=borrowing,
+                    status="PENDING" if number % 100 == 0 else "PAID",
+                    money_to_pay=borrowing.price,
+                )
+                for number, borrowing in zip(numbers, borrowings)
+            )
+
+        days = Cast(Mod(F("id"), 365), IntegerField())
+        Borrowing.objects.filter(book=book).update(
+            borrow_date=ExpressionWrapper(
+                F("borrow_date") - days, output_field=DateField()
+            ),
+            expected_return_date=ExpressionWrapper(
+                F("expected_return_date") - days, output_field=DateField()
+            ),
+            actual_return_date=ExpressionWrapper(
+                F("actual_return_date") - days, output_field=DateField()
+            ),
+        )
+        Payment.objects.filter(borrowing__book=book).update(
+            created_at=ExpressionWrapper(
+                F("created_at")
+                - days * Value(timedelta(1), output_field=DurationField()),
+                output_field=DateTimeField(),
+            )
+        )
+        return users[len(users) // 2], borrowings[-1]
+
+    @staticmethod
+    def _queries(user, borrowing):
+        ordering = ("-borrow_date", "-id")
+        borrowings = Borrowing.objects.filter(user=user).order_by(*ordering)
+        return {
+            "user borrowings": borrowings[:20],
+            "active user borrowings": borrowings.filter(
+                actual_return_date__isnull=True
+            )[:20],
+            "overdue borrowings": Borrowing.objects.filter(
+                actual_return_date__isnull=True,
+                expected_return_date__lt=timezone.now().date(),
+            ).order_by("pk")[:1000],
+            "user payments": Payment.objects.filter(
+                borrowing__user=user
+            ).order_by("-id")[:20],
+            "pending payment of a borrowing": Payment.objects.filter(
+                borrowing=borrowing, status="PENDING", type="PAYMENT"
+            )[:1],
+            "pending fines": Payment.objects.filter(
+                status="PENDING", type="FINE"
+            ).order_by("-id")[:20],
+            "payments of a day": Payment.objects.filter(
+                created_at__gte=timezone.now() - timedelta(181),
+                created_at__lt=timezone.now() - timedelta(180),
+            ).order_by("-id")[:20],
+        }
+
+    @staticmethod
+    def _measure(queries, repeat):
+        results = {}
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = (
+                statistics.median(timings),
+                queryset.explain(costs=False),
+            )
+        return results
@@ -0,0 +1,60 @@
+from datetime import date
+
+from django.core.management import BaseCommand
+
+from library_service.exports import (
+    EXPORT_CHUNK_SIZE,
+    EXPORT_OUTPUTS,
+    EXPORTS,
+    export_rows,
+    render_export,
+)
+
+
+class Command(BaseCommand):
+    """Django command to stream books, borrowings or payments to a file"""
+
+    help = (  # noqa: VNE003
+        "Export books, borrowings (with price and fine) or "
+        "payments as CSV or NDJSON through a server-side cursor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", choices=tuple(EXPORTS))
+        parser.add_argument("--output", choices=EXPORT_OUTPUTS, default="csv")
+        parser.add_argument(
+            "--file", help="Write to this file instead of stdout."
+        )
+        parser.add_argument(
+            "--date-from",
+            type=date.fromisoformat,
+            help="First borrow date to export (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--date-to",
+            type=date.fromisoformat,
+            help="Last borrow date to export (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=EXPORT_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        rows = export_rows(
+            options["name"],
+            options["date_from"],
+            options["date_to"],
+            options["chunk_size"],
+        )
+        chunks = render_export(
+            options["name"], options["output"], rows, options["chunk_size"]
+        )
+
+        if options["file"] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["file"], "w", newline="") as export_file:
+            for chunk in chunks:
+                export_file.write(chunk)
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from borrowing.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    """Django command to delete Idempotency-Key responses past their TTL"""
+
+    help = (  # noqa: VNE003
+        "Delete stored Idempotency-Key responses older than "
+        "IDEMPOTENCY_KEY_TTL seconds."
+    )
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(
+            created_at__lt=timezone.now()
+            - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        ).delete()
+        self.stdout.write(f"Deleted {deleted} idempotency keys.")
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+BACKFILL_FEE_SNAPSHOT = """
+UPDATE borrowing_borrowing AS borrowing
+SET daily_fee = book.daily_fee,
+    price = book.daily_fee
+        * (borrowing.expected_return_date - borrowing.borrow_date + 1)
+FROM book_book AS book
+WHERE book.id = borrowing.book_id AND borrowing.daily_fee IS NULL;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0004_borrowing_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="borrowing",
+            name="daily_fee",
+            field=models.DecimalField(
+                decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="borrowing",
+            name="price",
+            field=models.DecimalField(
+                decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.RunSQL(BACKFILL_FEE_SNAPSHOT, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name="borrowing",
+            name="daily_fee",
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name="borrowing",
+            name="price",
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+    ]
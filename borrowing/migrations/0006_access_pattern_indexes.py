@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:37
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0005_borrowing_fee_snapshot"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["user", "-borrow_date", "-id"],
+                name="borrowing_user_date_id_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["user", "-borrow_date", "-id"],
+                name="borrowing_active_user_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["id"],
+                include=["expected_return_date"],
+                name="borrowing_active_id_idx",
+            ),
+        ),
+    ]
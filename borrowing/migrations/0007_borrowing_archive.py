@@ -0,0 +1,91 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+HISTORY_COLUMNS = """
+    id, borrow_date, expected_return_date, actual_return_date,
+    book_id, user_id, daily_fee, price, updated_at
+"""
+
+CREATE_HISTORY_VIEW = f"""
+CREATE VIEW borrowing_history AS
+SELECT {HISTORY_COLUMNS}, false AS archived FROM borrowing_borrowing
+UNION ALL
+SELECT {HISTORY_COLUMNS}, true AS archived FROM borrowing_archivedborrowing;
+"""
+
+DROP_HISTORY_VIEW = "DROP VIEW borrowing_history;"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0004_book_updated_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("borrowing", "0006_access_pattern_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedBorrowing",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("borrow_date", models.DateField()),
+                ("expected_return_date", models.DateField()),
+                ("actual_return_date", models.DateField()),
+                ("daily_fee", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("updated_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField()),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_borrowings",
+                        to="book.book",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_borrowings",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-borrow_date"],
+                "indexes": [
+                    models.Index(
+                        fields=["-borrow_date", "-id"],
+                        name="archived_borrow_date_id_idx",
+                    ),
+                    models.Index(
+                        fields=["user", "-borrow_date", "-id"],
+                        name="archived_user_date_id_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunSQL(CREATE_HISTORY_VIEW, DROP_HISTORY_VIEW),
+        migrations.CreateModel(
+            name="BorrowingHistory",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("borrow_date", models.DateField()),
+                ("expected_return_date", models.DateField()),
+                ("actual_return_date", models.DateField(null=True)),
+                ("daily_fee", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("updated_at", models.DateTimeField()),
+                ("archived", models.BooleanField()),
+            ],
+            options={
+                "db_table": "borrowing_history",
+                "ordering": ["-borrow_date"],
+                "managed": False,
+            },
+        ),
+    ]
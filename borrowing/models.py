@@ -1,13 +1,67 @@
+import datetime
+
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db.models import Q, F
+from django.db.models import (
+    Case,
+    DecimalField,
+    F,
+    Func,
+    IntegerField,
+    Q,
+    Value,
+    When,
+)
+from django.utils import timezone
 
 from book.models import Book
+from library_service.querysets import TimestampedQuerySet
 
 
 FINE_MULTIPLIER = 2
 
 
+class DaysBetween(Func):
+    """Whole days from the second date to the first"""
+
+    template = "(%(expressions)s)"
+    arg_joiner = " - "
+    output_field = IntegerField()
+
+
+class BorrowingQuerySet(TimestampedQuerySet):
+    def with_fine(self):
+        """
+        Annotate fine_amount computed by the database from the fee snapshot.
+
+        The fine of a borrowing that is still out keeps running until
+        today, so it is the fine it would get if returned now.
+        """
+        today = Value(timezone.now().date())
+        return self.annotate(
+            fine_amount=Case(
+                When(
+                    actual_return_date__gt=F("expected_return_date"),
+                    then=F("daily_fee")
+                    * DaysBetween(
+                        "actual_return_date", "expected_return_date"
+                    )
+                    * FINE_MULTIPLIER,
+                ),
+                When(
+                    actual_return_date__isnull=True,
+                    expected_return_date__lt=today,
+                    then=F("daily_fee")
+                    * DaysBetween(today, "expected_return_date")
+                    * FINE_MULTIPLIER,
+                ),
+                default=Value(0),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
+
+
 class Borrowing(models.Model):
     borrow_date = models.DateField(auto_now_add=True)
     expected_return_date = models.DateField()
@@ -18,9 +72,35 @@ class Borrowing(models.Model):
     user = models.ForeignKey(
         get_user_model(), on_delete=models.CASCADE, related_name="borrowings"
     )
+    daily_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BorrowingQuerySet.as_manager()
 
     class Meta:
         ordering = ["-borrow_date"]
+        indexes = [
+            models.Index(
+                fields=["-borrow_date", "-id"],
+                name="borrowing_borrow_date_id_idx",
+            ),
+            models.Index(
+                fields=["user", "-borrow_date", "-id"],
+                name="borrowing_user_date_id_idx",
+            ),
+            models.Index(
+                fields=["user", "-borrow_date", "-id"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrowing_active_user_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                include=["expected_return_date"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrowing_active_id_idx",
+            ),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=Q(expected_return_date__gte=F("borrow_date"))
@@ -29,10 +109,21 @@ class Borrowing(models.Model):
             )
         ]
 
-    @property
-    def price(self):
-        return self.book.daily_fee * (
-            (self.expected_return_date - self.borrow_date).days + 1
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.set_price()
+        super().save(*args, **kwargs)
+
+    def set_price(self):
+        """Snapshot the daily fee of the book and the price it gives"""
+        if self.daily_fee is None:
+            self.daily_fee = self.book.daily_fee
+        for name in ("daily_fee", "expected_return_date"):
+            field = self._meta.get_field(name)
+            setattr(self, name, field.to_python(getattr(self, name)))
+        borrow_date = self.borrow_date or datetime.date.today()
+        self.price = self.daily_fee * (
+            (self.expected_return_date - borrow_date).days + 1
         )
 
     @property
@@ -43,7 +134,95 @@ class Borrowing(models.Model):
         ):
             return (
                 (self.actual_return_date - self.expected_return_date).days
-                * self.book.daily_fee
+                * self.daily_fee
                 * FINE_MULTIPLIER
             )
         return 0
+
+
+class ArchivedBorrowing(models.Model):
+    """Returned borrowing moved out of the live table by archive_borrowings"""
+
+    id = models.BigIntegerField(primary_key=True)  # noqa: VNE003
+    borrow_date = models.DateField()
+    expected_return_date = models.DateField()
+    actual_return_date = models.DateField()
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="archived_borrowings"
+    )
+    user = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        related_name="archived_borrowings",
+    )
+    daily_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["-borrow_date"]
+        indexes = [
+            models.Index(
+                fields=["-borrow_date", "-id"],
+                name="archived_borrow_date_id_idx",
+            ),
+            models.Index(
+                fields=["user", "-borrow_date", "-id"],
+                name="archived_user_date_id_idx",
+            ),
+        ]
+
+
+class BorrowingHistory(models.Model):
+    """
+    Live and archived borrowings, read through the borrowing_history view.
+
+    The view is a UNION ALL of both tables and has to be recreated when
+    their columns change.
+    """
+
+    id = models.BigIntegerField(primary_key=True)  # noqa: VNE003
+    borrow_date = models.DateField()
+    expected_return_date = models.DateField()
+    actual_return_date = models.DateField(null=True)
+    book = models.ForeignKey(
+        Book, on_delete=models.DO_NOTHING, related_name="+"
+    )
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.DO_NOTHING, related_name="+"
+    )
+    daily_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField()
+    archived = models.BooleanField()
+
+    objects = BorrowingQuerySet.as_manager()
+
+    class Meta:
+        managed = False
+        db_table = "borrowing_history"
+        ordering = ["-borrow_date"]
+
+
+class IdempotencyKey(models.Model):
+    """Response of a borrowing request sent with an Idempotency-Key header"""
+
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        related_name="idempotency_keys",
+    )
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    response_headers = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="unique_user_idempotency_key"
+            )
+        ]
@@ -1,16 +1,27 @@
-import stripe
+import uuid
+from collections import Counter
+
 from django.db import transaction
+from django.db.models import Case, F, Value, When
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import serializers
 
+from book.models import Book
 from book.serializers import BookSerializer
-from borrowing.models import Borrowing
+from borrowing.models import Borrowing, BorrowingHistory
 from payment.models import Payment
 from payment.serializers import PaymentSerializer
-from payment.views import create_checkout_session
+from payment.services import (
+    bill_fines,
+    enqueue_checkout,
+    enqueue_fine_checkouts,
+)
 from user.serializers import UserSerializer
 
+BULK_BORROW_LIMIT = 20
+BULK_RETURN_LIMIT = 500
+
 
 class BorrowingListSerializer(serializers.ModelSerializer):
     book_title = serializers.CharField(source="book.title", read_only=True)
@@ -28,11 +39,13 @@ class BorrowingListSerializer(serializers.ModelSerializer):
             "borrow_date",
             "expected_return_date",
             "actual_return_date",
+            "daily_fee",
+            "price",
             "book_title",
             "user_email",
             "payments",
         )
-        read_only_fields = ("actual_return_date",)
+        read_only_fields = ("actual_return_date", "daily_fee", "price")
 
 
 class BorrowingDetailSerializer(serializers.ModelSerializer):
@@ -47,10 +60,43 @@ class BorrowingDetailSerializer(serializers.ModelSerializer):
             "borrow_date",
             "actual_return_date",
             "expected_return_date",
+            "daily_fee",
+            "price",
             "book",
             "user",
             "payments",
         )
+        read_only_fields = ("daily_fee", "price")
+
+
+class BorrowingHistorySerializer(serializers.ModelSerializer):
+    book_title = serializers.CharField(source="book.title", read_only=True)
+    user_email = serializers.CharField(source="user.email", read_only=True)
+
+    class Meta:
+        model = BorrowingHistory
+        fields = (
+            "id",
+            "borrow_date",
+            "expected_return_date",
+            "actual_return_date",
+            "daily_fee",
+            "price",
+            "book_title",
+            "user_email",
+            "archived",
+        )
+
+
+class BorrowingTotalsSerializer(serializers.Serializer):
+    borrowings = serializers.IntegerField()
+    active = serializers.IntegerField()
+    overdue = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=None, decimal_places=2)
+    fines = serializers.DecimalField(max_digits=None, decimal_places=2)
+    running_fines = serializers.DecimalField(
+        max_digits=None, decimal_places=2
+    )
 
 
 class BorrowingCreateSerializer(serializers.ModelSerializer):
@@ -67,14 +113,106 @@ class BorrowingCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         with transaction.atomic():
             book = validated_data.get("book")
+            if not Book.objects.filter(pk=book.pk).take_copy():
+                raise serializers.ValidationError("The book is out of stock.")
             borrowing = Borrowing.objects.create(**validated_data)
-            book.inventory -= 1
-            book.save()
             request = self.context["request"]
             create_payment(request, borrowing, borrowing.price, "PAYMENT")
             return borrowing
 
 
+class BorrowingBulkItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Borrowing
+        fields = (
+            "id",
+            "book",
+            "borrow_date",
+            "expected_return_date",
+            "daily_fee",
+            "price",
+        )
+
+
+class BorrowingBulkCreateSerializer(serializers.Serializer):
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BULK_BORROW_LIMIT,
+        write_only=True,
+    )
+    expected_return_date = serializers.DateField(write_only=True)
+    borrowings = BorrowingBulkItemSerializer(many=True, read_only=True)
+    checkout = serializers.URLField(read_only=True)
+
+    def validate_books(self, books):
+        if len(set(books)) != len(books):
+            raise serializers.ValidationError("Books must not repeat.")
+        return books
+
+    def validate_expected_return_date(self, expected_return_date):
+        if expected_return_date < timezone.now().date():
+            raise serializers.ValidationError(
+                "The return date must not be in the past."
+            )
+        return expected_return_date
+
+    def create(self, validated_data):
+        """Borrow every book or none, paid through one checkout session"""
+        book_ids = validated_data["books"]
+        expected_return_date = validated_data["expected_return_date"]
+        with transaction.atomic():
+            books = list(
+                Book.objects.select_for_update()
+                .filter(pk__in=book_ids)
+                .order_by("pk")
+            )
+            if missing := set(book_ids) - {book.pk for book in books}:
+                raise serializers.ValidationError(
+                    {"books": f"Books not found: {sorted(missing)}."}
+                )
+            out_of_stock = [book.title for book in books if not book.inventory]
+            if out_of_stock:
+                raise serializers.ValidationError(
+                    {"books": f"Out of stock: {', '.join(out_of_stock)}."}
+                )
+            Book.objects.filter(pk__in=book_ids).take_copy()
+
+            borrowings = [
+                Borrowing(
+                    book=book,
+                    user=validated_data["user"],
+                    expected_return_date=expected_return_date,
+                )
+                for book in books
+            ]
+            for borrowing in borrowings:
+                borrowing.set_price()
+            Borrowing.objects.bulk_create(borrowings)
+
+            checkout_group = uuid.uuid4()
+            payments = Payment.objects.bulk_create(
+                Payment(
+                    status="PENDING",
+                    type="PAYMENT",
+                    borrowing=borrowing,
+                    money_to_pay=borrowing.price,
+                    checkout_group=checkout_group,
+                )
+                for borrowing in borrowings
+            )
+            request = self.context["request"]
+            enqueue_checkout(payments[0], payment_url(request, payments[0]))
+
+        checkout_url = reverse(
+            "payment:payment-checkout", kwargs={"pk": payments[0].id}
+        )
+        return {
+            "borrowings": borrowings,
+            "checkout": request.build_absolute_uri(checkout_url),
+        }
+
+
 class BorrowingReturnSerializer(serializers.ModelSerializer):
     book = BookSerializer(many=False, read_only=True)
     user = UserSerializer(many=False, read_only=True)
@@ -105,17 +243,136 @@ class BorrowingReturnSerializer(serializers.ModelSerializer):
         return data
 
     def save(self, **kwargs):
+        """
+        Return the borrowing once: the return date is set only on a
+        borrowing that is still out, so of two racing returns the second
+        one changes no row and is rejected before it touches the book.
+        """
+        borrowing = self.instance
+        today = timezone.now().date()
         with transaction.atomic():
-            self.instance.actual_return_date = timezone.now().date()
-            book = self.instance.book
+            returned = Borrowing.objects.filter(
+                pk=borrowing.pk, actual_return_date__isnull=True
+            ).update(actual_return_date=today)
+            if not returned:
+                raise serializers.ValidationError(
+                    "This borrowing has already been returned."
+                )
+            borrowing.actual_return_date = today
             request = self.context["request"]
-            book.inventory += 1
-            book.save()
+            Book.objects.filter(pk=borrowing.book_id).return_copy()
 
-            if self.instance.actual_return_date > self.instance.expected_return_date:
-                create_payment(request, self.instance, self.instance.overdue, "FINE")
+            if borrowing.actual_return_date > borrowing.expected_return_date:
+                borrowings = Borrowing.objects.filter(pk=borrowing.pk)
+                bill_fines(borrowings)
+                enqueue_fine_checkouts(
+                    borrowings, lambda fine: payment_url(request, fine)
+                )
 
-            return super().save(**kwargs)
+            return borrowing
+
+
+class BorrowingBulkReturnResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()  # noqa: VNE003
+    result = serializers.CharField()
+    fine = serializers.DecimalField(
+        max_digits=None, decimal_places=2, allow_null=True
+    )
+
+
+class BorrowingBulkReturnSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BULK_RETURN_LIMIT,
+    )
+
+    def save(self, **kwargs):
+        """
+        Return every returnable borrowing with set-based updates and bill
+        the fines of late ones, return a result per requested borrowing.
+        """
+        request = self.context["request"]
+        borrowing_ids = list(dict.fromkeys(self.validated_data["borrowings"]))
+        today = timezone.now().date()
+        with transaction.atomic():
+            borrowings = {
+                borrowing["pk"]: borrowing
+                for borrowing in Borrowing.objects.select_for_update()
+                .filter(pk__in=borrowing_ids)
+                .order_by("pk")
+                .values(
+                    "pk",
+                    "book_id",
+                    "expected_return_date",
+                    "actual_return_date",
+                )
+            }
+            unpaid = set(
+                Payment.objects.filter(
+                    borrowing_id__in=borrowings,
+                    status="PENDING",
+                    type="PAYMENT",
+                ).values_list("borrowing_id", flat=True)
+            )
+            results = {}
+            for borrowing_id in borrowing_ids:
+                borrowing = borrowings.get(borrowing_id)
+                if borrowing is None:
+                    results[borrowing_id] = "not_found"
+                elif borrowing["actual_return_date"]:
+                    results[borrowing_id] = "already_returned"
+                elif borrowing_id in unpaid:
+                    results[borrowing_id] = "payment_pending"
+                else:
+                    results[borrowing_id] = "returned"
+            returned = [
+                borrowing_id
+                for borrowing_id, result in results.items()
+                if result == "returned"
+            ]
+
+            fines = {}
+            if returned:
+                Borrowing.objects.filter(pk__in=returned).update(
+                    actual_return_date=today
+                )
+                copies = Counter(
+                    borrowings[borrowing_id]["book_id"]
+                    for borrowing_id in returned
+                )
+                Book.objects.filter(pk__in=copies).update(
+                    inventory=F("inventory")
+                    + Case(
+                        *(
+                            When(pk=book_id, then=Value(count))
+                            for book_id, count in copies.items()
+                        ),
+                        default=Value(0),
+                    )
+                )
+
+                late = [
+                    borrowing_id
+                    for borrowing_id in returned
+                    if borrowings[borrowing_id]["expected_return_date"] < today
+                ]
+                if late:
+                    late_borrowings = Borrowing.objects.filter(pk__in=late)
+                    bill_fines(late_borrowings)
+                    fines = enqueue_fine_checkouts(
+                        late_borrowings,
+                        lambda fine: payment_url(request, fine),
+                    )
+
+        return [
+            {
+                "id": borrowing_id,
+                "result": result,
+                "fine": fines.get(borrowing_id),
+            }
+            for borrowing_id, result in results.items()
+        ]
 
 
 def create_payment(request, borrowing: Borrowing, money_amount: int, payment_type: str):
@@ -126,17 +383,10 @@ def create_payment(request, borrowing: Borrowing, money_amount: int, payment_typ
         money_to_pay=money_amount,
     )
 
-    base_url = request.build_absolute_uri(
-        reverse("payment:payment-detail", kwargs={"pk": payment.id})
-    )
-
-    money_amount = int(money_amount * 100)
-
-    session_data = create_checkout_session(base_url, borrowing.id, money_amount)
+    enqueue_checkout(payment, payment_url(request, payment))
 
-    if session_data.get("error", None):
-        raise stripe.error.APIError
 
-    payment.session_url = session_data["session_url"]
-    payment.session_id = session_data["session_id"]
-    payment.save()
+def payment_url(request, payment: Payment) -> str:
+    return request.build_absolute_uri(
+        reverse("payment:payment-detail", kwargs={"pk": payment.id})
+    )
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borrowing.models import Borrowing
+from library_service.versions import invalidate, model_version
+
+
+@receiver(post_save, sender=Borrowing)
+@receiver(post_delete, sender=Borrowing)
+def invalidate_borrowings_on_change(sender, **kwargs):
+    invalidate(model_version(sender))
@@ -1,4 +1,7 @@
+from datetime import date, timedelta
+
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 from book.models import Book
 from borrowing.models import Borrowing
@@ -20,9 +23,13 @@ def create_user(**params):
     return get_user_model().objects.create_user(**params)
 
 
+def days_from_today(days: int) -> date:
+    return timezone.now().date() + timedelta(days=days)
+
+
 def sample_borrowing(book, user, **params):
     defaults = {
-        "expected_return_date": "2025-10-12",
+        "expected_return_date": days_from_today(10),
         "book": book,
         "user": user,
     }
@@ -1,13 +1,44 @@
+import csv
+import io
+import json
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APIClient
 
 from book.models import Book
-from borrowing.serializers import BorrowingListSerializer
-from borrowing.tests import create_user, sample_book, sample_borrowing
+from borrowing.archive import archive_borrowings
+from borrowing.models import ArchivedBorrowing, Borrowing, IdempotencyKey
+from borrowing.serializers import (
+    BorrowingCreateSerializer,
+    BorrowingListSerializer,
+    BorrowingReturnSerializer,
+)
+from borrowing.tests import (
+    create_user,
+    days_from_today,
+    sample_book,
+    sample_borrowing,
+)
+from payment.models import ArchivedPayment, Payment, PaymentOutbox
+from payment.services import process_checkout_outbox
+from payment.tests import sample_payment, stripe_api, stripe_requests
 
 BORROWING_URL = reverse("borrowing:borrowing-list")
+BULK_URL = reverse("borrowing:borrowing-bulk-borrow")
+BULK_RETURN_URL = reverse("borrowing:borrowing-bulk-return")
+BOOK_URL = reverse("book:book-list")
+EXPORT_URL = reverse("borrowing:borrowing-export")
+TOTALS_URL = reverse("borrowing:borrowing-totals")
 PAYMENTS_URL = reverse("payment:payment-list")
 
 
@@ -15,6 +46,10 @@ def return_url(borrowing_id):
     return reverse("borrowing:borrowing-return-book", args=[borrowing_id])
 
 
+def detail_url(borrowing_id):
+    return reverse("borrowing:borrowing-detail", args=[borrowing_id])
+
+
 class UnauthenticatedBorrowingsApiTest(TestCase):
     def setUp(self) -> None:
         self.client = APIClient()
@@ -49,14 +84,14 @@ class AuthenticatedBorrowingsApiTest(TestCase):
         serializer1 = BorrowingListSerializer(user_borrowing)
         serializer2 = BorrowingListSerializer(second_user_borrowing)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data["results"])
+        self.assertNotIn(serializer2.data, res.data["results"])
 
     def test_filtering_is_active(self):
         book = sample_book()
         activ_borrowing = sample_borrowing(book, self.user)
         non_active_borrowing = sample_borrowing(
-            book, self.user, actual_return_date="2025-10-12"
+            book, self.user, actual_return_date=days_from_today(0)
         )
 
         res = self.client.get(BORROWING_URL, {"is_active": True})
@@ -64,8 +99,8 @@ class AuthenticatedBorrowingsApiTest(TestCase):
         serializer1 = BorrowingListSerializer(activ_borrowing)
         serializer2 = BorrowingListSerializer(non_active_borrowing)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data["results"])
+        self.assertNotIn(serializer2.data, res.data["results"])
 
 
 class AdminBorrowingApiTest(TestCase):
@@ -93,8 +128,8 @@ class AdminBorrowingApiTest(TestCase):
         serializer1 = BorrowingListSerializer(user_borrowing)
         serializer2 = BorrowingListSerializer(second_user_borrowing)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data["results"])
+        self.assertIn(serializer2.data, res.data["results"])
 
     def test_filtering_by_user_id(self):
         book = sample_book()
@@ -113,8 +148,24 @@ class AdminBorrowingApiTest(TestCase):
         serializer1 = BorrowingListSerializer(first_borrowing)
         serializer2 = BorrowingListSerializer(second_borrowing)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data["results"])
+        self.assertNotIn(serializer2.data, res.data["results"])
+
+    def test_list_paginated_by_borrow_date_and_id(self):
+        book = sample_book()
+        borrowings = [sample_borrowing(book, self.user) for _ in range(5)]
+
+        seen = []
+        url = f"{BORROWING_URL}?page_size=2"
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            seen.extend(borrowing["id"] for borrowing in res.data["results"])
+            url = res.data["next"]
+
+        self.assertEqual(
+            seen, sorted((borrowing.id for borrowing in borrowings), reverse=True)
+        )
 
 
 class ReturnFunctionalityTest(TestCase):
@@ -128,12 +179,26 @@ class ReturnFunctionalityTest(TestCase):
     def test_cannot_return_borrowing_twice(self):
         book = sample_book()
         borrowing = sample_borrowing(
-            book, self.user, actual_return_date="2025-10-12"
+            book, self.user, actual_return_date=days_from_today(0)
         )
         url_for_return = return_url(borrowing.id)
         res = self.client.post(url_for_return, {})
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_racing_return_changes_inventory_once(self):
+        book = sample_book(inventory=5)
+        borrowing = sample_borrowing(book, self.user)
+        request = self.client.post(return_url(borrowing.id), {}).wsgi_request
+        serializer = BorrowingReturnSerializer(
+            borrowing, data={}, partial=True, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        with self.assertRaises(ValidationError):
+            serializer.save()
+
+        self.assertEqual(Book.objects.get(id=book.id).inventory, 6)
+
     def test_add_book_inventory_on_returning(self):
         book = sample_book()
         borrowing = sample_borrowing(
@@ -147,3 +212,810 @@ class ReturnFunctionalityTest(TestCase):
         get_after_transaction = Book.objects.get(id=book.id)
 
         self.assertEqual(get_after_transaction.inventory, book.inventory + 1)
+
+
+class BorrowFunctionalityTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+
+    def test_take_book_inventory_on_borrowing(self):
+        book = sample_book(inventory=1)
+        payload = {"expected_return_date": days_from_today(10), "book": book.id}
+
+        res = self.client.post(BORROWING_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Book.objects.get(id=book.id).inventory, 0)
+
+        res = self.client.post(BORROWING_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Book.objects.get(id=book.id).inventory, 0)
+
+    def test_fee_and_price_snapshot_on_borrowing(self):
+        book = sample_book(daily_fee="1.50")
+        payload = {
+            "expected_return_date": timezone.now().date() + timedelta(3),
+            "book": book.id,
+        }
+
+        self.client.post(BORROWING_URL, payload)
+
+        borrowing = Borrowing.objects.get()
+        self.assertEqual(borrowing.daily_fee, Decimal("1.50"))
+        self.assertEqual(borrowing.price, Decimal("6.00"))
+        self.assertEqual(Payment.objects.get().money_to_pay, Decimal("6.00"))
+
+    def test_out_of_stock_after_validation(self):
+        book = sample_book(inventory=1)
+        serializer = BorrowingCreateSerializer(
+            data={"expected_return_date": days_from_today(10), "book": book.id}
+        )
+        serializer.is_valid(raise_exception=True)
+        Book.objects.filter(id=book.id).update(inventory=0)
+
+        with self.assertRaises(ValidationError):
+            serializer.save(user=self.user)
+
+        self.assertEqual(Book.objects.get(id=book.id).inventory, 0)
+        self.assertFalse(Borrowing.objects.exists())
+        self.assertFalse(PaymentOutbox.objects.exists())
+
+    def test_cached_book_inventory_follows_borrow_and_return(self):
+        cache.clear()
+        book = sample_book(inventory=2)
+        book_url = reverse("book:book-detail", args=[book.id])
+        self.assertEqual(self.client.get(book_url).data["inventory"], 2)
+        self.assertEqual(self.client.get(BOOK_URL).data["results"][0]["inventory"], 2)
+
+        self.client.post(
+            BORROWING_URL,
+            {"expected_return_date": days_from_today(10), "book": book.id},
+        )
+        self.assertEqual(self.client.get(book_url).data["inventory"], 1)
+        self.assertEqual(self.client.get(BOOK_URL).data["results"][0]["inventory"], 1)
+
+        Payment.objects.update(status="PAID")
+        self.client.post(return_url(Borrowing.objects.get().id))
+        self.assertEqual(self.client.get(book_url).data["inventory"], 2)
+
+
+class BulkBorrowTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        self.books = [
+            sample_book(title=f"Book {number}", daily_fee="1.00")
+            for number in range(3)
+        ]
+        self.payload = {
+            "books": [book.id for book in self.books],
+            "expected_return_date": timezone.now().date() + timedelta(4),
+        }
+
+    def test_bulk_borrow(self):
+        res = self.client.post(BULK_URL, self.payload, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data["borrowings"]), 3)
+        self.assertEqual(res.data["borrowings"][0]["price"], "5.00")
+        for book in self.books:
+            self.assertEqual(Book.objects.get(id=book.id).inventory, 9)
+        payments = Payment.objects.filter(borrowing__user=self.user)
+        self.assertEqual(payments.count(), 3)
+        self.assertEqual(
+            payments.values("checkout_group").distinct().count(), 1
+        )
+        self.assertEqual(PaymentOutbox.objects.count(), 1)
+        self.assertTrue(res.data["checkout"].endswith("/checkout/"))
+
+    def test_one_checkout_session_for_all_books(self):
+        self.client.post(BULK_URL, self.payload, format="json")
+
+        with stripe_api(
+            {
+                "POST /v1/products": [
+                    {"id": f"prod_{number}"} for number in range(3)
+                ],
+                "POST /v1/checkout/sessions": {
+                    "id": "bulk_session",
+                    "url": "https://checkout.stripe.com/c/pay/bulk_session",
+                },
+            }
+        ) as api:
+            self.assertEqual(process_checkout_outbox(), (1, 0))
+
+        [(params, _)] = stripe_requests(api, "POST /v1/checkout/sessions")
+        self.assertEqual(
+            [
+                params["name"]
+                for params, _ in stripe_requests(api, "POST /v1/products")
+            ],
+            ["Book 0", "Book 1", "Book 2"],
+        )
+        line_items = params["line_items"]
+        self.assertEqual(
+            [item["price_data"]["product"] for item in line_items],
+            ["prod_0", "prod_1", "prod_2"],
+        )
+        self.assertEqual(
+            set(Payment.objects.values_list("session_id", flat=True)),
+            {"bulk_session"},
+        )
+
+    def test_out_of_stock_book_fails_whole_request(self):
+        Book.objects.filter(id=self.books[1].id).update(inventory=0)
+
+        res = self.client.post(BULK_URL, self.payload, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Book 1", res.data["books"])
+        self.assertEqual(Book.objects.get(id=self.books[0].id).inventory, 10)
+        self.assertFalse(Borrowing.objects.exists())
+        self.assertFalse(Payment.objects.exists())
+
+    def test_unknown_or_repeated_books_rejected(self):
+        for books in ([self.books[0].id, 0], [self.books[0].id] * 2):
+            res = self.client.post(
+                BULK_URL, {**self.payload, "books": books}, format="json"
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_return_date_in_past_rejected(self):
+        payload = {**self.payload, "expected_return_date": "2020-01-01"}
+        res = self.client.post(BULK_URL, payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_borrow_queries(self):
+        with self.assertNumQueries(8):
+            self.client.post(BULK_URL, self.payload, format="json")
+
+
+class BulkReturnTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.admin = create_user(
+            email="admin@admin.com", password="adminpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        self.book = sample_book(inventory=5, daily_fee="1.00")
+        self.other_book = sample_book(title="Other", inventory=5)
+        self.on_time = [
+            sample_borrowing(self.book, self.admin) for _ in range(2)
+        ]
+        self.other = sample_borrowing(self.other_book, self.admin)
+        self.late = sample_borrowing(self.book, self.admin)
+        today = timezone.now().date()
+        Borrowing.objects.filter(pk=self.late.pk).update(
+            borrow_date=today - timedelta(10),
+            expected_return_date=today - timedelta(3),
+        )
+        self.returned = sample_borrowing(
+            self.book, self.admin, actual_return_date=days_from_today(0)
+        )
+        self.unpaid = sample_borrowing(self.book, self.admin)
+        sample_payment(self.unpaid)
+
+    def test_bulk_return(self):
+        ids = [
+            *(borrowing.id for borrowing in self.on_time),
+            self.other.id,
+            self.late.id,
+            self.returned.id,
+            self.unpaid.id,
+            self.unpaid.id + 1000,
+        ]
+
+        res = self.client.post(
+            BULK_RETURN_URL, {"borrowings": ids}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = {item["id"]: item for item in res.data["results"]}
+        self.assertEqual(
+            [item["result"] for item in res.data["results"]],
+            ["returned"] * 4 + ["already_returned", "payment_pending", "not_found"],
+        )
+        self.assertEqual(results[self.late.id]["fine"], "6.00")
+        self.assertIsNone(results[self.other.id]["fine"])
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 8)
+        self.assertEqual(Book.objects.get(id=self.other_book.id).inventory, 6)
+        self.assertEqual(
+            Borrowing.objects.filter(actual_return_date__isnull=True).count(),
+            1,
+        )
+        fine = Payment.objects.get(type="FINE")
+        self.assertEqual(fine.borrowing_id, self.late.id)
+        self.assertTrue(PaymentOutbox.objects.filter(payment=fine).exists())
+
+    def test_bulk_return_replaces_stale_fine_session(self):
+        fine = sample_payment(self.late, type="FINE", money_to_pay="2.00")
+
+        with stripe_api({}) as api:
+            res = self.client.post(
+                BULK_RETURN_URL, {"borrowings": [self.late.id]}, format="json"
+            )
+
+        api.assert_not_called()
+        self.assertEqual(res.data["results"][0]["fine"], "6.00")
+        fine.refresh_from_db()
+        self.assertEqual(fine.money_to_pay, Decimal("2.00"))
+        self.assertTrue(PaymentOutbox.objects.filter(payment=fine).exists())
+
+    def test_bulk_return_queries_do_not_grow(self):
+        borrowings = [
+            sample_borrowing(self.book, self.admin) for _ in range(200)
+        ]
+        ids = [borrowing.id for borrowing in borrowings] + [self.late.id]
+
+        with self.assertNumQueries(11):
+            res = self.client.post(
+                BULK_RETURN_URL, {"borrowings": ids}, format="json"
+            )
+        self.assertEqual(len(res.data["results"]), 201)
+
+    def test_bulk_return_staff_only(self):
+        self.client.force_authenticate(
+            create_user(email="test@test.com", password="testpass")
+        )
+        res = self.client.post(
+            BULK_RETURN_URL, {"borrowings": [self.other.id]}, format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        self.book = sample_book(inventory=3)
+        self.payload = {"expected_return_date": days_from_today(10), "book": self.book.id}
+
+    def post(self, url, payload, key="key-1"):
+        return self.client.post(
+            url, payload, format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retried_borrow_is_replayed(self):
+        first = self.post(BORROWING_URL, self.payload)
+        with self.assertNumQueries(4):
+            second = self.post(BORROWING_URL, self.payload)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(Borrowing.objects.count(), 1)
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 2)
+        self.assertEqual(PaymentOutbox.objects.count(), 1)
+
+    def test_other_keys_and_users_run_again(self):
+        self.post(BORROWING_URL, self.payload)
+        self.post(BORROWING_URL, self.payload, key="key-2")
+        self.client.force_authenticate(
+            create_user(email="other@test.com", password="testpass")
+        )
+        self.post(BORROWING_URL, self.payload)
+
+        self.assertEqual(Borrowing.objects.count(), 3)
+
+    def test_key_reused_for_other_request(self):
+        self.post(BORROWING_URL, self.payload)
+
+        res = self.post(
+            BORROWING_URL, {**self.payload, "expected_return_date": days_from_today(11)}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Borrowing.objects.count(), 1)
+
+    def test_failed_request_can_be_retried(self):
+        Book.objects.filter(id=self.book.id).update(inventory=0)
+        self.assertEqual(
+            self.post(BORROWING_URL, self.payload).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+        Book.objects.filter(id=self.book.id).update(inventory=1)
+        self.assertEqual(
+            self.post(BORROWING_URL, self.payload).status_code,
+            status.HTTP_201_CREATED,
+        )
+
+    def test_rejected_request_can_be_corrected(self):
+        res = self.post(
+            BORROWING_URL, {**self.payload, "book": self.book.id + 1000}
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.post(BORROWING_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", res)
+
+    def test_accepted_return_is_not_stored(self):
+        borrowing = sample_borrowing(self.book, self.user)
+        payment = sample_payment(borrowing, session_id=None, session_url="")
+
+        first = self.post(return_url(borrowing.id), {})
+        Payment.objects.filter(pk=payment.pk).update(status="PAID")
+        second = self.post(return_url(borrowing.id), {})
+
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Idempotent-Replayed", second)
+
+    def test_expired_key_runs_again(self):
+        self.post(BORROWING_URL, self.payload)
+        IdempotencyKey.objects.update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+
+        self.post(BORROWING_URL, self.payload)
+
+        self.assertEqual(Borrowing.objects.count(), 2)
+
+    def test_retried_return_is_replayed(self):
+        borrowing = sample_borrowing(self.book, self.user)
+
+        first = self.post(return_url(borrowing.id), {})
+        second = self.post(return_url(borrowing.id), {})
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 4)
+
+    def test_purge_expired_keys(self):
+        self.post(BORROWING_URL, self.payload)
+        self.post(BORROWING_URL, self.payload, key="key-2")
+        IdempotencyKey.objects.filter(key="key-1").update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+
+        call_command("purge_idempotency_keys", stdout=io.StringIO())
+
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list("key", flat=True)),
+            ["key-2"],
+        )
+
+
+class BorrowingQueryCountTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.admin = create_user(
+            email="admin@admin.com", password="adminpass", is_staff=True
+        )
+        self.book = sample_book()
+        for _ in range(5):
+            borrowing = sample_borrowing(self.book, self.user)
+            sample_payment(borrowing)
+            sample_payment(
+                borrowing, type="FINE", session_id=f"fine_{borrowing.id}"
+            )
+        self.borrowing = borrowing
+
+    def test_list_queries(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            res = self.client.get(BORROWING_URL)
+        self.assertEqual(len(res.data["results"]), 5)
+
+    def test_list_queries_as_staff(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(2):
+            self.client.get(BORROWING_URL, {"is_active": True})
+
+    def test_retrieve_queries(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            res = self.client.get(detail_url(self.borrowing.id))
+        self.assertEqual(len(res.data["payments"]), 2)
+
+    def test_create_queries(self):
+        self.client.force_authenticate(self.user)
+        payload = {"expected_return_date": days_from_today(10), "book": self.book.id}
+        with self.assertNumQueries(7):
+            res = self.client.post(BORROWING_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_return_queries(self):
+        self.client.force_authenticate(self.user)
+        borrowing = sample_borrowing(self.book, self.user)
+        with self.assertNumQueries(6):
+            res = self.client.post(return_url(borrowing.id), {})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_not_modified_queries(self):
+        self.client.force_authenticate(self.user)
+        etag = self.client.get(BORROWING_URL)["ETag"]
+        with self.assertNumQueries(0):
+            res = self.client.get(BORROWING_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class BorrowingConditionalGetTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        self.book = sample_book()
+        self.borrowing = sample_borrowing(self.book, self.user)
+        self.payment = sample_payment(self.borrowing)
+
+    def assertModified(self, url, etag):
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res["ETag"], etag)
+
+    def test_not_modified_with_matching_etag(self):
+        for url in (BORROWING_URL, detail_url(self.borrowing.id)):
+            etag = self.client.get(url)["ETag"]
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(res["ETag"], etag)
+            self.assertFalse(res.content)
+
+    def test_modified_by_borrowing_payment_and_book_changes(self):
+        url = f"{BORROWING_URL}?is_active=1"
+
+        etag = self.client.get(url)["ETag"]
+        Borrowing.objects.filter(pk=self.borrowing.pk).update(
+            expected_return_date=self.borrowing.expected_return_date
+        )
+        self.assertModified(url, etag)
+
+        etag = self.client.get(url)["ETag"]
+        Payment.objects.filter(pk=self.payment.pk).update(status="PAID")
+        self.assertModified(url, etag)
+
+        etag = self.client.get(url)["ETag"]
+        self.book.title = "Renamed"
+        self.book.save()
+        self.assertModified(url, etag)
+
+    def test_modified_by_new_borrowing(self):
+        etag = self.client.get(BORROWING_URL)["ETag"]
+        sample_borrowing(self.book, self.user)
+        self.assertModified(BORROWING_URL, etag)
+
+    def test_modified_by_the_date(self):
+        etag = self.client.get(BORROWING_URL)["ETag"]
+        tomorrow = timezone.now() + timedelta(days=1)
+        with patch("django.utils.timezone.now", return_value=tomorrow):
+            self.assertModified(BORROWING_URL, etag)
+
+    def test_etag_differs_between_users(self):
+        etag = self.client.get(BORROWING_URL)["ETag"]
+
+        self.client.force_authenticate(
+            create_user(email="other@test.com", password="testpass")
+        )
+        self.assertModified(BORROWING_URL, etag)
+
+
+class BorrowingExportTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.admin = create_user(
+            email="admin@admin.com", password="adminpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        book = sample_book(daily_fee="2.00")
+        self.old = sample_borrowing(book, self.admin)
+        self.new = sample_borrowing(book, self.admin)
+        Borrowing.objects.filter(pk=self.old.pk).update(
+            borrow_date="2023-01-01",
+            expected_return_date="2023-01-03",
+            actual_return_date="2023-01-05",
+            price="6.00",
+        )
+
+    def test_export_csv_with_price_and_overdue(self):
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(b"".join(res.streaming_content).decode())))
+        self.assertEqual([int(row["id"]) for row in rows], [self.old.id, self.new.id])
+        self.assertEqual(rows[0]["price"], "6.00")
+        self.assertEqual(rows[0]["fine"], "8.00")
+        self.assertEqual(rows[1]["actual_return_date"], "")
+
+    def test_export_ndjson_by_borrow_date(self):
+        res = self.client.get(
+            EXPORT_URL,
+            {"output": "ndjson", "date_from": "2022-12-01", "date_to": "2023-01-31"},
+        )
+
+        lines = b"".join(res.streaming_content).decode().splitlines()
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line)["id"] for line in lines], [self.old.id])
+
+    def test_export_invalid_date(self):
+        res = self.client.get(EXPORT_URL, {"date_from": "yesterday"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_staff_only(self):
+        self.client.force_authenticate(
+            create_user(email="test@test.com", password="testpass")
+        )
+        res = self.client.get(EXPORT_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_data_command(self):
+        out = io.StringIO()
+
+        call_command(
+            "export_data",
+            "borrowings",
+            "--output=ndjson",
+            "--date-from=2023-06-01",
+            stdout=out,
+        )
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [self.new.id])
+
+
+class BorrowingAmountsTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.admin = create_user(
+            email="admin@admin.com", password="adminpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        book = sample_book(daily_fee="2.00")
+        today = timezone.now().date()
+
+        self.on_time = sample_borrowing(book, self.admin)
+        self.returned_late = sample_borrowing(book, self.admin)
+        self.running = sample_borrowing(book, self.admin)
+        Borrowing.objects.filter(pk=self.on_time.pk).update(
+            borrow_date=today - timedelta(10),
+            expected_return_date=today - timedelta(8),
+            actual_return_date=today - timedelta(9),
+            price="6.00",
+        )
+        Borrowing.objects.filter(pk=self.returned_late.pk).update(
+            borrow_date=today - timedelta(10),
+            expected_return_date=today - timedelta(8),
+            actual_return_date=today - timedelta(5),
+            price="6.00",
+        )
+        Borrowing.objects.filter(pk=self.running.pk).update(
+            borrow_date=today - timedelta(10),
+            expected_return_date=today - timedelta(1),
+            price="20.00",
+        )
+
+    def test_fines_computed_in_database(self):
+        fines = {
+            borrowing.id: borrowing.fine_amount
+            for borrowing in Borrowing.objects.with_fine()
+        }
+
+        self.assertEqual(fines[self.on_time.id], 0)
+        self.assertEqual(fines[self.returned_late.id], Decimal("12.00"))
+        self.assertEqual(fines[self.running.id], Decimal("4.00"))
+
+    def test_fine_matches_python_property(self):
+        for borrowing in Borrowing.objects.with_fine().filter(
+            actual_return_date__isnull=False
+        ):
+            self.assertEqual(borrowing.fine_amount, borrowing.overdue)
+
+    def test_fine_does_not_join_book(self):
+        query = str(Borrowing.objects.with_fine().query)
+        self.assertNotIn("book_book", query)
+
+    def test_book_fee_change_keeps_snapshot(self):
+        Book.objects.update(daily_fee="5.00")
+
+        borrowing = Borrowing.objects.with_fine().get(pk=self.running.pk)
+        self.assertEqual(borrowing.daily_fee, Decimal("2.00"))
+        self.assertEqual(borrowing.price, Decimal("20.00"))
+        self.assertEqual(borrowing.fine_amount, Decimal("4.00"))
+
+    def test_ordering_by_fine_walks_pages(self):
+        seen = []
+        url = f"{BORROWING_URL}?ordering=-fine&page_size=1"
+        while url:
+            res = self.client.get(url)
+            seen.extend(borrowing["id"] for borrowing in res.data["results"])
+            url = res.data["next"]
+
+        self.assertEqual(
+            seen, [self.returned_late.id, self.running.id, self.on_time.id]
+        )
+
+    def test_ordering_by_price(self):
+        res = self.client.get(BORROWING_URL, {"ordering": "price"})
+
+        ids = [borrowing["id"] for borrowing in res.data["results"]]
+        self.assertEqual(ids[-1], self.running.id)
+
+    def test_filter_min_fine(self):
+        res = self.client.get(BORROWING_URL, {"min_fine": "4"})
+
+        ids = {borrowing["id"] for borrowing in res.data["results"]}
+        self.assertEqual(ids, {self.returned_late.id, self.running.id})
+
+    def test_filter_invalid_min_fine(self):
+        res = self.client.get(BORROWING_URL, {"min_fine": "lots"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            res = self.client.get(TOTALS_URL)
+
+        self.assertEqual(
+            res.data,
+            {
+                "borrowings": 3,
+                "active": 1,
+                "overdue": 2,
+                "price": "32.00",
+                "fines": "16.00",
+                "running_fines": "4.00",
+            },
+        )
+
+    def test_running_fine_follows_the_date(self):
+        tomorrow = timezone.now() + timedelta(1)
+        self.client.get(TOTALS_URL)
+
+        with patch("django.utils.timezone.now", return_value=tomorrow):
+            res = self.client.get(TOTALS_URL)
+
+        self.assertEqual(res.data["running_fines"], "8.00")
+
+    def test_totals_follow_filters(self):
+        res = self.client.get(TOTALS_URL, {"is_active": True})
+
+        self.assertEqual(res.data["borrowings"], 1)
+        self.assertEqual(res.data["fines"], "4.00")
+
+    def test_totals_staff_only(self):
+        self.client.force_authenticate(
+            create_user(email="test@test.com", password="testpass")
+        )
+        res = self.client.get(TOTALS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BorrowingArchiveTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.admin = create_user(
+            email="admin@admin.com", password="adminpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        self.book = sample_book()
+        self.old = self.returned_borrowing(days_ago=400)
+        sample_payment(self.old, status="PAID")
+        self.old_unpaid = self.returned_borrowing(days_ago=400)
+        sample_payment(
+            self.old_unpaid, type="FINE", session_id="fine_unpaid"
+        )
+        self.recent = self.returned_borrowing(days_ago=10)
+        self.active = sample_borrowing(self.book, self.admin)
+
+    def returned_borrowing(self, days_ago):
+        borrowing = sample_borrowing(self.book, self.admin)
+        today = timezone.now().date()
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            borrow_date=today - timedelta(days_ago + 10),
+            expected_return_date=today - timedelta(days_ago + 5),
+            actual_return_date=today - timedelta(days_ago),
+        )
+        return borrowing
+
+    def test_archive_moves_old_returned_borrowings(self):
+        out = io.StringIO()
+        call_command("archive_borrowings", stdout=out)
+
+        self.assertIn("Archived 1 borrowings and 1 payments", out.getvalue())
+        self.assertFalse(Borrowing.objects.filter(pk=self.old.pk).exists())
+        archived = ArchivedBorrowing.objects.get()
+        self.assertEqual(archived.pk, self.old.pk)
+        self.assertEqual(archived.price, self.old.price)
+        self.assertEqual(
+            ArchivedPayment.objects.get().borrowing_id, self.old.pk
+        )
+        self.assertEqual(Borrowing.objects.count(), 3)
+
+    def test_archive_keeps_every_payment_column(self):
+        borrowing = self.returned_borrowing(days_ago=400)
+        payment = sample_payment(
+            borrowing,
+            status="PAID",
+            type="FINE",
+            session_id="cs_archived",
+            session_url="https://checkout.stripe.com/c/pay/cs_archived",
+            session_expires_at=timezone.now() - timedelta(days=399),
+            checkout_group=uuid.uuid4(),
+            money_to_pay=Decimal("12.50"),
+            created_at=timezone.now() - timedelta(days=405),
+        )
+        payment.refresh_from_db()
+
+        archive_borrowings(timezone.now().date())
+
+        archived = ArchivedPayment.objects.get(pk=payment.pk)
+        for field in ArchivedPayment._meta.concrete_fields:
+            self.assertEqual(
+                getattr(archived, field.attname),
+                getattr(payment, field.attname),
+                field.name,
+            )
+
+    def test_archive_again_moves_nothing(self):
+        call_command("archive_borrowings", stdout=io.StringIO())
+        out = io.StringIO()
+
+        call_command("archive_borrowings", "--older-than=5", stdout=out)
+
+        self.assertIn("Archived 1 borrowings", out.getvalue())
+        self.assertEqual(
+            set(ArchivedBorrowing.objects.values_list("pk", flat=True)),
+            {self.old.pk, self.recent.pk},
+        )
+
+    def test_live_list_excludes_archived(self):
+        call_command("archive_borrowings", stdout=io.StringIO())
+
+        res = self.client.get(BORROWING_URL)
+
+        ids = {borrowing["id"] for borrowing in res.data["results"]}
+        self.assertEqual(
+            ids, {self.old_unpaid.id, self.recent.id, self.active.id}
+        )
+        res = self.client.get(detail_url(self.old.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_include_archived(self):
+        call_command("archive_borrowings", stdout=io.StringIO())
+
+        res = self.client.get(BORROWING_URL, {"include_archived": True})
+
+        archived = {
+            borrowing["id"]: borrowing["archived"]
+            for borrowing in res.data["results"]
+        }
+        self.assertEqual(
+            archived,
+            {
+                self.old.id: True,
+                self.old_unpaid.id: False,
+                self.recent.id: False,
+                self.active.id: False,
+            },
+        )
+        res = self.client.get(
+            detail_url(self.old.id), {"include_archived": True}
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["book_title"], self.book.title)
+
+    def test_include_archived_only_own_borrowings(self):
+        call_command("archive_borrowings", stdout=io.StringIO())
+        self.client.force_authenticate(
+            create_user(email="test@test.com", password="testpass")
+        )
+
+        res = self.client.get(BORROWING_URL, {"include_archived": True})
+
+        self.assertEqual(res.data["results"], [])
+
+    def test_history_etag_follows_archiving(self):
+        params = {"include_archived": True}
+        etag = self.client.get(BORROWING_URL, params)["ETag"]
+
+        call_command("archive_borrowings", stdout=io.StringIO())
+
+        res = self.client.get(BORROWING_URL, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -1,27 +1,82 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, Max, Q, Sum
 from django.http import HttpResponseRedirect
+from django.utils import timezone
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from borrowing.models import Borrowing
+from book.cache import get_catalog_version
+from borrowing.idempotency import idempotent
+from borrowing.models import Borrowing, BorrowingHistory
 from borrowing.permissions import IsAdminOrIfAuthenticatedReadOrCreateOnly
 from borrowing.serializers import (
+    BorrowingBulkCreateSerializer,
+    BorrowingBulkReturnResultSerializer,
+    BorrowingBulkReturnSerializer,
     BorrowingCreateSerializer,
     BorrowingDetailSerializer,
+    BorrowingHistorySerializer,
     BorrowingListSerializer, BorrowingReturnSerializer,
+    BorrowingTotalsSerializer,
 )
+from library_service.conditional import conditional_get
+from library_service.exports import export_response
+from library_service.pagination import KeysetPagination
+from library_service.versions import get_version, model_version
+from payment.models import Payment
+
+
+class BorrowingPagination(KeysetPagination):
+    ordering = ("-borrow_date", "-id")
+    orderings = {
+        "borrow_date": ("borrow_date", "id"),
+        "-borrow_date": ("-borrow_date", "-id"),
+        "expected_return_date": ("expected_return_date", "id"),
+        "-expected_return_date": ("-expected_return_date", "-id"),
+        "price": ("price", "id"),
+        "-price": ("-price", "-id"),
+        "fine": ("fine_amount", "id"),
+        "-fine": ("-fine_amount", "-id"),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get("ordering")
+        if ordering in self.orderings:
+            return self.orderings[ordering]
+        return super().get_ordering(request, queryset, view)
 
 
 class BorrowingViewSet(viewsets.ModelViewSet):
-    queryset = Borrowing.objects.select_related("book", "user")
+    queryset = Borrowing.objects.select_related(
+        "book", "user"
+    ).prefetch_related("payments")
     permission_classes = [IsAdminOrIfAuthenticatedReadOrCreateOnly]
+    pagination_class = BorrowingPagination
+    lookup_value_regex = r"\d+"
+
+    @property
+    def include_archived(self):
+        return self.action in ("list", "retrieve") and bool(
+            self.request.query_params.get("include_archived")
+        )
 
     def get_queryset(self):
-        queryset = self.queryset
+        # Fines run until today, so they are annotated on every request.
+        queryset = self.queryset.with_fine()
+        if self.include_archived:
+            queryset = BorrowingHistory.objects.with_fine().select_related(
+                "book", "user"
+            )
         user = self.request.user
         is_active = self.request.query_params.get("is_active")
         user_id = self.request.query_params.get("user_id")
+        min_fine = self.request.query_params.get("min_fine")
 
         if user.is_staff:
             if user_id:
@@ -33,11 +88,52 @@ class BorrowingViewSet(viewsets.ModelViewSet):
         if is_active:
             queryset = queryset.filter(actual_return_date__isnull=True)
 
+        if min_fine:
+            try:
+                min_fine = Decimal(min_fine)
+            except InvalidOperation:
+                raise ValidationError({"min_fine": "A number is required."})
+            queryset = queryset.filter(fine_amount__gte=min_fine)
+
         return queryset
 
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def get_validators(self):
+        """
+        Versions of borrowings, their payments and the books they show,
+        and today's date that running fines follow
+        """
+        marker = ":".join(
+            str(part)
+            for part in (
+                get_catalog_version(),
+                get_version(model_version(Borrowing)),
+                get_version(model_version(Payment)),
+                timezone.now().date(),
+            )
+        )
+        return marker, None
+
     def get_serializer_class(self):
+        if self.include_archived:
+            return BorrowingHistorySerializer
         if self.action == "create":
             return BorrowingCreateSerializer
+        if self.action == "bulk_borrow":
+            return BorrowingBulkCreateSerializer
+        if self.action == "bulk_return":
+            return BorrowingBulkReturnSerializer
         if self.action == "retrieve":
             return BorrowingDetailSerializer
         if self.action == "return_book":
@@ -47,17 +143,92 @@ class BorrowingViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(methods=["POST"], detail=False, url_path="bulk")
+    @idempotent
+    def bulk_borrow(self, request):
+        """Borrow several books at once, paid through one checkout session"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="bulk-return",
+        permission_classes=(IsAdminUser,),
+    )
+    @idempotent
+    def bulk_return(self, request):
+        """Return a bin of borrowings at the circulation desk"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = BorrowingBulkReturnResultSerializer(
+            serializer.save(), many=True
+        )
+        return Response({"results": results.data})
+
     @action(methods=["POST"], detail=True, url_path="return")
+    @idempotent
     def return_book(self, request, pk=None):
         borrowing = get_object_or_404(Borrowing, pk=pk)
         serializer = self.get_serializer(borrowing, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
 
-        if (payment_obj := borrowing.payments.filter(status="PENDING")).exists():
-            return HttpResponseRedirect(payment_obj.first().session_url)
+        if payment := borrowing.payments.filter(
+            status="PENDING", type="PAYMENT"
+        ).first():
+            if payment.has_live_session:
+                return HttpResponseRedirect(payment.session_url)
+            return Response(
+                {
+                    "message": "Payment session is being prepared.",
+                    "checkout": reverse(
+                        "payment:payment-checkout",
+                        kwargs={"pk": payment.id},
+                        request=request,
+                    ),
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
 
         serializer.save()
 
         return Response(
             {"message": "Borrowing returned successfully."}, status=status.HTTP_200_OK
         )
+
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="totals",
+        permission_classes=(IsAdminUser,),
+    )
+    def totals(self, request):
+        """Counts, prices and fines of the filtered borrowings in one query"""
+        active = Q(actual_return_date__isnull=True)
+        totals = (
+            self.get_queryset()
+            .order_by()
+            .aggregate(
+                borrowings=Count("id"),
+                active=Count("id", filter=active),
+                overdue=Count("id", filter=Q(fine_amount__gt=0)),
+                price=Sum("price", default=Decimal(0)),
+                fines=Sum("fine_amount", default=Decimal(0)),
+                running_fines=Sum(
+                    "fine_amount", filter=active, default=Decimal(0)
+                ),
+            )
+        )
+        return Response(BorrowingTotalsSerializer(totals).data)
+
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="export",
+        permission_classes=(IsAdminUser,),
+    )
+    def export(self, request):
+        """Stream borrowings with price and overdue fine for accounting"""
+        return export_response(request, "borrowings")
@@ -0,0 +1,146 @@
+import csv
+import json
+from dataclasses import dataclass, field
+from datetime import date
+from itertools import islice
+from typing import Callable, Iterator
+
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+
+from book.models import Book
+from borrowing.models import Borrowing
+from payment.models import Payment
+
+EXPORT_OUTPUTS = ("csv", "ndjson")
+EXPORT_CHUNK_SIZE = 2000
+CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+@dataclass(frozen=True)
+class Export:
+    queryset: Callable[[], QuerySet]
+    columns: tuple[str, ...]
+    fields: tuple[str, ...] = ()
+    sources: dict[str, str] = field(default_factory=dict)
+    date_field: str | None = None
+
+
+EXPORTS = {
+    "books": Export(
+        queryset=Book.objects.all,
+        columns=("id", "title", "author", "cover", "inventory", "daily_fee"),
+    ),
+    "borrowings": Export(
+        queryset=Borrowing.objects.with_fine,
+        columns=(
+            "id",
+            "borrow_date",
+            "expected_return_date",
+            "actual_return_date",
+            "book_id",
+            "user_id",
+            "price",
+            "fine",
+        ),
+        fields=(
+            "id",
+            "borrow_date",
+            "expected_return_date",
+            "actual_return_date",
+            "book_id",
+            "user_id",
+            "price",
+        ),
+        sources={"fine": "fine_amount"},
+        date_field="borrow_date",
+    ),
+    "payments": Export(
+        queryset=Payment.objects.all,
+        columns=(
+            "id",
+            "status",
+            "type",
+            "borrowing_id",
+            "session_id",
+            "money_to_pay",
+            "updated_at",
+        ),
+        date_field="borrowing__borrow_date",
+    ),
+}
+
+
+class ExportSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=EXPORT_OUTPUTS, default="csv")
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+
+class Echo:
+    """File-like object that hands back what is written to it"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(
+    name: str,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[list]:
+    """
+    Yield the rows of an export through a server-side cursor.
+
+    Only ``chunk_size`` model instances are held at a time.
+    """
+    export = EXPORTS[name]
+    queryset = export.queryset().only(*(export.fields or export.columns))
+    if export.date_field and date_from:
+        queryset = queryset.filter(**{f"{export.date_field}__gte": date_from})
+    if export.date_field and date_to:
+        queryset = queryset.filter(**{f"{export.date_field}__lte": date_to})
+
+    for instance in queryset.order_by("id").iterator(chunk_size=chunk_size):
+        yield [
+            getattr(instance, export.sources.get(column, column))
+            for column in export.columns
+        ]
+
+
+def render_export(
+    name: str, output: str, rows: Iterator[list], chunk_size: int
+) -> Iterator[str]:
+    """Render export rows as CSV or NDJSON, ``chunk_size`` rows a chunk"""
+    columns = EXPORTS[name].columns
+    writer = csv.writer(Echo())
+    if output == "csv":
+        yield writer.writerow(columns)
+
+    while chunk := list(islice(rows, chunk_size)):
+        if output == "csv":
+            yield "".join(writer.writerow(row) for row in chunk)
+        else:
+            yield "".join(
+                json.dumps(dict(zip(columns, row)), default=str) + "\n"
+                for row in chunk
+            )
+
+
+def export_response(request, name: str) -> StreamingHttpResponse:
+    """Stream an export filtered by the query parameters of the request"""
+    serializer = ExportSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    params = serializer.validated_data
+
+    rows = export_rows(name, params.get("date_from"), params.get("date_to"))
+    response = StreamingHttpResponse(
+        render_export(name, params["output"], rows, EXPORT_CHUNK_SIZE),
+        content_type=CONTENT_TYPES[params["output"]],
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="{name}.{params["output"]}"'
+    )
+    return response
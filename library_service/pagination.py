@@ -0,0 +1,144 @@
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the whole ordering key.
+
+    DRF's CursorPagination only seeks on the first ordering field and
+    falls back to an OFFSET for rows sharing the same value, so deep pages
+    over non-unique columns (titles, dates) get slower. Here the cursor
+    stores the value of every ordering field and the next page is fetched
+    with a row comparison, e.g. for ("title", "id"):
+
+        title >= :title AND (title > :title OR (title = :title AND id > :id))
+
+    The last ordering field must be unique and no ordering field may be
+    nullable. No COUNT(*) is issued.
+    """
+
+    ordering = ("-id",)
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor["reverse"]
+        ordering = self._reverse(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+
+        if self.cursor is not None:
+            try:
+                queryset = queryset.filter(
+                    self._seek(ordering, self.cursor["values"])
+                )
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            cursor = json.loads(b64decode(encoded.encode("ascii")))
+            ordering = tuple(cursor["o"])
+            values = list(cursor["v"])
+            reverse = bool(cursor.get("r"))
+        except (
+            AttributeError,
+            BinasciiError,
+            KeyError,
+            TypeError,
+            UnicodeError,
+            ValueError,
+        ):
+            raise NotFound(self.invalid_cursor_message)
+
+        if ordering != self.ordering or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return {"values": values, "reverse": reverse}
+
+    def _link(self, instance, reverse):
+        values = [
+            getattr(instance, field.lstrip("-")) for field in self.ordering
+        ]
+        cursor = {"o": self.ordering, "v": values}
+        if reverse:
+            cursor["r"] = 1
+        encoded = b64encode(
+            json.dumps(cursor, default=str).encode("utf-8")
+        ).decode("ascii")
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def _reverse(ordering):
+        return tuple(
+            field[1:] if field.startswith("-") else f"-{field}"
+            for field in ordering
+        )
+
+    @staticmethod
+    def _seek(ordering, values):
+        fields = [
+            (field.lstrip("-"), "lt" if field.startswith("-") else "gt")
+            for field in ordering
+        ]
+        condition = Q()
+        for index, (field, lookup) in enumerate(fields):
+            equal = {
+                name: values[position]
+                for position, (name, _) in enumerate(fields[:index])
+            }
+            condition |= Q(**equal, **{f"{field}__{lookup}": values[index]})
+
+        # Redundant bound on the leading column lets the planner use it as
+        # an index range instead of evaluating the OR for every row.
+        leading, lookup = fields[0]
+        return Q(**{f"{leading}__{lookup}e": values[0]}) & condition
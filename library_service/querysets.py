@@ -0,0 +1,23 @@
+from django.db import models
+from django.utils import timezone
+
+from library_service.versions import invalidate, model_version
+
+
+class TimestampedQuerySet(models.QuerySet):
+    """
+    QuerySet whose update() also moves the updated_at marker, and whose
+    bulk writes bump the version of the table
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault("updated_at", timezone.now())
+        rows = super().update(**kwargs)
+        if rows:
+            invalidate(model_version(self.model))
+        return rows
+
+    def bulk_create(self, instances, *args, **kwargs):
+        instances = super().bulk_create(instances, *args, **kwargs)
+        invalidate(model_version(self.model))
+        return instances
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import json
 import os
 from datetime import timedelta
 from pathlib import Path
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "drf_spectacular",
     "book",
@@ -98,6 +100,30 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Without REDIS_URL every process keeps its own local-memory cache.
+
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+
+BOOK_CACHE_TIMEOUT = int(os.environ.get("BOOK_CACHE_TIMEOUT", 300))
+
+# Seconds a checkout session status read from the gateway is reused for.
+PAYMENT_STATUS_CACHE_TIMEOUT = int(
+    os.environ.get("PAYMENT_STATUS_CACHE_TIMEOUT", 5)
+)
+
+# Seconds a status check waits for the same check already in flight.
+PAYMENT_STATUS_CHECK_TIMEOUT = float(
+    os.environ.get("PAYMENT_STATUS_CHECK_TIMEOUT", 10)
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -183,3 +209,30 @@ SIMPLE_JWT = {
 }
 
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
+
+PAYMENT_GATEWAY = {
+    "BACKEND": os.environ.get(
+        "PAYMENT_GATEWAY_BACKEND", "payment.gateways.StripeGateway"
+    ),
+    "OPTIONS": json.loads(os.environ.get("PAYMENT_GATEWAY_OPTIONS", "{}")),
+    "CIRCUIT_BREAKER": json.loads(
+        os.environ.get("PAYMENT_GATEWAY_CIRCUIT_BREAKER", "{}")
+    ),
+}
+
+# Public address of the API, used for links built outside a request.
+SITE_URL = os.environ.get("SITE_URL", "http://127.0.0.1:8000")
+
+# Seconds a checkout session can be paid for; Stripe accepts 30 minutes
+# to 24 hours. Sessions past it are expired by expire_checkout_sessions.
+CHECKOUT_SESSION_TTL = int(os.environ.get("CHECKOUT_SESSION_TTL", 82800))
+
+# Returned borrowings older than this many days are moved to the archive
+# by the archive_borrowings command.
+BORROWING_ARCHIVE_AFTER_DAYS = int(
+    os.environ.get("BORROWING_ARCHIVE_AFTER_DAYS", 365)
+)
+
+# Seconds a stored Idempotency-Key response is replayed for.
+IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL", 86400))
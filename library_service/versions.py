@@ -0,0 +1,48 @@
+import time
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import models, transaction
+from django.utils import timezone
+
+
+def get_version(name: str) -> int:
+    """Current version of a cached resource, moved by every write to it"""
+    key = f"version:{name}"
+    version = cache.get(key)
+    if version is None:
+        # A lost version restarts from the clock, never from a number
+        # whose cached responses or ETags may still be around.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_modified(name: str) -> datetime | None:
+    """When the version was last bumped, if the cache still knows"""
+    return cache.get(f"modified:{name}")
+
+
+def bump_version(name: str) -> None:
+    try:
+        cache.incr(f"version:{name}")
+    except ValueError:
+        cache.add(f"version:{name}", time.time_ns(), timeout=None)
+    cache.set(f"modified:{name}", timezone.now(), timeout=None)
+
+
+def invalidate(name: str) -> None:
+    """
+    Bump a version after a write.
+
+    The version is bumped right away and again once the transaction
+    commits: anything derived from the pre-commit rows in between is
+    keyed by a version that is already gone.
+    """
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def model_version(model: type[models.Model]) -> str:
+    """Version name of the table of a model"""
+    return model._meta.label_lower
@@ -0,0 +1,236 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from django.core.cache import cache
+
+from payment.gateways import GatewayError, PaymentGateway
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(GatewayError):
+    """The gateway is not called because its circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Failure-rate and slow-call-rate circuit breaker.
+
+    The outcome of the last ``window`` calls is kept. Once at least
+    ``min_calls`` have been recorded and either the share of failed calls
+    reaches ``failure_rate_threshold`` or the share of calls slower than
+    ``slow_call_duration`` seconds reaches ``slow_call_rate_threshold``,
+    the breaker opens and rejects calls for ``open_duration`` seconds.
+    After that, ``half_open_calls`` trial calls are let through: if they
+    all succeed the breaker closes, any failure opens it again. Any
+    exception raised by the call counts as a failure.
+
+    The window and the half-open trials are kept per process. With a
+    ``shared_key`` a trip is also stored in the cache and adopted by the
+    breakers of every other process, so web processes stop calling and
+    report the circuit open when a worker trips it, and the other way
+    round. The clock is then wall time, comparable between processes.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_rate_threshold: float = 0.5,
+        slow_call_duration: float = 5.0,
+        slow_call_rate_threshold: float = 0.5,
+        open_duration: float = 30.0,
+        half_open_calls: int = 1,
+        shared_key: str | None = None,
+        clock=time.time,
+    ):
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.shared_key = shared_key
+        self.clock = clock
+
+        self.state = self.CLOSED
+        self.trips = 0
+        self.rejected = 0
+        self.opened_at = None
+        self._outcomes = deque(maxlen=window)
+        self._trial_calls = 0
+        self._trial_successes = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        self._before_call()
+        started = self.clock()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._record(failed=True, duration=self.clock() - started)
+            raise
+        self._record(failed=False, duration=self.clock() - started)
+        return result
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker lets a trial call through"""
+        with self._lock:
+            self._adopt_shared_trip()
+            if self.state != self.OPEN:
+                return 0.0
+            return max(
+                0.0, self.opened_at + self.open_duration - self.clock()
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._adopt_shared_trip()
+            failure_rate, slow_call_rate = self._rates()
+            return {
+                "state": self.state,
+                "trips": self._shared_trips(),
+                "rejected": self.rejected,
+                "recorded_calls": len(self._outcomes),
+                "failure_rate": failure_rate,
+                "slow_call_rate": slow_call_rate,
+            }
+
+    def _before_call(self) -> None:
+        with self._lock:
+            self._adopt_shared_trip()
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.open_duration:
+                    self.rejected += 1
+                    raise CircuitOpenError("Payment gateway circuit is open")
+                self.state = self.HALF_OPEN
+                self._trial_calls = self._trial_successes = 0
+
+            if self.state == self.HALF_OPEN:
+                if self._trial_calls >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError("Payment gateway circuit is open")
+                self._trial_calls += 1
+
+    def _record(self, failed: bool, duration: float) -> None:
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                    return
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info("Payment gateway circuit closed")
+                return
+
+            self._outcomes.append((failed, slow))
+            if self.state == self.CLOSED and len(self._outcomes) >= (
+                self.min_calls
+            ):
+                failure_rate, slow_call_rate = self._rates()
+                if (
+                    failure_rate >= self.failure_rate_threshold
+                    or slow_call_rate >= self.slow_call_rate_threshold
+                ):
+                    self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+        self.trips += 1
+        self._outcomes.clear()
+        if self.shared_key:
+            cache.set(
+                f"{self.shared_key}:opened-at",
+                self.opened_at,
+                math.ceil(self.open_duration),
+            )
+            try:
+                cache.incr(f"{self.shared_key}:trips")
+            except ValueError:
+                cache.add(f"{self.shared_key}:trips", 1, timeout=None)
+        logger.warning(
+            "Payment gateway circuit opened (trip #%s) for %ss",
+            self.trips,
+            self.open_duration,
+        )
+
+    def _adopt_shared_trip(self) -> None:
+        """Open when another process tripped the breaker more recently"""
+        if not self.shared_key:
+            return
+        opened_at = cache.get(f"{self.shared_key}:opened-at")
+        if (
+            opened_at is not None
+            and (self.opened_at is None or opened_at > self.opened_at)
+            and self.clock() - opened_at < self.open_duration
+        ):
+            self.state = self.OPEN
+            self.opened_at = opened_at
+            self._outcomes.clear()
+
+    def _shared_trips(self) -> int:
+        if not self.shared_key:
+            return self.trips
+        return cache.get(f"{self.shared_key}:trips", self.trips)
+
+    def _rates(self) -> tuple[float, float]:
+        if not self._outcomes:
+            return 0.0, 0.0
+        total = len(self._outcomes)
+        failed = sum(1 for failure, _ in self._outcomes if failure)
+        slow = sum(1 for _, slow in self._outcomes if slow)
+        return failed / total, slow / total
+
+
+class CircuitBreakerGateway(PaymentGateway):
+    """Gateway wrapper that sends outbound calls through a circuit breaker"""
+
+    def __init__(self, gateway: PaymentGateway, breaker: CircuitBreaker):
+        self.gateway = gateway
+        self.breaker = breaker
+
+    def create_product(self, **kwargs):
+        return self.breaker.call(self.gateway.create_product, **kwargs)
+
+    def create_checkout_session(self, **kwargs):
+        return self.breaker.call(
+            self.gateway.create_checkout_session, **kwargs
+        )
+
+    def retrieve_checkout_session(self, session_id):
+        return self.breaker.call(
+            self.gateway.retrieve_checkout_session, session_id
+        )
+
+    def expire_checkout_session(self, session_id):
+        return self.breaker.call(
+            self.gateway.expire_checkout_session, session_id
+        )
+
+    def list_checkout_sessions(self, **kwargs):
+        return self.breaker.call(
+            self.gateway.list_checkout_sessions, **kwargs
+        )
+
+    def construct_event(self, payload, signature):
+        return self.gateway.construct_event(payload, signature)
+
+    def retry_after(self):
+        return self.breaker.retry_after()
+
+    def stats(self):
+        return {
+            **self.gateway.stats(),
+            "circuit_breaker": self.breaker.stats(),
+        }
@@ -0,0 +1,452 @@
+import abc
+import functools
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class GatewayError(Exception):
+    """The payment gateway failed or could not be reached"""
+
+
+class InvalidWebhookError(Exception):
+    """A webhook payload is malformed or its signature does not match"""
+
+
+class WebhookNotConfiguredError(InvalidWebhookError):
+    """No signing secret is configured to verify webhooks with"""
+
+
+@dataclass(frozen=True)
+class LineItem:
+    name: str
+    amount: int
+    quantity: int = 1
+    description: str = "Book borrowing"
+    product_id: str | None = None
+
+
+@dataclass(frozen=True)
+class CheckoutSession:
+    id: str  # noqa: VNE003
+    url: str
+    status: str = "open"
+    payment_status: str = "unpaid"
+    expires_at: datetime | None = None
+    created_at: datetime | None = None
+
+
+@dataclass(frozen=True)
+class CheckoutSessionPage:
+    sessions: list[CheckoutSession]
+    has_more: bool = False
+
+
+class PaymentGateway(abc.ABC):
+    """Checkout operations the payment app needs from a gateway"""
+
+    @abc.abstractmethod
+    def create_product(
+        self, *, name: str, idempotency_key: str | None = None
+    ) -> str:
+        """Create a product line items can refer to, return its id"""
+
+    @abc.abstractmethod
+    def create_checkout_session(
+        self,
+        *,
+        success_url: str,
+        cancel_url: str,
+        line_items: list[LineItem],
+        idempotency_key: str | None = None,
+        expires_at: datetime | None = None,
+    ) -> CheckoutSession:
+        ...
+
+    @abc.abstractmethod
+    def retrieve_checkout_session(self, session_id: str) -> CheckoutSession:
+        ...
+
+    @abc.abstractmethod
+    def expire_checkout_session(self, session_id: str) -> CheckoutSession:
+        """
+        Expire an open session so it can no longer be paid and return it.
+
+        A session that is no longer open is returned as it is, so a session
+        paid in the meantime is reported as paid.
+        """
+
+    @abc.abstractmethod
+    def list_checkout_sessions(
+        self,
+        *,
+        created_after: datetime,
+        created_before: datetime,
+        starting_after: str | None = None,
+        limit: int = 100,
+    ) -> CheckoutSessionPage:
+        """
+        One page of the sessions created in [created_after, created_before),
+        newest first; pass the last session id as ``starting_after`` to get
+        the next page.
+        """
+
+    @abc.abstractmethod
+    def construct_event(self, payload: bytes, signature: str) -> dict:
+        """Verify a webhook delivery and return the event it carries"""
+
+    def retry_after(self) -> float:
+        """Seconds callers should wait before the gateway accepts calls"""
+        return 0.0
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class StripeHTTPClient(stripe.http_client.RequestsClient):
+    """Requests client with its own retry count instead of the global one"""
+
+    def __init__(self, max_retries: int = 2, **kwargs):
+        super().__init__(**kwargs)
+        self.max_retries = max_retries
+
+    def _max_network_retries(self):
+        return self.max_retries
+
+
+class StripeGateway(PaymentGateway):
+    """
+    Stripe Checkout through the gateway's own configured HTTP client.
+
+    The client keeps a keep-alive session per thread, uses a bounded
+    timeout and retries connection errors and 409/429/5xx responses with
+    backoff. The client and the API key are passed with every request, so
+    the global ``stripe`` settings other code may rely on stay untouched.
+    """
+
+    PRODUCTS_URL = "/v1/products"
+    SESSIONS_URL = "/v1/checkout/sessions"
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        webhook_secret: str | None = None,
+        timeout: float = 10,
+        max_retries: int = 2,
+        currency: str = "usd",
+    ):
+        self.api_key = api_key or settings.STRIPE_SECRET_KEY
+        self.webhook_secret = webhook_secret or settings.STRIPE_WEBHOOK_SECRET
+        self.currency = currency
+        self.http_client = StripeHTTPClient(
+            max_retries=max_retries, timeout=timeout
+        )
+
+    def create_product(self, *, name, idempotency_key=None):
+        product = self._request(
+            "post",
+            self.PRODUCTS_URL,
+            {"name": name},
+            idempotency_key=idempotency_key,
+        )
+        return product["id"]
+
+    def create_checkout_session(
+        self,
+        *,
+        success_url,
+        cancel_url,
+        line_items,
+        idempotency_key=None,
+        expires_at=None,
+    ):
+        if expires_at is not None:
+            options = {"expires_at": int(expires_at.timestamp())}
+        else:
+            options = {}
+        session = self._request(
+            "post",
+            self.SESSIONS_URL,
+            {
+                **options,
+                "success_url": success_url,
+                "cancel_url": cancel_url,
+                "payment_method_types": ["card"],
+                "mode": "payment",
+                "line_items": [
+                    {
+                        "price_data": {
+                            "currency": self.currency,
+                            "unit_amount": item.amount,
+                            **self._product(item),
+                        },
+                        "quantity": item.quantity,
+                    }
+                    for item in line_items
+                ],
+            },
+            idempotency_key=idempotency_key,
+        )
+        return self._session(session)
+
+    def retrieve_checkout_session(self, session_id):
+        return self._session(
+            self._request("get", self._session_url(session_id))
+        )
+
+    def expire_checkout_session(self, session_id):
+        try:
+            session = self._request(
+                "post", self._session_url(session_id) + "/expire"
+            )
+        except GatewayError as error:
+            # A session that is no longer open cannot be expired
+            if not isinstance(
+                error.__cause__, stripe.error.InvalidRequestError
+            ):
+                raise
+            return self.retrieve_checkout_session(session_id)
+        return self._session(session)
+
+    def list_checkout_sessions(
+        self,
+        *,
+        created_after,
+        created_before,
+        starting_after=None,
+        limit=100,
+    ):
+        params = {
+            "created": {
+                "gte": int(created_after.timestamp()),
+                "lt": int(created_before.timestamp()),
+            },
+            "limit": limit,
+        }
+        if starting_after:
+            params["starting_after"] = starting_after
+        page = self._request("get", self.SESSIONS_URL, params)
+        return CheckoutSessionPage(
+            sessions=[self._session(session) for session in page["data"]],
+            has_more=page["has_more"],
+        )
+
+    def construct_event(self, payload, signature):
+        if not self.webhook_secret:
+            raise WebhookNotConfiguredError("STRIPE_WEBHOOK_SECRET is not set")
+        try:
+            stripe.WebhookSignature.verify_header(
+                payload.decode("utf-8"), signature, self.webhook_secret
+            )
+            return json.loads(payload)
+        except (
+            ValueError,
+            TypeError,
+            stripe.error.SignatureVerificationError,
+        ) as error:
+            raise InvalidWebhookError(str(error)) from error
+
+    def _request(self, method, url, params=None, idempotency_key=None):
+        """Send an API request with this gateway's key and HTTP client"""
+        requestor = stripe.api_requestor.APIRequestor(
+            key=self.api_key, client=self.http_client
+        )
+        headers = stripe.util.populate_headers(idempotency_key)
+        try:
+            response, api_key = requestor.request(method, url, params, headers)
+        except stripe.error.StripeError as error:
+            raise GatewayError(str(error)) from error
+        return stripe.util.convert_to_stripe_object(response, api_key)
+
+    def _session_url(self, session_id: str) -> str:
+        return f"{self.SESSIONS_URL}/{stripe.util.sanitize_id(session_id)}"
+
+    @staticmethod
+    def _product(item: LineItem) -> dict:
+        if item.product_id:
+            return {"product": item.product_id}
+        return {
+            "product_data": {
+                "name": item.name,
+                "description": item.description,
+            }
+        }
+
+    @staticmethod
+    def _session(session) -> CheckoutSession:
+        return CheckoutSession(
+            id=session["id"],
+            url=session.get("url") or "",
+            status=session.get("status") or "open",
+            payment_status=session.get("payment_status") or "unpaid",
+            expires_at=_from_timestamp(session.get("expires_at")),
+            created_at=_from_timestamp(session.get("created")),
+        )
+
+
+class FakeGateway(PaymentGateway):
+    """
+    In-process gateway for development and load tests.
+
+    Every call sleeps for ``latency`` seconds (plus up to ``jitter``) and
+    fails with GatewayError at ``failure_rate``. Webhook payloads are
+    accepted without a signature.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.sessions: dict[str, CheckoutSession] = {}
+        self.products: dict[str, str] = {}
+        self.line_items: dict[str, list[LineItem]] = {}
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create_product(self, *, name, idempotency_key=None):
+        self._call()
+        product_id = f"prod_fake_{uuid.uuid4().hex}"
+        with self._lock:
+            self.products[product_id] = name
+        return product_id
+
+    def create_checkout_session(
+        self,
+        *,
+        success_url,
+        cancel_url,
+        line_items,
+        idempotency_key=None,
+        expires_at=None,
+    ):
+        self._call()
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        session = CheckoutSession(
+            id=session_id,
+            url=f"https://checkout.fake.local/pay/{session_id}",
+            expires_at=expires_at,
+            created_at=datetime.now(timezone.utc),
+        )
+        with self._lock:
+            self.sessions[session_id] = session
+            self.line_items[session_id] = list(line_items)
+        return session
+
+    def retrieve_checkout_session(self, session_id):
+        self._call()
+        try:
+            return self.sessions[session_id]
+        except KeyError:
+            raise GatewayError(f"No such checkout session: {session_id}")
+
+    def expire_checkout_session(self, session_id):
+        session = self.retrieve_checkout_session(session_id)
+        if session.status != "open":
+            return session
+        with self._lock:
+            session = self.sessions[session_id] = replace(
+                session, status="expired"
+            )
+        return session
+
+    def list_checkout_sessions(
+        self,
+        *,
+        created_after,
+        created_before,
+        starting_after=None,
+        limit=100,
+    ):
+        self._call()
+        with self._lock:
+            sessions = sorted(
+                (
+                    session
+                    for session in self.sessions.values()
+                    if created_after <= session.created_at < created_before
+                ),
+                key=lambda session: session.created_at,
+                reverse=True,
+            )
+        if starting_after is not None:
+            position = [session.id for session in sessions].index(
+                starting_after
+            )
+            sessions = sessions[position + 1:]
+        return CheckoutSessionPage(
+            sessions=sessions[:limit], has_more=len(sessions) > limit
+        )
+
+    def construct_event(self, payload, signature):
+        try:
+            return json.loads(payload)
+        except ValueError as error:
+            raise InvalidWebhookError(str(error)) from error
+
+    def complete(self, session_id: str) -> None:
+        """Simulate the customer paying for a session"""
+        with self._lock:
+            self.sessions[session_id] = replace(
+                self.sessions[session_id],
+                status="complete",
+                payment_status="paid",
+            )
+
+    def _call(self) -> None:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.failure_rate
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise GatewayError("Simulated gateway failure")
+
+
+def _from_timestamp(timestamp: int | None) -> datetime | None:
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+@functools.cache
+def get_gateway() -> PaymentGateway:
+    """Return the gateway configured by settings.PAYMENT_GATEWAY"""
+    from payment.circuit_breaker import CircuitBreaker, CircuitBreakerGateway
+
+    config = settings.PAYMENT_GATEWAY
+    gateway = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+    if config.get("CIRCUIT_BREAKER") is not None:
+        breaker = CircuitBreaker(
+            **{
+                "shared_key": f"payment:circuit-breaker:{config['BACKEND']}",
+                **config["CIRCUIT_BREAKER"],
+            }
+        )
+        gateway = CircuitBreakerGateway(gateway, breaker)
+    return gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(*, setting, **kwargs):
+    if setting in (
+        "PAYMENT_GATEWAY", "STRIPE_SECRET_KEY", "STRIPE_WEBHOOK_SECRET"
+    ):
+        get_gateway.cache_clear()
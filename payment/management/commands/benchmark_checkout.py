@@ -0,0 +1,140 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import Borrowing
+from payment.gateways import get_gateway
+from payment.models import Payment
+from payment.services import enqueue_checkout, process_checkout_outbox
+
+
+class Command(BaseCommand):
+    """Django command to benchmark the checkout outbox without the network"""
+
+    help = (  # noqa: VNE003
+        "Create pending payments and drain their checkout outbox with "
+        "concurrent workers against the in-process fake gateway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.05,
+            help="Seconds every fake gateway call takes.",
+        )
+        parser.add_argument("--jitter", type=float, default=0.0)
+        parser.add_argument("--failure-rate", type=float, default=0.0)
+        parser.add_argument(
+            "--circuit-breaker",
+            action="store_true",
+            help="Wrap the fake gateway in the default circuit breaker.",
+        )
+        parser.add_argument(
+            "--use-configured-gateway",
+            action="store_true",
+            help="Call settings.PAYMENT_GATEWAY instead of the fake.",
+        )
+
+    def handle(self, *args, **options):
+        if options["use_configured_gateway"]:
+            self._run(options)
+            return
+
+        fake = {
+            "BACKEND": "payment.gateways.FakeGateway",
+            "OPTIONS": {
+                "latency": options["latency"],
+                "jitter": options["jitter"],
+                "failure_rate": options["failure_rate"],
+            },
+        }
+        if options["circuit_breaker"]:
+            fake["CIRCUIT_BREAKER"] = {}
+        with override_settings(PAYMENT_GATEWAY=fake):
+            self._run(options)
+
+    def _run(self, options):
+        user, _ = get_user_model().objects.get_or_create(
+            email="benchmark-checkout@library.local"
+        )
+        book = Book.objects.create(
+            title=f"Benchmark {time.time_ns()}",
+            author="Benchmark",
+            cover=Book.CoverChoices.SOFT,
+            inventory=options["payments"],
+            daily_fee="1.00",
+        )
+        borrowings = [
+            Borrowing(
+                book=book,
+                user=user,
+                expected_return_date=timezone.now().date() + timedelta(7),
+            )
+            for _ in range(options["payments"])
+        ]
+        for borrowing in borrowings:
+            borrowing.set_price()
+        Borrowing.objects.bulk_create(borrowings)
+        payments = Payment.objects.bulk_create(
+            Payment(borrowing=borrowing, money_to_pay=book.daily_fee)
+            for borrowing in borrowings
+        )
+        for payment in payments:
+            enqueue_checkout(payment, "http://benchmark.local/api/payment/")
+
+        results = {"created": 0, "failed": 0}
+        lock = threading.Lock()
+        gateway = get_gateway()
+
+        def worker():
+            created = failed = 0
+            try:
+                while True:
+                    batch_created, batch_failed = process_checkout_outbox(
+                        options["batch_size"]
+                    )
+                    if not batch_created + batch_failed:
+                        break
+                    created += batch_created
+                    failed += batch_failed
+            finally:
+                connection.close()
+                with lock:
+                    results["created"] += created
+                    results["failed"] += failed
+
+        threads = [
+            threading.Thread(target=worker) for _ in range(options["workers"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        ready = Payment.objects.filter(
+            borrowing__book=book, session_id__isnull=False
+        ).count()
+        self.stdout.write(
+            f"workers={options['workers']} payments={options['payments']}"
+        )
+        self.stdout.write(
+            f"created={results['created']} failed={results['failed']} "
+            f"ready={ready} elapsed={elapsed:.2f}s "
+            f"throughput={results['created'] / elapsed:.0f} sessions/s"
+        )
+        self.stdout.write(f"gateway stats: {gateway.stats()}")
+
+        book.delete()
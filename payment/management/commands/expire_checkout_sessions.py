@@ -0,0 +1,32 @@
+import time
+
+from django.core.management import BaseCommand
+
+from payment.services import (
+    STALE_CHECKOUT_BATCH_SIZE,
+    expire_stale_checkouts,
+)
+
+
+class Command(BaseCommand):
+    """Django command to expire checkout sessions of stale payments"""
+
+    help = (  # noqa: VNE003
+        "Expire at the gateway the checkout sessions of pending payments "
+        "that are past their expiry time, so they are never paid or "
+        "redirected to again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=STALE_CHECKOUT_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        expired, paid, failed = expire_stale_checkouts(options["batch_size"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Expired {expired} sessions, found {paid} paid, {failed} "
+            f"failed in {elapsed:.2f}s."
+        )
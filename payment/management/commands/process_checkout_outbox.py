@@ -0,0 +1,35 @@
+import time
+
+from django.core.management import BaseCommand
+
+from payment.services import process_checkout_outbox
+
+
+class Command(BaseCommand):
+    """Django command to create pending checkout sessions from the outbox"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of draining it once.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep when the outbox has nothing due.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            created, failed = process_checkout_outbox(options["batch_size"])
+            if created or failed:
+                self.stdout.write(
+                    f"Created {created} checkout sessions, {failed} failed."
+                )
+            if created + failed < options["batch_size"]:
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
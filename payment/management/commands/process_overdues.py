@@ -0,0 +1,28 @@
+import time
+
+from django.core.management import BaseCommand
+
+from payment.services import OVERDUE_CHUNK_SIZE, process_overdues
+
+
+class Command(BaseCommand):
+    """Django command to bill fines of overdue borrowings still out"""
+
+    help = (  # noqa: VNE003
+        "Create or refresh pending FINE payments of overdue borrowings "
+        "that have not been returned. Safe to run on several nodes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=OVERDUE_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        created, refreshed = process_overdues(options["chunk_size"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Created {created} fines, refreshed {refreshed} "
+            f"in {elapsed:.2f}s."
+        )
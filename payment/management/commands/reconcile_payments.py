@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from payment.services import RECONCILE_PAGE_SIZE, reconcile_payments
+
+
+class Command(BaseCommand):
+    """Django command to reconcile payments with the gateway sessions"""
+
+    help = (  # noqa: VNE003
+        "List the checkout sessions created at the gateway in the last "
+        "--hours hours, apply the statuses missed by webhooks to the "
+        "payments and print the differences."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=48,
+            help="Age in hours of the oldest session to reconcile.",
+        )
+        parser.add_argument(
+            "--page-size", type=int, default=RECONCILE_PAGE_SIZE
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only print the differences.",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        started = time.perf_counter()
+        report = reconcile_payments(
+            now - timedelta(hours=options["hours"]),
+            now,
+            options["page_size"],
+            options["dry_run"],
+        )
+        elapsed = time.perf_counter() - started
+
+        for payment_id, session_id in report.paid:
+            self.stdout.write(
+                f"~ payment {payment_id} ({session_id}): PENDING -> PAID"
+            )
+        for payment_id, session_id in report.expired:
+            self.stdout.write(
+                f"~ payment {payment_id} ({session_id}): session expired"
+            )
+        for payment_id, session_id in report.unpaid:
+            self.stdout.write(
+                f"! payment {payment_id} ({session_id}): PAID, "
+                f"session not paid"
+            )
+        for session_id in report.unmatched:
+            self.stdout.write(f"? session {session_id}: no payment")
+
+        self.stdout.write(
+            f"{'Found' if options['dry_run'] else 'Applied'} "
+            f"{len(report.paid)} paid and {len(report.expired)} expired, "
+            f"{len(report.unpaid)} unpaid and {len(report.unmatched)} "
+            f"unmatched of {report.sessions} sessions in {report.pages} "
+            f"gateway calls, {elapsed:.2f}s."
+        )
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0005_payment_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="payment",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "PENDING"), ("type", "FINE")),
+                fields=("borrowing",),
+                name="payment_one_pending_fine",
+            ),
+        ),
+    ]
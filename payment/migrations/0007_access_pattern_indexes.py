@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:37
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("payment", "0006_payment_one_pending_fine"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["borrowing", "type"],
+                name="payment_pending_borrowing_idx",
+            ),
+        ),
+    ]
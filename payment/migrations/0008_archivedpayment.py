@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0007_borrowing_archive"),
+        ("payment", "0007_access_pattern_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedPayment",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("PENDING", "Pending"), ("PAID", "Paid")], max_length=7
+                    ),
+                ),
+                (
+                    "type",
+                    models.CharField(
+                        choices=[("PAYMENT", "Payment"), ("FINE", "Fine")], max_length=7
+                    ),
+                ),
+                ("session_url", models.URLField(blank=True, max_length=511)),
+                ("session_id", models.CharField(blank=True, max_length=255, null=True)),
+                ("money_to_pay", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("updated_at", models.DateTimeField()),
+                (
+                    "borrowing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payments",
+                        to="borrowing.archivedborrowing",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0009_payment_checkout_group"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="session_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Sessions created so far kept the 24 hour Stripe default.
+        migrations.RunSQL(
+            """
+            UPDATE payment_payment
+            SET session_expires_at = updated_at + interval '24 hours'
+            WHERE session_id IS NOT NULL
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
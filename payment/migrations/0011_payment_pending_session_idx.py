@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:58
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("payment", "0010_payment_session_expires_at"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(
+                    ("session_id__isnull", False), ("status", "PENDING")
+                ),
+                fields=["session_expires_at", "id"],
+                name="payment_pending_session_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0011_payment_pending_session_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="created_at",
+            field=models.DateTimeField(null=True),
+        ),
+        # The last update is the closest record of when a payment was made.
+        migrations.RunSQL(
+            "UPDATE payment_payment SET created_at = updated_at",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
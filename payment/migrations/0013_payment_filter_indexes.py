@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:05
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("payment", "0012_payment_created_at"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                fields=["status", "type", "-id"],
+                name="payment_status_type_id_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                fields=["created_at", "id"],
+                name="payment_created_id_idx",
+            ),
+        ),
+    ]
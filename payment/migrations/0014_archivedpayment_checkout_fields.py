@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0013_payment_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedpayment",
+            name="session_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="archivedpayment",
+            name="checkout_group",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="archivedpayment",
+            name="created_at",
+            field=models.DateTimeField(null=True),
+        ),
+        # Payments archived so far lost their creation time; the last
+        # update is the closest record of it, as in 0012.
+        migrations.RunSQL(
+            "UPDATE payment_archivedpayment SET created_at = updated_at",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="archivedpayment",
+            name="created_at",
+            field=models.DateTimeField(),
+        ),
+    ]
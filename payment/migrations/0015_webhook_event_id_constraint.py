@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0014_archivedpayment_checkout_fields"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="webhookevent",
+            name="event_id",
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name="webhookevent",
+            constraint=models.UniqueConstraint(
+                fields=("event_id",), name="payment_webhook_event_id_unique"
+            ),
+        ),
+    ]
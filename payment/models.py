@@ -1,6 +1,8 @@
 from django.db import models
+from django.utils import timezone
 
-from borrowing.models import Borrowing
+from borrowing.models import ArchivedBorrowing, Borrowing
+from library_service.querysets import TimestampedQuerySet
 
 
 class Payment(models.Model):
@@ -23,10 +25,109 @@ class Payment(models.Model):
         related_name="payments",
         on_delete=models.CASCADE,
     )
-    session_url = models.URLField(max_length=511)
-    session_id = models.CharField(max_length=255, unique=True)
+    session_url = models.URLField(max_length=511, blank=True)
+    session_id = models.CharField(
+        max_length=255, null=True, blank=True, db_index=True
+    )
+    session_expires_at = models.DateTimeField(null=True, blank=True)
+    checkout_group = models.UUIDField(null=True, blank=True, db_index=True)
     money_to_pay = models.DecimalField(
         max_digits=10,
         decimal_places=2,
         default=0
     )
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TimestampedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "type", "-id"],
+                name="payment_status_type_id_idx",
+            ),
+            models.Index(
+                fields=["created_at", "id"],
+                name="payment_created_id_idx",
+            ),
+            models.Index(
+                fields=["session_expires_at", "id"],
+                condition=models.Q(
+                    status="PENDING", session_id__isnull=False
+                ),
+                name="payment_pending_session_idx",
+            ),
+            models.Index(
+                fields=["borrowing", "type"],
+                condition=models.Q(status="PENDING"),
+                name="payment_pending_borrowing_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["borrowing"],
+                condition=models.Q(type="FINE", status="PENDING"),
+                name="payment_one_pending_fine",
+            )
+        ]
+
+    @property
+    def has_live_session(self) -> bool:
+        """Whether the checkout session URL can still be paid"""
+        return bool(self.session_url) and (
+            self.session_expires_at is None
+            or self.session_expires_at > timezone.now()
+        )
+
+
+class ArchivedPayment(models.Model):
+    """Payment moved to the archive together with its borrowing"""
+
+    id = models.BigIntegerField(primary_key=True)  # noqa: VNE003
+    status = models.CharField(max_length=7, choices=Payment.STATUSES)
+    type = models.CharField(  # noqa: VNE003
+        max_length=7, choices=Payment.TYPES
+    )
+    borrowing = models.ForeignKey(
+        to=ArchivedBorrowing,
+        related_name="payments",
+        on_delete=models.CASCADE,
+    )
+    session_url = models.URLField(max_length=511, blank=True)
+    session_id = models.CharField(max_length=255, null=True, blank=True)
+    session_expires_at = models.DateTimeField(null=True, blank=True)
+    checkout_group = models.UUIDField(null=True, blank=True)
+    money_to_pay = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+
+class PaymentOutbox(models.Model):
+    """Checkout session still to be created at the gateway for a payment"""
+
+    payment = models.OneToOneField(
+        to=Payment,
+        related_name="outbox",
+        on_delete=models.CASCADE,
+    )
+    domain_url = models.URLField(max_length=511)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class WebhookEvent(models.Model):
+    """Gateway webhook event that has already been processed"""
+
+    event_id = models.CharField(max_length=255)
+    type = models.CharField(max_length=255)  # noqa: VNE003
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["event_id"], name="payment_webhook_event_id_unique"
+            )
+        ]
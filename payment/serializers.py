@@ -25,5 +25,22 @@ class PaymentDetailSerializer(serializers.ModelSerializer):
             "borrowing",
             "session_url",
             "session_id",
+            "session_expires_at",
             "money_to_pay",
+            "created_at",
         )
+
+
+class PaymentFilterSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Payment.STATUSES, required=False)
+    type = serializers.ChoiceField(  # noqa: VNE003
+        choices=Payment.TYPES, required=False
+    )
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+
+class PaymentSummarySerializer(serializers.Serializer):
+    pending = serializers.DecimalField(max_digits=None, decimal_places=2)
+    paid = serializers.DecimalField(max_digits=None, decimal_places=2)
+    fines = serializers.DecimalField(max_digits=None, decimal_places=2)
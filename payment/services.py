@@ -0,0 +1,651 @@
+import hashlib
+import math
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import Borrowing
+from payment.gateways import (
+    CheckoutSession,
+    GatewayError,
+    LineItem,
+    get_gateway,
+)
+from payment.models import Payment, PaymentOutbox, WebhookEvent
+
+OUTBOX_LEASE = timedelta(minutes=2)
+OUTBOX_MAX_BACKOFF = timedelta(minutes=10)
+OVERDUE_CHUNK_SIZE = 1000
+STALE_CHECKOUT_BATCH_SIZE = 100
+RECONCILE_PAGE_SIZE = 100
+SESSION_CHECK_POLL_INTERVAL = 0.05
+
+
+@dataclass
+class Reconciliation:
+    """Differences between the gateway sessions and the local payments"""
+
+    pages: int = 0
+    sessions: int = 0
+    paid: list[tuple[int, str]] = field(default_factory=list)
+    expired: list[tuple[int, str]] = field(default_factory=list)
+    unpaid: list[tuple[int, str]] = field(default_factory=list)
+    unmatched: list[str] = field(default_factory=list)
+
+
+def create_checkout_session(
+        domain_url: str,
+        payments: list[Payment],
+        idempotency_key: str | None = None,
+) -> CheckoutSession:
+    """
+    Create one checkout session with a line item for every payment.
+
+    Payments must come with their borrowing and book loaded. The session
+    expires CHECKOUT_SESSION_TTL seconds from now.
+    """
+    line_items = []
+    product_ids = {}
+    for payment in payments:
+        book = payment.borrowing.book
+        if book.pk not in product_ids:
+            product_ids[book.pk] = get_book_product_id(book)
+        line_items.append(
+            LineItem(
+                name=book.title,
+                amount=int(payment.money_to_pay * 100),
+                product_id=product_ids[book.pk],
+            )
+        )
+    return get_gateway().create_checkout_session(
+        success_url=domain_url + "success/",
+        cancel_url=domain_url + "cancelled/",
+        line_items=line_items,
+        idempotency_key=idempotency_key,
+        expires_at=timezone.now()
+        + timedelta(seconds=settings.CHECKOUT_SESSION_TTL),
+    )
+
+
+def get_book_product_id(book: Book) -> str:
+    """
+    Gateway product of the book, created on its first checkout.
+
+    The id is stored on the book, so checkouts of a loaded book cost no
+    query. A book loaded before its product was stored reads it back, and
+    the idempotency key stored on the book makes concurrent first
+    checkouts share a product. It is unique to the row, so databases of
+    other environments on the same gateway account never reuse a
+    product, and renaming a book replaces it.
+    """
+    if book.gateway_product_id:
+        return book.gateway_product_id
+
+    books = Book.objects.filter(pk=book.pk)
+    book.gateway_product_id, book.gateway_product_key = books.values_list(
+        "gateway_product_id", "gateway_product_key"
+    ).get()
+    if not book.gateway_product_id:
+        book.gateway_product_id = get_gateway().create_product(
+            name=book.title,
+            idempotency_key=f"book-product-{book.gateway_product_key}",
+        )
+        books.filter(
+            gateway_product_id="",
+            gateway_product_key=book.gateway_product_key,
+        ).update(gateway_product_id=book.gateway_product_id)
+    return book.gateway_product_id
+
+
+def checkout_payments(payment: Payment) -> list[Payment]:
+    """Pending payments paid through the same checkout session as this one"""
+    if payment.checkout_group is None:
+        return [payment] if payment.status == "PENDING" else []
+    return list(
+        Payment.objects.filter(
+            checkout_group=payment.checkout_group, status="PENDING"
+        )
+        .select_related("borrowing__book")
+        .order_by("pk")
+    )
+
+
+def check_checkout_session(session_id: str) -> CheckoutSession:
+    """
+    Read a checkout session from the gateway for a status check.
+
+    The session is cached for PAYMENT_STATUS_CACHE_TIMEOUT seconds. Of the
+    concurrent checks of one session, in any process, the one that adds the
+    check lock to the shared cache calls the gateway, and the others poll
+    the cache for its session or error, for at most
+    PAYMENT_STATUS_CHECK_TIMEOUT seconds.
+    """
+    key = f"payment:session:{session_id}"
+    lock = f"payment:session-check:{session_id}"
+    timeout = settings.PAYMENT_STATUS_CHECK_TIMEOUT
+    check = uuid.uuid4().hex
+    while True:
+        session = cache.get(key)
+        if session is not None:
+            return session
+        if cache.add(lock, check, math.ceil(timeout)):
+            break
+        if running := cache.get(lock):
+            return _await_session_check(f"{lock}:{running}", timeout)
+
+    try:
+        session = get_gateway().retrieve_checkout_session(session_id)
+    except BaseException as error:
+        cache.set(
+            f"{lock}:{check}",
+            str(error) or type(error).__name__,
+            math.ceil(timeout),
+        )
+        raise
+    else:
+        cache.set(key, session, settings.PAYMENT_STATUS_CACHE_TIMEOUT)
+        cache.set(f"{lock}:{check}", session, math.ceil(timeout))
+        return session
+    finally:
+        if cache.get(lock) == check:
+            cache.delete(lock)
+
+
+def _await_session_check(result_key: str, timeout: float) -> CheckoutSession:
+    """Poll for the outcome of a check made by another caller"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = cache.get(result_key)
+        if isinstance(result, CheckoutSession):
+            return result
+        if result is not None:
+            raise GatewayError(result)
+        time.sleep(SESSION_CHECK_POLL_INTERVAL)
+    raise GatewayError("Payment status check timed out")
+
+
+def enqueue_checkout(payment: Payment, domain_url: str) -> None:
+    """
+    Ask the outbox worker to create a checkout session for the payment.
+
+    Payments of a checkout group share one outbox entry, kept on the first
+    payment of the group.
+    """
+    if payment.checkout_group is not None:
+        payment = Payment.objects.filter(
+            checkout_group=payment.checkout_group
+        ).order_by("pk").first()
+    PaymentOutbox.objects.bulk_create(
+        [PaymentOutbox(payment=payment, domain_url=domain_url)],
+        ignore_conflicts=True,
+    )
+
+
+def site_payment_url(payment_id: int) -> str:
+    """Absolute URL of a payment for checkouts enqueued outside a request"""
+    return settings.SITE_URL + reverse(
+        "payment:payment-detail", kwargs={"pk": payment_id}
+    )
+
+
+def enqueue_checkouts(domain_urls: dict[int, str]) -> None:
+    """Enqueue checkouts of ungrouped payments, keyed by payment id"""
+    PaymentOutbox.objects.bulk_create(
+        [
+            PaymentOutbox(payment_id=payment_id, domain_url=domain_url)
+            for payment_id, domain_url in domain_urls.items()
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def claim_outbox_entries(batch_size: int) -> list[PaymentOutbox]:
+    """
+    Lease a batch of due outbox entries to this worker.
+
+    Rows locked by another worker are skipped, and a leased entry becomes
+    due again once the lease runs out, so a crashed worker does not lose it.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            PaymentOutbox.objects.select_for_update(
+                skip_locked=True, of=("self",)
+            )
+            .select_related("payment__borrowing__book")
+            .filter(available_at__lte=now)
+            .order_by("available_at")[:batch_size]
+        )
+        PaymentOutbox.objects.filter(
+            pk__in=[entry.pk for entry in entries]
+        ).update(attempts=F("attempts") + 1, available_at=now + OUTBOX_LEASE)
+    return entries
+
+
+def release_checkout_sessions(entry: PaymentOutbox) -> list[Payment]:
+    """
+    Expire the sessions of payments checked out again, re-price their fines
+    and return the payments left to check out.
+
+    A session paid in the meantime marks its payments paid, and only the
+    rest of their fines is billed, with a checkout of its own.
+    """
+    gateway = get_gateway()
+    payments = checkout_payments(entry.payment)
+    for session_id in {payment.session_id for payment in payments} - {None}:
+        session = expire_checkout_session(gateway, session_id)
+        if session.payment_status != "paid":
+            Payment.objects.filter(
+                session_id=session_id, status="PENDING"
+            ).update(session_id=None, session_url="", session_expires_at=None)
+    fined = [
+        payment.borrowing_id for payment in payments if payment.type == "FINE"
+    ]
+    if fined:
+        with transaction.atomic():
+            borrowings = Borrowing.objects.filter(pk__in=fined)
+            bill_fines(borrowings)
+            enqueue_fine_checkouts(
+                borrowings, lambda fine: site_payment_url(fine.pk)
+            )
+    entry.payment.refresh_from_db()
+    return checkout_payments(entry.payment)
+
+
+def process_outbox_entry(entry: PaymentOutbox) -> bool:
+    """
+    Create the checkout session for a claimed entry outside any lock.
+
+    Sessions the payments already have are expired first, see
+    release_checkout_sessions(). The new session is kept only if its
+    payments are still pending at the amounts it bills, otherwise the
+    entry is tried again with the amounts of the moment.
+    """
+    try:
+        payments = checkout_payments(entry.payment)
+        if any(payment.session_id for payment in payments):
+            payments = release_checkout_sessions(entry)
+        if payments:
+            billed = {payment.pk: payment.money_to_pay for payment in payments}
+            digest = hashlib.sha256(
+                repr(sorted(billed.items())).encode()
+            ).hexdigest()[:16]
+            session = create_checkout_session(
+                entry.domain_url,
+                payments,
+                idempotency_key=f"payment-outbox-{entry.pk}-{digest}",
+            )
+    except GatewayError as error:
+        backoff = min(
+            timedelta(seconds=2 ** (entry.attempts + 1)), OUTBOX_MAX_BACKOFF
+        )
+        PaymentOutbox.objects.filter(pk=entry.pk).update(
+            last_error=str(error),
+            available_at=timezone.now() + backoff,
+        )
+        return False
+    if not payments:
+        PaymentOutbox.objects.filter(pk=entry.pk).delete()
+        return True
+
+    with transaction.atomic():
+        current = dict(
+            Payment.objects.select_for_update()
+            .filter(pk__in=billed, status="PENDING")
+            .values_list("pk", "money_to_pay")
+        )
+        if current != billed:
+            PaymentOutbox.objects.filter(pk=entry.pk).update(
+                available_at=timezone.now()
+            )
+            return False
+        Payment.objects.filter(pk__in=billed).update(
+            session_url=session.url,
+            session_id=session.id,
+            session_expires_at=session.expires_at,
+        )
+        PaymentOutbox.objects.filter(pk=entry.pk).delete()
+    return True
+
+
+def process_checkout_outbox(batch_size: int = 50) -> tuple[int, int]:
+    """
+    Process one batch of the outbox, return (created, failed) counts.
+
+    Nothing is claimed while the gateway circuit is open, and entries left
+    in a batch when it opens are released until it may close again.
+    """
+    gateway = get_gateway()
+    if gateway.retry_after():
+        return 0, 0
+
+    created = failed = 0
+    entries = claim_outbox_entries(batch_size)
+    for position, entry in enumerate(entries):
+        if process_outbox_entry(entry):
+            created += 1
+            continue
+        failed += 1
+        if retry_after := gateway.retry_after():
+            PaymentOutbox.objects.filter(
+                pk__in=[rest.pk for rest in entries[position + 1:]]
+            ).update(
+                attempts=F("attempts") - 1,
+                available_at=timezone.now() + timedelta(seconds=retry_after),
+            )
+            break
+    return created, failed
+
+
+def expire_stale_checkouts(
+        batch_size: int = STALE_CHECKOUT_BATCH_SIZE,
+) -> tuple[int, int, int]:
+    """
+    Expire the checkout sessions of pending payments that are past their
+    expiry time.
+
+    Payments are walked in batches along the pending session index and
+    every session is expired at the gateway, so a late customer cannot pay
+    it. Its payments forget the dead session and get a new one only when
+    checkout is requested again. A session paid in the meantime marks its
+    payments paid instead, and sessions the gateway failed on are left for
+    the next run. Return the (expired, paid, failed) session counts.
+    """
+    gateway = get_gateway()
+    stale = Payment.objects.filter(
+        status="PENDING",
+        session_id__isnull=False,
+        session_expires_at__lte=timezone.now(),
+    ).order_by("session_expires_at", "pk")
+    expired = paid = failed = 0
+    last = None
+    while not gateway.retry_after():
+        batch = stale
+        if last is not None:
+            batch = batch.filter(
+                Q(session_expires_at__gt=last[0])
+                | Q(session_expires_at=last[0], pk__gt=last[1])
+            )
+        rows = list(
+            batch.values_list("session_expires_at", "pk", "session_id")[
+                :batch_size
+            ]
+        )
+        if not rows:
+            break
+        last = rows[-1]
+        for session_id in dict.fromkeys(row[2] for row in rows):
+            try:
+                session = expire_checkout_session(gateway, session_id)
+            except GatewayError:
+                failed += 1
+                continue
+            if session.payment_status == "paid":
+                paid += 1
+            else:
+                Payment.objects.filter(
+                    session_id=session_id, status="PENDING"
+                ).update(session_id=None, session_url="")
+                expired += 1
+    return expired, paid, failed
+
+
+def expire_checkout_session(gateway, session_id: str) -> CheckoutSession:
+    """
+    Expire a checkout session at the gateway so it can no longer be paid.
+
+    A session paid in the meantime marks its pending payments paid.
+    """
+    session = gateway.expire_checkout_session(session_id)
+    if session.payment_status == "paid":
+        Payment.objects.filter(
+            session_id=session_id, status="PENDING"
+        ).update(status="PAID")
+    return session
+
+
+def reconcile_payments(
+        created_after: datetime,
+        created_before: datetime,
+        page_size: int = RECONCILE_PAGE_SIZE,
+        dry_run: bool = False,
+) -> Reconciliation:
+    """
+    Match the checkout sessions created at the gateway in a time window
+    against the local payments, for payments whose webhook never arrived.
+
+    Sessions are listed a page at a time and every page is matched with one
+    query on session_id. Pending payments of paid sessions are marked paid
+    and those of expired sessions drop the session, in bulk updates. Paid
+    payments whose session is not paid and sessions without a payment are
+    only reported.
+    """
+    gateway = get_gateway()
+    report = Reconciliation()
+    starting_after = None
+    while True:
+        page = gateway.list_checkout_sessions(
+            created_after=created_after,
+            created_before=created_before,
+            starting_after=starting_after,
+            limit=page_size,
+        )
+        report.pages += 1
+        report.sessions += len(page.sessions)
+        sessions = {session.id: session for session in page.sessions}
+        matched = set()
+        paid, expired = [], []
+        for payment_id, session_id, payment_status in Payment.objects.filter(
+            session_id__in=sessions
+        ).values_list("pk", "session_id", "status"):
+            matched.add(session_id)
+            session = sessions[session_id]
+            if payment_status == "PENDING":
+                if session.payment_status == "paid":
+                    paid.append(session_id)
+                    report.paid.append((payment_id, session_id))
+                elif session.status == "expired":
+                    expired.append(session_id)
+                    report.expired.append((payment_id, session_id))
+            elif session.payment_status != "paid":
+                report.unpaid.append((payment_id, session_id))
+        report.unmatched.extend(
+            session_id for session_id in sessions if session_id not in matched
+        )
+
+        if not dry_run:
+            Payment.objects.filter(
+                session_id__in=paid, status="PENDING"
+            ).update(status="PAID")
+            Payment.objects.filter(
+                session_id__in=expired, status="PENDING"
+            ).update(session_id=None, session_url="")
+
+        if not page.has_more or not page.sessions:
+            return report
+        starting_after = page.sessions[-1].id
+
+
+def handle_webhook_event(event) -> bool:
+    """
+    Apply a verified checkout webhook event to the local payments.
+
+    Every event id is recorded in the same transaction as its effect, so
+    redelivered events are skipped and a failed one is retried whole. Any
+    other database error fails the delivery, so the gateway sends it again.
+    Return False for an event that has already been processed.
+    """
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(
+                event_id=event["id"], type=event["type"]
+            )
+            _apply_checkout_event(event["type"], event["data"]["object"])
+    except IntegrityError as error:
+        constraint = getattr(
+            getattr(error.__cause__, "diag", None), "constraint_name", None
+        )
+        if constraint != "payment_webhook_event_id_unique":
+            raise
+        return False
+    return True
+
+
+def _apply_checkout_event(event_type: str, session) -> None:
+    payments = Payment.objects.filter(session_id=session["id"])
+
+    if event_type in (
+        "checkout.session.completed",
+        "checkout.session.async_payment_succeeded",
+    ):
+        if session["payment_status"] == "paid":
+            payments.exclude(status="PAID").update(status="PAID")
+
+    elif event_type == "checkout.session.expired":
+        payments.filter(status="PENDING").update(
+            session_id=None, session_url=""
+        )
+
+
+def _fine_dues(borrowings):
+    """Borrowings still owing a fine, annotated with the fine due"""
+    paid_fines = (
+        Payment.objects.filter(
+            borrowing=OuterRef("pk"), type="FINE", status="PAID"
+        )
+        .order_by()
+        .values("borrowing")
+        .annotate(total=Sum("money_to_pay"))
+        .values("total")
+    )
+    return (
+        borrowings.with_fine()
+        .annotate(
+            due=F("fine_amount")
+            - Coalesce(Subquery(paid_fines), Decimal(0))
+        )
+        .filter(due__gt=0)
+        .order_by()
+    )
+
+
+def bill_fines(borrowings) -> tuple[int, int]:
+    """
+    Create or refresh the pending FINE payment of every borrowing.
+
+    The fine still due is the fine computed by the database minus the fines
+    already paid. Only fines without a checkout session are re-priced, so
+    billing makes no gateway calls: a fine whose session bills an older
+    amount keeps it until the borrowing is returned, see
+    enqueue_fine_checkouts(). Return the (created, refreshed) counts.
+    """
+    dues = _fine_dues(borrowings)
+    pending_fines = Payment.objects.filter(type="FINE", status="PENDING")
+    refreshed = (
+        pending_fines.filter(
+            borrowing__in=borrowings.values("pk"), session_id=None
+        )
+        .alias(
+            due=Subquery(
+                dues.filter(pk=OuterRef("borrowing_id")).values("due")
+            )
+        )
+        .filter(due__isnull=False)
+        .exclude(money_to_pay=F("due"))
+        .update(money_to_pay=F("due"), updated_at=timezone.now())
+    )
+    created = Payment.objects.bulk_create(
+        Payment(
+            borrowing_id=borrowing_id,
+            type="FINE",
+            status="PENDING",
+            money_to_pay=due,
+        )
+        for borrowing_id, due in dues.exclude(
+            Exists(pending_fines.filter(borrowing=OuterRef("pk")))
+        ).values_list("pk", "due")
+    )
+    return len(created), refreshed
+
+
+def enqueue_fine_checkouts(borrowings, payment_url) -> dict[int, Decimal]:
+    """
+    Enqueue checkouts of the pending fines of returned borrowings.
+
+    Fines without a session get one, and so does a fine whose session
+    bills an older amount: the outbox worker expires that session at the
+    gateway before checking the fine out again at its final amount.
+    ``payment_url`` maps a fine to the URL its checkout returns to.
+    Return the fine billed per borrowing.
+    """
+    fines = list(
+        Payment.objects.filter(
+            borrowing__in=borrowings.values("pk"),
+            type="FINE",
+            status="PENDING",
+        ).annotate(
+            due=Coalesce(
+                Subquery(
+                    _fine_dues(borrowings)
+                    .filter(pk=OuterRef("borrowing_id"))
+                    .values("due")
+                ),
+                F("money_to_pay"),
+            )
+        )
+    )
+    enqueue_checkouts(
+        {
+            fine.pk: payment_url(fine)
+            for fine in fines
+            if fine.session_id is None or fine.money_to_pay != fine.due
+        }
+    )
+    return {fine.borrowing_id: fine.due for fine in fines}
+
+
+def process_overdues(
+        chunk_size: int = OVERDUE_CHUNK_SIZE,
+) -> tuple[int, int]:
+    """
+    Bill the running fines of overdue borrowings that are still out.
+
+    Overdue borrowings are walked in primary key chunks, each locked in its
+    own transaction. Chunks locked by another worker are skipped, so several
+    workers can run at once, and running again only refreshes amounts.
+    No checkout is enqueued for a fine that keeps running: its customer
+    asks for one, or it gets one once the book is returned.
+    Return the (created, refreshed) counts.
+    """
+    today = timezone.now().date()
+    overdue = Borrowing.objects.filter(
+        actual_return_date__isnull=True, expected_return_date__lt=today
+    )
+    created = refreshed = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            pks = list(
+                overdue.select_for_update(skip_locked=True)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not pks:
+                break
+            new, changed = bill_fines(Borrowing.objects.filter(pk__in=pks))
+        created += new
+        refreshed += changed
+        last_pk = pks[-1]
+    return created, refreshed
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from library_service.versions import invalidate, model_version
+from payment.models import Payment
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def invalidate_payments_on_change(sender, **kwargs):
+    invalidate(model_version(sender))
@@ -1,5 +1,15 @@
+import hashlib
+import hmac
+import itertools
+import json
+import time
+from unittest.mock import patch
+
+from payment.gateways import StripeGateway
 from payment.models import Payment
 
+WEBHOOK_SECRET = "whsec_test"
+
 
 def sample_payment(borrowing, **params):
     defaults = {
@@ -12,3 +22,50 @@ def sample_payment(borrowing, **params):
     }
     defaults.update(params)
     return Payment.objects.create(**defaults)
+
+
+def signed_webhook(event_id, event_type, session, secret=WEBHOOK_SECRET):
+    payload = json.dumps(
+        {
+            "id": event_id,
+            "object": "event",
+            "type": event_type,
+            "data": {"object": session},
+        }
+    )
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(),
+        f"{timestamp}.{payload}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+    return payload, f"t={timestamp},v1={signature}"
+
+
+def stripe_api(responses):
+    """
+    Patch the Stripe API requests of StripeGateway. ``responses`` maps
+    "METHOD /v1/path" to a response, or to a list answered one per call.
+    """
+    answers = {
+        route: iter(response)
+        if isinstance(response, list)
+        else itertools.repeat(response)
+        for route, response in responses.items()
+    }
+
+    def request(method, url, params=None, idempotency_key=None):
+        return next(answers[f"{method.upper()} {url}"])
+
+    return patch.object(StripeGateway, "_request", side_effect=request)
+
+
+def stripe_requests(api, route):
+    """(params, idempotency key) of the patched requests to a route"""
+    method, url = route.split()
+    requests = []
+    for call in api.call_args_list:
+        if call.args[:2] == (method.lower(), url):
+            params = call.args[2] if len(call.args) > 2 else None
+            requests.append((params, call.kwargs.get("idempotency_key")))
+    return requests
@@ -1,22 +1,82 @@
+import io
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
 from unittest.mock import patch
-from django.test import TestCase
+import stripe
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from borrowing.tests import create_user, sample_book, sample_borrowing
-from payment.models import Payment
+from book.models import Book
+from borrowing.models import Borrowing
+from borrowing.tests import (
+    create_user,
+    days_from_today,
+    sample_book,
+    sample_borrowing,
+)
+from payment.circuit_breaker import CircuitBreaker, CircuitOpenError
+from payment.gateways import (
+    FakeGateway,
+    GatewayError,
+    StripeGateway,
+    get_gateway,
+)
+from payment.models import Payment, PaymentOutbox, WebhookEvent
 from payment.serializers import PaymentSerializer
-from payment.tests import sample_payment
+from payment.services import (
+    check_checkout_session,
+    claim_outbox_entries,
+    enqueue_checkout,
+    expire_stale_checkouts,
+    process_checkout_outbox,
+    process_overdues,
+    reconcile_payments,
+)
+from payment.tests import (
+    WEBHOOK_SECRET,
+    sample_payment,
+    signed_webhook,
+    stripe_api,
+    stripe_requests,
+)
 
 PAYMENTS_URL = reverse("payment:payment-list")
 BORROWING_URL = reverse("borrowing:borrowing-list")
+WEBHOOK_URL = reverse("payment:payment-webhook")
 
 
 def success_url(payment_id):
     return reverse("payment:payment-success", args=[payment_id])
 
 
+FAKE_GATEWAY = {"BACKEND": "payment.gateways.FakeGateway"}
+STRIPE_GATEWAY = {"BACKEND": "payment.gateways.StripeGateway"}
+BREAKER_GATEWAY = {
+    "BACKEND": "payment.gateways.FakeGateway",
+    "CIRCUIT_BREAKER": {"window": 4, "min_calls": 2, "open_duration": 30},
+}
+GATEWAY_URL = reverse("payment:payment-gateway")
+SUMMARY_URL = reverse("payment:payment-summary")
+EXPORT_URL = reverse("payment:payment-export")
+
+
+def detail_url(payment_id):
+    return reverse("payment:payment-detail", args=[payment_id])
+
+
+def checkout_url(payment_id):
+    return reverse("payment:payment-checkout", args=[payment_id])
+
+
 class UnauthenticatedPaymentsApiTest(TestCase):
     def setUp(self) -> None:
         self.client = APIClient()
@@ -55,13 +115,22 @@ class AuthenticatedPaymentsApiTest(TestCase):
         serializer1 = PaymentSerializer(payment_first_user)
         serializer2 = PaymentSerializer(payment_second_user)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data["results"])
+        self.assertNotIn(serializer2.data, res.data["results"])
 
-    def test_create_payment_for_borrowing(self):
+    @stripe_api(
+        {
+            "POST /v1/products": {"id": "test_product"},
+            "POST /v1/checkout/sessions": {
+                "id": "test_session",
+                "url": "https://checkout.stripe.com/c/pay/test_session",
+            },
+        }
+    )
+    def test_create_payment_for_borrowing(self, api):
         book = sample_book()
 
-        payload = {"expected_return_date": "2023-12-12", "book": book.id}
+        payload = {"expected_return_date": days_from_today(11), "book": book.id}
 
         res = self.client.post(BORROWING_URL, payload)
 
@@ -72,33 +141,1342 @@ class AuthenticatedPaymentsApiTest(TestCase):
         self.assertEqual(payment.borrowing, borrowing)
         self.assertEqual(payment.status, "PENDING")
         self.assertEqual(payment.type, "PAYMENT")
-        self.assertIsNotNone(payment.session_url)
+        self.assertEqual(payment.session_url, "")
+        self.assertIsNone(payment.session_id)
+        self.assertTrue(PaymentOutbox.objects.filter(payment=payment).exists())
+        api.assert_not_called()
+
+        process_checkout_outbox()
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.session_id, "test_session")
+        self.assertEqual(
+            payment.session_url,
+            "https://checkout.stripe.com/c/pay/test_session",
+        )
+        self.assertFalse(PaymentOutbox.objects.exists())
+
+
+class CheckoutOutboxTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        borrowing = sample_borrowing(sample_book(), self.user)
+        self.payment = sample_payment(
+            borrowing, session_id=None, session_url=""
+        )
+        enqueue_checkout(
+            self.payment, f"http://testserver{detail_url(self.payment.id)}"
+        )
+        self.entry = PaymentOutbox.objects.get(payment=self.payment)
+
+    def test_checkout_pending_until_session_created(self):
+        res = self.client.get(checkout_url(self.payment.id))
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data["status"], "pending")
+        self.assertEqual(res["Retry-After"], "1")
+
+        with stripe_api(
+            {
+                "POST /v1/products": {"id": "test_product"},
+                "POST /v1/checkout/sessions": {
+                    "id": "test_session",
+                    "url": "https://checkout.stripe.com/c/pay/test_session",
+                },
+            }
+        ) as api:
+            self.assertEqual(process_checkout_outbox(), (1, 0))
+
+        [(params, idempotency_key)] = stripe_requests(
+            api, "POST /v1/checkout/sessions"
+        )
+        self.assertEqual(
+            params["success_url"],
+            f"http://testserver{detail_url(self.payment.id)}success/",
+        )
+        self.assertTrue(
+            idempotency_key.startswith(f"payment-outbox-{self.entry.id}-")
+        )
+
+        res = self.client.get(checkout_url(self.payment.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data,
+            {
+                "status": "ready",
+                "session_url": "https://checkout.stripe.com/c/pay/test_session",
+            },
+        )
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_failed_entry_is_retried_later(self):
+        gateway = get_gateway()
+        gateway.failure_rate = 1
+
+        self.assertEqual(process_checkout_outbox(), (0, 1))
+
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.attempts, 1)
+        self.assertEqual(self.entry.last_error, "Simulated gateway failure")
+        self.assertGreater(self.entry.available_at, timezone.now())
+        self.assertEqual(process_checkout_outbox(), (0, 0))
+
+        PaymentOutbox.objects.update(available_at=timezone.now())
+        gateway.failure_rate = 0
+        self.assertEqual(process_checkout_outbox(), (1, 0))
+
+        self.payment.refresh_from_db()
+        self.assertIn(self.payment.session_id, gateway.sessions)
+
+    def test_paid_payment_is_not_polled(self):
+        Payment.objects.filter(pk=self.payment.pk).update(
+            status="PAID",
+            session_url="https://checkout.stripe.com/c/pay/test_session",
+            session_expires_at=timezone.now() - timedelta(hours=1),
+        )
+
+        res = self.client.get(checkout_url(self.payment.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {"status": "paid", "session_url": None})
+        self.assertNotIn("Retry-After", res)
+
+    def test_claimed_entries_are_leased(self):
+        self.assertEqual(len(claim_outbox_entries(10)), 1)
+        self.assertEqual(claim_outbox_entries(10), [])
+
+    def test_return_waits_for_pending_session(self):
+        res = self.client.post(
+            reverse(
+                "borrowing:borrowing-return-book",
+                args=[self.payment.borrowing_id],
+            ),
+            {},
+        )
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(
+            res.data["checkout"],
+            f"http://testserver{checkout_url(self.payment.id)}",
+        )
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class CheckoutProductTest(TestCase):
+    def setUp(self) -> None:
+        get_gateway.cache_clear()
+        self.gateway = get_gateway()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.book = sample_book()
+
+    def enqueue(self):
+        payment = sample_payment(
+            sample_borrowing(self.book, self.user),
+            session_id=None,
+            session_url="",
+        )
+        enqueue_checkout(payment, "http://testserver/api/payment/")
+        return payment
+
+    def test_product_created_once_per_book(self):
+        self.enqueue()
+        self.enqueue()
+
+        self.assertEqual(process_checkout_outbox(), (2, 0))
+
+        self.book.refresh_from_db()
+        self.assertEqual(
+            self.gateway.products,
+            {self.book.gateway_product_id: self.book.title},
+        )
+        for line_items in self.gateway.line_items.values():
+            self.assertEqual(
+                line_items[0].product_id, self.book.gateway_product_id
+            )
+
+    def test_checkout_without_extra_queries(self):
+        self.enqueue()
+        process_checkout_outbox()
+        payment = self.enqueue()
+
+        with self.assertNumQueries(9):
+            self.assertEqual(process_checkout_outbox(), (1, 0))
+
+        payment.refresh_from_db()
         self.assertIsNotNone(payment.session_id)
 
+    def test_product_keyed_by_book_row(self):
+        other = sample_book(title="Other")
+        self.assertNotEqual(
+            self.book.gateway_product_key, other.gateway_product_key
+        )
+        self.enqueue()
 
-class SuccessEndpointApiTest(TestCase):
+        with patch.object(
+            self.gateway, "create_product", wraps=self.gateway.create_product
+        ) as create_product:
+            process_checkout_outbox()
+
+        self.assertEqual(
+            create_product.call_args.kwargs["idempotency_key"],
+            f"book-product-{self.book.gateway_product_key}",
+        )
+
+    def test_renamed_book_gets_new_product(self):
+        self.enqueue()
+        process_checkout_outbox()
+        self.book.refresh_from_db()
+        key = self.book.gateway_product_key
+
+        self.book.title = "Renamed"
+        self.book.save()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.gateway_product_id, "")
+        self.assertNotEqual(self.book.gateway_product_key, key)
+
+        self.enqueue()
+        process_checkout_outbox()
+        self.book.refresh_from_db()
+        self.assertEqual(
+            self.gateway.products[self.book.gateway_product_id], "Renamed"
+        )
+        self.assertEqual(len(self.gateway.products), 2)
+
+    def test_title_update_forgets_product(self):
+        self.enqueue()
+        process_checkout_outbox()
+        self.book.refresh_from_db()
+        key = self.book.gateway_product_key
+
+        Book.objects.filter(pk=self.book.pk).update(title="Renamed")
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.gateway_product_id, "")
+        self.assertNotEqual(self.book.gateway_product_key, key)
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY, CHECKOUT_SESSION_TTL=3600)
+class StaleCheckoutTest(TestCase):
     def setUp(self) -> None:
         self.client = APIClient()
         self.user = create_user(email="test@test.com", password="testpass")
         self.client.force_authenticate(self.user)
+        self.gateway = get_gateway()
+        self.payment = self.checkout(sample_borrowing(sample_book(), self.user))
+
+    def checkout(self, borrowing):
+        payment = sample_payment(borrowing, session_id=None, session_url="")
+        enqueue_checkout(payment, "http://testserver/api/payment/")
+        process_checkout_outbox()
+        payment.refresh_from_db()
+        return payment
+
+    def expire(self, *payments):
+        Payment.objects.filter(
+            pk__in=[payment.pk for payment in payments]
+        ).update(session_expires_at=timezone.now() - timedelta(minutes=1))
+
+    def test_session_expiry_is_recorded(self):
+        self.assertAlmostEqual(
+            self.payment.session_expires_at,
+            timezone.now() + timedelta(hours=1),
+            delta=timedelta(minutes=1),
+        )
+        self.assertEqual(
+            self.gateway.sessions[self.payment.session_id].expires_at,
+            self.payment.session_expires_at,
+        )
+
+    def test_stale_sessions_are_expired(self):
+        session_id = self.payment.session_id
+        self.expire(self.payment)
+
+        self.assertEqual(expire_stale_checkouts(), (1, 0, 0))
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+        self.assertIsNone(self.payment.session_id)
+        self.assertEqual(self.payment.session_url, "")
+        self.assertIsNotNone(self.payment.session_expires_at)
+        self.assertEqual(self.gateway.sessions[session_id].status, "expired")
+        self.assertFalse(PaymentOutbox.objects.exists())
 
-    @patch("stripe.checkout.Session.retrieve")
-    def test_success_endpoint(self, mock_session_retrieve):
+    def test_live_sessions_are_kept(self):
+        calls = self.gateway.calls
+
+        self.assertEqual(expire_stale_checkouts(), (0, 0, 0))
+        self.assertEqual(self.gateway.calls, calls)
+
+    def test_paid_session_marks_payment_paid(self):
+        self.gateway.complete(self.payment.session_id)
+        self.expire(self.payment)
+
+        self.assertEqual(expire_stale_checkouts(), (0, 1, 0))
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PAID")
+
+    def test_failed_sessions_are_left_for_next_run(self):
+        self.expire(self.payment)
+        self.gateway.failure_rate = 1
+
+        self.assertEqual(expire_stale_checkouts(), (0, 0, 1))
+
+        self.gateway.failure_rate = 0
+        self.assertEqual(expire_stale_checkouts(), (1, 0, 0))
+
+    def test_walks_stale_payments_in_batches(self):
+        book = sample_book(title="Second")
+        payments = [
+            self.checkout(sample_borrowing(book, self.user))
+            for _ in range(4)
+        ]
+        self.expire(self.payment, *payments[:3])
+
+        self.assertEqual(expire_stale_checkouts(batch_size=2), (4, 0, 0))
+        self.assertEqual(
+            Payment.objects.filter(session_id__isnull=False).get(),
+            payments[3],
+        )
+
+    def test_return_does_not_redirect_to_dead_session(self):
+        return_url = reverse(
+            "borrowing:borrowing-return-book",
+            args=[self.payment.borrowing_id],
+        )
+        self.assertEqual(
+            self.client.post(return_url, {}).status_code,
+            status.HTTP_302_FOUND,
+        )
+        self.expire(self.payment)
+
+        res = self.client.post(return_url, {})
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        res = self.client.get(checkout_url(self.payment.id))
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(
+            PaymentOutbox.objects.filter(payment=self.payment).exists()
+        )
+
+    def test_command(self):
+        self.expire(self.payment)
+        out = io.StringIO()
+
+        call_command("expire_checkout_sessions", stdout=out)
+
+        self.assertIn(
+            "Expired 1 sessions, found 0 paid, 0 failed", out.getvalue()
+        )
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class ReconcilePaymentsTest(TestCase):
+    def setUp(self) -> None:
+        self.gateway = get_gateway()
+        self.gateway.sessions.clear()
+        user = create_user(email="test@test.com", password="testpass")
         book = sample_book()
-        borrowing = sample_borrowing(book, self.user)
-        payment = sample_payment(borrowing)
+        self.payments = []
+        for _ in range(5):
+            payment = sample_payment(
+                sample_borrowing(book, user), session_id=None, session_url=""
+            )
+            enqueue_checkout(payment, "http://testserver/api/payment/")
+            self.payments.append(payment)
+        process_checkout_outbox()
+        for payment in self.payments:
+            payment.refresh_from_db()
 
-        mock_session_retrieve.return_value = {
-            "id": payment.session_id,
-            "payment_status": "paid",
+        self.paid, self.expired, self.open, self.unpaid = self.payments[:4]
+        self.gateway.complete(self.paid.session_id)
+        self.gateway.expire_checkout_session(self.expired.session_id)
+        Payment.objects.filter(pk=self.unpaid.pk).update(status="PAID")
+        self.unmatched = self.gateway.create_checkout_session(
+            success_url="", cancel_url="", line_items=[]
+        )
+        self.window = (
+            timezone.now() - timedelta(hours=1),
+            timezone.now() + timedelta(hours=1),
+        )
+
+    def test_applies_missed_statuses(self):
+        with self.assertNumQueries(3 + 2):
+            report = reconcile_payments(*self.window, page_size=2)
+
+        self.assertEqual((report.pages, report.sessions), (3, 6))
+        self.assertEqual(report.paid, [(self.paid.id, self.paid.session_id)])
+        self.assertEqual(
+            report.expired, [(self.expired.id, self.expired.session_id)]
+        )
+        self.assertEqual(
+            report.unpaid, [(self.unpaid.id, self.unpaid.session_id)]
+        )
+        self.assertEqual(report.unmatched, [self.unmatched.id])
+
+        statuses = dict(Payment.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[self.paid.id], "PAID")
+        self.assertEqual(statuses[self.open.id], "PENDING")
+        self.expired.refresh_from_db()
+        self.assertIsNone(self.expired.session_id)
+        self.assertEqual(self.expired.status, "PENDING")
+
+    def test_dry_run_changes_nothing(self):
+        report = reconcile_payments(*self.window, dry_run=True)
+
+        self.assertEqual(report.pages, 1)
+        self.assertEqual(len(report.paid), 1)
+        self.assertFalse(
+            Payment.objects.filter(pk=self.paid.pk, status="PAID").exists()
+        )
+
+    def test_sessions_outside_window_are_skipped(self):
+        report = reconcile_payments(
+            self.window[0] - timedelta(days=1), self.window[0]
+        )
+
+        self.assertEqual((report.pages, report.sessions), (1, 0))
+
+    def test_stripe_pages(self):
+        first_page = {
+            "data": [
+                {
+                    "id": self.paid.session_id,
+                    "status": "complete",
+                    "payment_status": "paid",
+                }
+            ],
+            "has_more": True,
         }
+        last_page = {"data": [], "has_more": False}
 
-        response = self.client.get(success_url(payment.id))
+        with override_settings(PAYMENT_GATEWAY=STRIPE_GATEWAY), stripe_api(
+            {"GET /v1/checkout/sessions": [first_page, last_page]}
+        ) as api:
+            report = reconcile_payments(*self.window)
+
+        self.assertEqual(report.paid, [(self.paid.id, self.paid.session_id)])
+        pages = stripe_requests(api, "GET /v1/checkout/sessions")
+        self.assertEqual(pages[1][0]["starting_after"], self.paid.session_id)
+        self.assertEqual(
+            pages[1][0]["created"],
+            {
+                "gte": int(self.window[0].timestamp()),
+                "lt": int(self.window[1].timestamp()),
+            },
+        )
+
+    def test_command(self):
+        out = io.StringIO()
+
+        call_command("reconcile_payments", stdout=out)
+
+        self.assertIn(
+            f"~ payment {self.paid.id} ({self.paid.session_id}): "
+            f"PENDING -> PAID",
+            out.getvalue(),
+        )
+        self.assertIn(
+            "Applied 1 paid and 1 expired, 1 unpaid and 1 unmatched of 6 "
+            "sessions in 1 gateway calls",
+            out.getvalue(),
+        )
+
+
+class SuccessEndpointApiTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+
+    @stripe_api({})
+    def test_success_endpoint(self, api):
+        book = sample_book()
+        borrowing = sample_borrowing(book, self.user)
+        payment = sample_payment(borrowing, status="PAID")
 
-        updated_payment = Payment.objects.get(pk=payment.pk)
-        self.assertEqual(updated_payment.status, "PAID")
+        response = self.client.get(success_url(payment.id))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, PaymentSerializer(payment).data)
+        api.assert_not_called()
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class PaymentStatusCheckTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        get_gateway.cache_clear()
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        self.gateway = get_gateway()
+        self.session = self.gateway.create_checkout_session(
+            success_url="", cancel_url="", line_items=[]
+        )
+        self.payment = sample_payment(
+            sample_borrowing(sample_book(), self.user),
+            session_id=self.session.id,
+        )
+
+    def test_pending_payment_paid_at_gateway(self):
+        self.gateway.complete(self.session.id)
+
+        res = self.client.get(success_url(self.payment.id))
+
+        self.assertEqual(res.data["status"], "PAID")
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PAID")
+
+    def test_status_is_cached_briefly(self):
+        for _ in range(3):
+            res = self.client.get(success_url(self.payment.id))
+            self.assertEqual(res.data["status"], "PENDING")
+
+        self.assertEqual(self.gateway.calls, 2)
+
+    def test_concurrent_checks_share_one_call(self):
+        self.gateway.latency = 0.2
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    check_checkout_session(self.session.id)
+                )
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [self.session] * 5)
+        self.assertEqual(self.gateway.calls, 2)
+
+    def concurrent_check_errors(self, count):
+        errors = []
+
+        def check():
+            try:
+                check_checkout_session(self.session.id)
+            except BaseException as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=check) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+        return errors
+
+    def test_concurrent_checks_share_any_error(self):
+        def lost_session(session_id):
+            time.sleep(0.2)
+            raise KeyError(session_id)
+
+        with patch.object(
+            FakeGateway, "retrieve_checkout_session", side_effect=lost_session
+        ):
+            errors = self.concurrent_check_errors(3)
+
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(
+            sorted(type(error).__name__ for error in errors),
+            ["GatewayError", "GatewayError", "KeyError"],
+        )
+
+    def test_check_in_other_process_is_awaited(self):
+        cache.add(f"payment:session-check:{self.session.id}", "other")
+
+        def other_process():
+            time.sleep(0.2)
+            cache.set(
+                f"payment:session-check:{self.session.id}:other", self.session
+            )
+
+        thread = threading.Thread(target=other_process)
+        thread.start()
+        session = check_checkout_session(self.session.id)
+        thread.join()
+
+        self.assertEqual(session, self.session)
+        self.assertEqual(self.gateway.calls, 1)
+
+    @override_settings(PAYMENT_STATUS_CHECK_TIMEOUT=0.05)
+    def test_waiting_check_times_out(self):
+        self.gateway.latency = 0.5
+
+        errors = self.concurrent_check_errors(2)
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], GatewayError)
+
+    def test_gateway_failure_answers_from_database(self):
+        self.gateway.failure_rate = 1
+
+        res = self.client.get(success_url(self.payment.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "PENDING")
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class WebhookApiTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.payment = sample_payment(
+            sample_borrowing(sample_book(), self.user)
+        )
+
+    def post_event(self, event_id, event_type, session):
+        payload, signature = signed_webhook(event_id, event_type, session)
+        return self.client.post(
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature,
+        )
+
+    def test_completed_event_marks_payment_paid(self):
+        session = {"id": self.payment.session_id, "payment_status": "paid"}
+
+        res = self.post_event("evt_1", "checkout.session.completed", session)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {"received": True, "duplicate": False})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PAID")
+
+        self.client.force_authenticate(self.user)
+        res = self.client.get(success_url(self.payment.id))
+        self.assertEqual(res.data["status"], "PAID")
+
+    def test_unpaid_completed_event_keeps_payment_pending(self):
+        session = {"id": self.payment.session_id, "payment_status": "unpaid"}
+
+        self.post_event("evt_1", "checkout.session.completed", session)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+
+    def test_duplicate_event_is_ignored(self):
+        session = {"id": self.payment.session_id, "payment_status": "paid"}
+        self.post_event("evt_1", "checkout.session.completed", session)
+        Payment.objects.filter(pk=self.payment.pk).update(status="PENDING")
+
+        res = self.post_event("evt_1", "checkout.session.completed", session)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {"received": True, "duplicate": True})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+
+    def test_other_integrity_error_fails_delivery(self):
+        session = {"id": self.payment.session_id, "payment_status": "paid"}
+
+        with patch(
+            "payment.services._apply_checkout_event",
+            side_effect=IntegrityError("payment_one_pending_fine"),
+        ), self.assertRaises(IntegrityError):
+            self.post_event("evt_1", "checkout.session.completed", session)
+
+        self.assertFalse(WebhookEvent.objects.exists())
+        res = self.post_event("evt_1", "checkout.session.completed", session)
+        self.assertEqual(res.data, {"received": True, "duplicate": False})
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=None)
+    def test_missing_secret_rejected(self):
+        session = {"id": self.payment.session_id, "payment_status": "paid"}
+
+        with self.assertLogs("payment.views", "ERROR"):
+            res = self.post_event(
+                "evt_1", "checkout.session.completed", session
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            res.data["detail"], "Webhook signing secret is not configured."
+        )
+
+    def test_expired_event_drops_dead_session(self):
+        session = {"id": self.payment.session_id, "payment_status": "unpaid"}
+
+        self.post_event("evt_1", "checkout.session.expired", session)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+        self.assertIsNone(self.payment.session_id)
+        self.assertEqual(self.payment.session_url, "")
+
+        self.client.force_authenticate(self.user)
+        res = self.client.get(checkout_url(self.payment.id))
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(
+            PaymentOutbox.objects.filter(payment=self.payment).exists()
+        )
+
+    def test_invalid_signature_rejected(self):
+        session = {"id": self.payment.session_id, "payment_status": "paid"}
+        payload, _ = signed_webhook(
+            "evt_1", "checkout.session.completed", session
+        )
+        _, signature = signed_webhook(
+            "evt_1", "checkout.session.completed", session, "whsec_other"
+        )
+
+        res = self.client.post(
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature,
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+
+
+class PaymentConditionalGetTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        self.payment = sample_payment(
+            sample_borrowing(sample_book(), self.user)
+        )
+
+    def test_etag_follows_payment_updates(self):
+        url = detail_url(self.payment.id)
+        etag = self.client.get(url)["ETag"]
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Payment.objects.filter(pk=self.payment.pk).update(status="PAID")
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "PAID")
+
+    def test_if_modified_since(self):
+        res = self.client.get(PAYMENTS_URL)
+        last_modified = res["Last-Modified"]
+
+        res = self.client.get(
+            PAYMENTS_URL, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        later = timezone.now() + timedelta(seconds=5)
+        with patch("django.utils.timezone.now", return_value=later):
+            Payment.objects.filter(pk=self.payment.pk).update(status="PAID")
+        res = self.client.get(
+            PAYMENTS_URL, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_other_users_payment_not_found(self):
+        self.client.force_authenticate(
+            create_user(email="other@test.com", password="testpass")
+        )
+        res = self.client.get(detail_url(self.payment.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(res.has_header("ETag"))
+
+
+class PaymentExportTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.admin = create_user(
+            email="admin@admin.com", password="adminpass", is_staff=True
+        )
+        self.payment = sample_payment(
+            sample_borrowing(sample_book(), self.admin)
+        )
+
+    def test_export_payments(self):
+        self.client.force_authenticate(self.admin)
+
+        res = self.client.get(EXPORT_URL, {"output": "ndjson"})
+
+        rows = [
+            json.loads(line)
+            for line in b"".join(res.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["id"], self.payment.id)
+        self.assertEqual(rows[0]["money_to_pay"], "10.50")
+
+    def test_export_payments_by_borrow_date(self):
+        self.client.force_authenticate(self.admin)
+
+        res = self.client.get(EXPORT_URL, {"date_to": "2000-01-01"})
+
+        content = b"".join(res.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 1)
+
+    def test_export_staff_only(self):
+        self.client.force_authenticate(
+            create_user(email="test@test.com", password="testpass")
+        )
+        res = self.client.get(EXPORT_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OverdueFinesTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        self.book = sample_book(daily_fee="2.00")
+        self.today = timezone.now().date()
+
+    def overdue_borrowing(self, days, **params):
+        borrowing = sample_borrowing(self.book, self.user)
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            borrow_date=self.today - timedelta(10),
+            expected_return_date=self.today - timedelta(days),
+            **params,
+        )
+        return borrowing
+
+    def test_bills_overdue_borrowings_still_out(self):
+        overdue = self.overdue_borrowing(3)
+        sample_borrowing(self.book, self.user)
+        self.overdue_borrowing(3, actual_return_date=self.today)
+
+        self.assertEqual(process_overdues(), (1, 0))
+
+        fine = Payment.objects.get(type="FINE")
+        self.assertEqual(fine.borrowing, overdue)
+        self.assertEqual(fine.status, "PENDING")
+        self.assertEqual(fine.money_to_pay, Decimal("12.00"))
+
+    def attach_session(self):
+        session = get_gateway().create_checkout_session(
+            success_url="", cancel_url="", line_items=[]
+        )
+        Payment.objects.filter(type="FINE").update(
+            session_id=session.id, session_url=session.url
+        )
+        return session
+
+    def test_running_fine_is_checked_out_on_request(self):
+        self.overdue_borrowing(3)
+
+        process_overdues()
+
+        fine = Payment.objects.get(type="FINE")
+        self.assertFalse(PaymentOutbox.objects.exists())
+        res = self.client.get(checkout_url(fine.id))
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(
+            PaymentOutbox.objects.get(payment=fine).domain_url,
+            f"http://testserver{detail_url(fine.id)}",
+        )
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_rerun_refreshes_running_fine(self):
+        borrowing = self.overdue_borrowing(3)
+        process_overdues()
+        self.assertEqual(process_overdues(), (0, 0))
+
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            expected_return_date=self.today - timedelta(4)
+        )
+        self.assertEqual(process_overdues(), (0, 1))
+
+        fine = Payment.objects.get(type="FINE")
+        self.assertEqual(fine.money_to_pay, Decimal("16.00"))
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_rerun_keeps_fine_with_session(self):
+        borrowing = self.overdue_borrowing(3)
+        process_overdues()
+        session = self.attach_session()
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            expected_return_date=self.today - timedelta(4)
+        )
+
+        with patch.object(FakeGateway, "expire_checkout_session") as expire:
+            self.assertEqual(process_overdues(), (0, 0))
+
+        expire.assert_not_called()
+        fine = Payment.objects.get(type="FINE")
+        self.assertEqual(fine.money_to_pay, Decimal("12.00"))
+        self.assertEqual(fine.session_id, session.id)
+
+    def return_book(self, borrowing):
+        res = self.client.post(
+            reverse("borrowing:borrowing-return-book", args=[borrowing.id])
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_return_replaces_session_of_repriced_fine(self):
+        borrowing = self.overdue_borrowing(3)
+        process_overdues()
+        session = self.attach_session()
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            expected_return_date=self.today - timedelta(4)
+        )
+        gateway = get_gateway()
+        gateway.failure_rate = 1
+
+        self.return_book(borrowing)
+
+        fine = Payment.objects.get(type="FINE")
+        self.assertEqual(fine.session_id, session.id)
+        self.assertTrue(PaymentOutbox.objects.filter(payment=fine).exists())
+        self.assertEqual(process_checkout_outbox(), (0, 1))
+
+        gateway.failure_rate = 0
+        PaymentOutbox.objects.update(available_at=timezone.now())
+        self.assertEqual(process_checkout_outbox(), (1, 0))
+
+        fine.refresh_from_db()
+        self.assertEqual(fine.money_to_pay, Decimal("16.00"))
+        self.assertNotEqual(fine.session_id, session.id)
+        self.assertEqual(gateway.sessions[session.id].status, "expired")
+        self.assertEqual(
+            gateway.line_items[fine.session_id][0].amount, 1600
+        )
+        self.assertFalse(PaymentOutbox.objects.exists())
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_fine_paid_before_repricing_bills_the_rest(self):
+        borrowing = self.overdue_borrowing(3)
+        process_overdues()
+        session = self.attach_session()
+        get_gateway().complete(session.id)
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            expected_return_date=self.today - timedelta(4)
+        )
+
+        self.return_book(borrowing)
+        self.assertEqual(process_checkout_outbox(), (1, 0))
+        self.assertEqual(process_checkout_outbox(), (1, 0))
+
+        self.assertEqual(
+            list(
+                Payment.objects.filter(type="FINE")
+                .order_by("pk")
+                .values_list("status", "money_to_pay")
+            ),
+            [("PAID", Decimal("12.00")), ("PENDING", Decimal("4.00"))],
+        )
+        self.assertIsNotNone(
+            Payment.objects.get(type="FINE", status="PENDING").session_id
+        )
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_session_of_repriced_fine_is_not_stored(self):
+        borrowing = self.overdue_borrowing(3)
+        process_overdues()
+        fine = Payment.objects.get(type="FINE")
+        enqueue_checkout(fine, "http://testserver/api/payment/")
+        gateway = get_gateway()
+        create_session = gateway.create_checkout_session
+
+        def reprice_meanwhile(**kwargs):
+            Payment.objects.filter(pk=fine.pk).update(money_to_pay="14.00")
+            return create_session(**kwargs)
+
+        with patch.object(
+            gateway, "create_checkout_session", side_effect=reprice_meanwhile
+        ):
+            self.assertEqual(process_checkout_outbox(), (0, 1))
+
+        fine.refresh_from_db()
+        self.assertIsNone(fine.session_id)
+        self.assertTrue(PaymentOutbox.objects.filter(payment=fine).exists())
+
+    def test_paid_fines_are_deducted(self):
+        borrowing = self.overdue_borrowing(3)
+        sample_payment(
+            borrowing, type="FINE", status="PAID", money_to_pay="8.00"
+        )
+
+        process_overdues()
+
+        fine = Payment.objects.get(type="FINE", status="PENDING")
+        self.assertEqual(fine.money_to_pay, Decimal("4.00"))
+
+    def test_walks_overdues_in_chunks(self):
+        for _ in range(5):
+            self.overdue_borrowing(1)
+
+        with self.assertNumQueries(21):
+            self.assertEqual(process_overdues(chunk_size=2), (5, 0))
+
+    def test_command(self):
+        self.overdue_borrowing(1)
+        out = io.StringIO()
+
+        call_command("process_overdues", stdout=out)
+
+        self.assertIn("Created 1 fines, refreshed 0", out.getvalue())
+
+    def test_return_settles_billed_fine(self):
+        borrowing = self.overdue_borrowing(3)
+        sample_payment(borrowing, status="PAID")
+        process_overdues()
+
+        res = self.client.post(
+            reverse("borrowing:borrowing-return-book", args=[borrowing.id])
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        fine = Payment.objects.get(type="FINE")
+        self.assertEqual(fine.money_to_pay, Decimal("12.00"))
+        self.assertTrue(PaymentOutbox.objects.filter(payment=fine).exists())
+
+
+class PaymentFilterTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        book = sample_book()
+        borrowing = sample_borrowing(book, self.user)
+        self.pending = sample_payment(borrowing, money_to_pay="10.00")
+        self.paid = sample_payment(
+            borrowing, status="PAID", money_to_pay="20.00"
+        )
+        self.fine = sample_payment(
+            borrowing, type="FINE", money_to_pay="5.00"
+        )
+        Payment.objects.filter(pk=self.paid.pk).update(
+            created_at=timezone.now() - timedelta(days=10)
+        )
+        other = create_user(email="other@test.com", password="testpass")
+        sample_payment(sample_borrowing(book, other), money_to_pay="99.00")
+
+    def listed(self, **params):
+        res = self.client.get(PAYMENTS_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [payment["id"] for payment in res.data["results"]]
+
+    def test_filter_by_status_and_type(self):
+        self.assertEqual(
+            self.listed(status="PENDING"), [self.fine.id, self.pending.id]
+        )
+        self.assertEqual(
+            self.listed(status="PENDING", type="PAYMENT"), [self.pending.id]
+        )
+        self.assertEqual(self.listed(type="FINE"), [self.fine.id])
+
+    def test_filter_by_date(self):
+        today = timezone.now().date()
+
+        self.assertEqual(
+            self.listed(date_from=today), [self.fine.id, self.pending.id]
+        )
+        self.assertEqual(
+            self.listed(date_to=today - timedelta(days=10)), [self.paid.id]
+        )
+
+    def test_invalid_filter(self):
+        res = self.client.get(PAYMENTS_URL, {"status": "LOST"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("status", res.data)
+
+    def test_summary(self):
+        with self.assertNumQueries(1):
+            res = self.client.get(SUMMARY_URL)
+
+        self.assertEqual(
+            res.data, {"pending": "15.00", "paid": "20.00", "fines": "5.00"}
+        )
+
+    def test_filtered_summary(self):
+        res = self.client.get(SUMMARY_URL, {"type": "PAYMENT"})
+
+        self.assertEqual(
+            res.data, {"pending": "10.00", "paid": "20.00", "fines": "0.00"}
+        )
+
+    def test_staff_summary_covers_all_users(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        res = self.client.get(SUMMARY_URL)
+
+        self.assertEqual(res.data["pending"], "114.00")
+
+
+class PaymentQueryCountTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = create_user(email="test@test.com", password="testpass")
+        self.client.force_authenticate(self.user)
+        book = sample_book()
+        for _ in range(5):
+            self.payment = sample_payment(sample_borrowing(book, self.user))
+
+    def test_list_queries(self):
+        with self.assertNumQueries(1):
+            res = self.client.get(PAYMENTS_URL)
+        self.assertEqual(len(res.data["results"]), 5)
+
+    def test_retrieve_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get(detail_url(self.payment.id))
+
+    def test_not_modified_queries(self):
+        etag = self.client.get(detail_url(self.payment.id))["ETag"]
+        with self.assertNumQueries(0):
+            res = self.client.get(
+                detail_url(self.payment.id), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_success_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get(success_url(self.payment.id))
+
+    def test_webhook_queries(self):
+        session = {"id": self.payment.session_id, "payment_status": "paid"}
+        payload, signature = signed_webhook(
+            "evt_1", "checkout.session.completed", session
+        )
+        with override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET):
+            with self.assertNumQueries(4):
+                self.client.post(
+                    WEBHOOK_URL,
+                    payload,
+                    content_type="application/json",
+                    HTTP_STRIPE_SIGNATURE=signature,
+                )
+
+
+class FakeGatewayTest(TestCase):
+    def test_session_lifecycle(self):
+        gateway = FakeGateway()
+        session = gateway.create_checkout_session(
+            success_url="http://testserver/success/",
+            cancel_url="http://testserver/cancelled/",
+            line_items=[],
+        )
+
+        self.assertEqual(session.payment_status, "unpaid")
+        gateway.complete(session.id)
+        self.assertEqual(
+            gateway.retrieve_checkout_session(session.id).payment_status,
+            "paid",
+        )
+        self.assertEqual(gateway.calls, 2)
+
+    def test_failure_rate(self):
+        gateway = FakeGateway(failure_rate=1)
+        with self.assertRaises(GatewayError):
+            gateway.retrieve_checkout_session("cs_fake_missing")
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_gateway_from_settings(self):
+        self.assertIsInstance(get_gateway(), FakeGateway)
+        self.assertIs(get_gateway(), get_gateway())
+
+
+class StripeGatewayTest(TestCase):
+    def test_requests_use_own_client_and_key(self):
+        default_client = stripe.default_http_client
+        default_retries = stripe.max_network_retries
+        gateway = StripeGateway(api_key="sk_test_own", max_retries=5)
+
+        with patch.object(
+            gateway.http_client,
+            "request_with_retries",
+            return_value=('{"id": "prod_1", "object": "product"}', 200, {}),
+        ) as request:
+            product_id = gateway.create_product(
+                name="Book", idempotency_key="book-product-1"
+            )
+
+        self.assertEqual(product_id, "prod_1")
+        method, url, headers, body = request.call_args.args
+        self.assertEqual(url, "https://api.stripe.com/v1/products")
+        self.assertEqual(headers["Authorization"], "Bearer sk_test_own")
+        self.assertEqual(headers["Idempotency-Key"], "book-product-1")
+        self.assertEqual(gateway.http_client._max_network_retries(), 5)
+        self.assertIs(stripe.default_http_client, default_client)
+        self.assertEqual(stripe.max_network_retries, default_retries)
+
+    def test_gateway_error_wraps_stripe_error(self):
+        gateway = StripeGateway(api_key="sk_test_own")
+        with patch.object(
+            gateway.http_client,
+            "request_with_retries",
+            return_value=('{"error": {"message": "No such session"}}', 404, {}),
+        ), self.assertRaises(GatewayError):
+            gateway.retrieve_checkout_session("cs_missing")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            window=4,
+            min_calls=4,
+            failure_rate_threshold=0.5,
+            slow_call_duration=5,
+            slow_call_rate_threshold=0.5,
+            open_duration=30,
+            clock=self.clock,
+        )
+
+    def fail(self):
+        raise GatewayError("Gateway timeout")
+
+    def slow(self):
+        self.clock.now += 6
+        return "slow"
+
+    def test_opens_on_failure_rate(self):
+        self.breaker.call(lambda: "ok")
+        self.breaker.call(lambda: "ok")
+        for _ in range(2):
+            with self.assertRaises(GatewayError):
+                self.breaker.call(self.fail)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: "ok")
+        self.assertEqual(self.breaker.stats()["trips"], 1)
+        self.assertEqual(self.breaker.stats()["rejected"], 1)
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+    def test_opens_on_slow_calls(self):
+        self.breaker.call(lambda: "ok")
+        self.breaker.call(lambda: "ok")
+        self.breaker.call(self.slow)
+        self.breaker.call(self.slow)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_trial_closes_or_reopens(self):
+        for _ in range(4):
+            with self.assertRaises(GatewayError):
+                self.breaker.call(self.fail)
+
+        self.clock.now += 30
+        with self.assertRaises(GatewayError):
+            self.breaker.call(self.fail)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.trips, 2)
+
+        self.clock.now += 30
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_any_exception_fails_the_trial(self):
+        for _ in range(4):
+            with self.assertRaises(GatewayError):
+                self.breaker.call(self.fail)
+
+        self.clock.now += 30
+        with self.assertRaises(KeyError):
+            self.breaker.call({}.__getitem__, "missing")
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.clock.now += 30
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_trip_shared_between_processes(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        worker, web = (
+            CircuitBreaker(
+                window=4,
+                min_calls=4,
+                open_duration=30,
+                shared_key="test:circuit-breaker",
+                clock=self.clock,
+            )
+            for _ in range(2)
+        )
+        for _ in range(4):
+            with self.assertRaises(GatewayError):
+                worker.call(self.fail)
+
+        self.clock.now += 10
+        self.assertEqual(web.retry_after(), 20)
+        self.assertEqual(web.stats()["state"], CircuitBreaker.OPEN)
+        self.assertEqual(web.stats()["trips"], 1)
+        with self.assertRaises(CircuitOpenError):
+            web.call(lambda: "ok")
+
+        self.clock.now += 20
+        self.assertEqual(web.call(lambda: "ok"), "ok")
+        self.assertEqual(web.state, CircuitBreaker.CLOSED)
+
+
+@override_settings(PAYMENT_GATEWAY=BREAKER_GATEWAY)
+class CircuitBreakerGatewayTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.admin = create_user(
+            email="admin@admin.com", password="adminpass", is_staff=True
+        )
+        self.user = create_user(email="test@test.com", password="testpass")
+        book = sample_book()
+        for _ in range(4):
+            payment = sample_payment(
+                sample_borrowing(book, self.user),
+                session_id=None,
+                session_url="",
+            )
+            enqueue_checkout(payment, "http://testserver/api/payment/1/")
+        self.payment = payment
+        cache.clear()
+        self.addCleanup(cache.clear)
+        get_gateway.cache_clear()
+        get_gateway().gateway.failure_rate = 1
+
+    def test_outbox_stops_when_circuit_opens(self):
+        self.assertEqual(process_checkout_outbox(), (0, 2))
+
+        released = PaymentOutbox.objects.filter(attempts=0)
+        self.assertEqual(released.count(), 2)
+        self.assertGreater(released.first().available_at, timezone.now())
+        self.assertEqual(get_gateway().gateway.calls, 2)
+
+        PaymentOutbox.objects.update(available_at=timezone.now())
+        self.assertEqual(process_checkout_outbox(), (0, 0))
+        self.assertEqual(get_gateway().gateway.calls, 2)
+
+    def test_checkout_poll_backs_off_while_open(self):
+        process_checkout_outbox()
+
+        self.client.force_authenticate(self.user)
+        res = self.client.get(checkout_url(self.payment.id))
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertGreater(int(res["Retry-After"]), 1)
+
+    def test_gateway_status_for_staff_only(self):
+        process_checkout_outbox()
+
+        self.client.force_authenticate(self.user)
+        res = self.client.get(GATEWAY_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
 
-        serializer = PaymentSerializer(updated_payment)
-        self.assertEqual(response.data, serializer.data)
+        self.client.force_authenticate(self.admin)
+        res = self.client.get(GATEWAY_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["backend"], "FakeGateway")
+        self.assertEqual(res.data["circuit_breaker"]["state"], "open")
+        self.assertEqual(res.data["circuit_breaker"]["trips"], 1)
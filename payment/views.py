@@ -1,14 +1,48 @@
-import stripe
-from django.conf import settings
-from rest_framework import mixins, viewsets
+import logging
+import math
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from book.models import Book
-from borrowing.models import Borrowing
+from library_service.conditional import conditional_get
+from library_service.exports import export_response
+from library_service.pagination import KeysetPagination
+from library_service.versions import get_modified, get_version, model_version
+from payment.gateways import (
+    GatewayError,
+    InvalidWebhookError,
+    WebhookNotConfiguredError,
+    get_gateway,
+)
 from payment.models import Payment
-from payment.serializers import PaymentDetailSerializer, PaymentSerializer
+from payment.serializers import (
+    PaymentDetailSerializer,
+    PaymentFilterSerializer,
+    PaymentSerializer,
+    PaymentSummarySerializer,
+)
+from payment.services import (
+    check_checkout_session,
+    enqueue_checkout,
+    handle_webhook_event,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class PaymentPagination(KeysetPagination):
+    ordering = ("-id",)
 
 
 class PaymentViewSet(
@@ -18,14 +52,49 @@ class PaymentViewSet(
 ):
     queryset = Payment.objects.all()
     permission_classes = (IsAuthenticated,)
+    pagination_class = PaymentPagination
+    lookup_value_regex = r"\d+"
 
     def get_queryset(self):
         queryset = self.queryset
 
-        if self.request.user.is_staff:
-            return queryset
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(
+                borrowing__user_id=self.request.user.id
+            )
 
-        return queryset.filter(borrowing__user_id=self.request.user.id)
+        if self.action in ("list", "summary"):
+            filters = PaymentFilterSerializer(data=self.request.query_params)
+            filters.is_valid(raise_exception=True)
+            params = filters.validated_data
+            if "status" in params:
+                queryset = queryset.filter(status=params["status"])
+            if "type" in params:
+                queryset = queryset.filter(type=params["type"])
+            if "date_from" in params:
+                queryset = queryset.filter(
+                    created_at__gte=start_of_day(params["date_from"])
+                )
+            if "date_to" in params:
+                queryset = queryset.filter(
+                    created_at__lt=start_of_day(
+                        params["date_to"] + timedelta(1)
+                    )
+                )
+
+        return queryset
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_validators(self):
+        version = model_version(Payment)
+        return get_version(version), get_modified(version)
 
     def get_serializer_class(self):
         if self.action == "retrieve":
@@ -34,48 +103,137 @@ class PaymentViewSet(
 
     @action(methods=["GET"], detail=True, url_path="success")
     def success(self, request, pk=None):
-        session_id = self.get_object().session_id
-        payment = Payment.objects.get(session_id=session_id)
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        session = stripe.checkout.Session.retrieve(session_id)
-        if session["payment_status"] == "paid":
-            payment.status = "PAID"
-            payment.save()
-        serializer = PaymentSerializer(payment)
-        return Response(serializer.data)
+        """
+        Payment status, checked at the gateway while the payment is pending
+        in case the customer got here before the webhook
+        """
+        payment = self.get_object()
+        if payment.status == "PENDING" and payment.session_id:
+            try:
+                session = check_checkout_session(payment.session_id)
+            except GatewayError:
+                session = None
+            if session is not None and session.payment_status == "paid":
+                Payment.objects.filter(
+                    session_id=payment.session_id, status="PENDING"
+                ).update(status="PAID")
+                payment.refresh_from_db()
+        return Response(PaymentSerializer(payment).data)
 
-    @action(methods=["GET"], detail=True, url_path="cancelled")
-    def cancel(self, request, pk=None):
-        return Response({"detail": "You can make your pay in next 24 hours"})
+    @action(methods=["GET"], detail=True, url_path="checkout")
+    def checkout(self, request, pk=None):
+        """
+        Poll until the checkout session of the payment is created.
+        A payment that is no longer pending has nothing to check out and
+        is answered with its status.
+        """
+        payment = self.get_object()
+        if payment.status != "PENDING":
+            return Response(
+                {"status": payment.status.lower(), "session_url": None}
+            )
+        if payment.has_live_session:
+            return Response(
+                {"status": "ready", "session_url": payment.session_url}
+            )
+        enqueue_checkout(
+            payment,
+            reverse(
+                "payment:payment-detail",
+                kwargs={"pk": payment.id},
+                request=request,
+            ),
+        )
+        retry_after = max(1, math.ceil(get_gateway().retry_after()))
+        return Response(
+            {"status": "pending", "session_url": None},
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    @action(methods=["GET"], detail=False, url_path="summary")
+    def summary(self, request):
+        """Pending, paid and fine totals of the filtered payments"""
+        summary = (
+            self.get_queryset()
+            .order_by()
+            .aggregate(
+                pending=Sum(
+                    "money_to_pay",
+                    filter=Q(status="PENDING"),
+                    default=Decimal(0),
+                ),
+                paid=Sum(
+                    "money_to_pay", filter=Q(status="PAID"), default=Decimal(0)
+                ),
+                fines=Sum(
+                    "money_to_pay", filter=Q(type="FINE"), default=Decimal(0)
+                ),
+            )
+        )
+        return Response(PaymentSummarySerializer(summary).data)
 
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="gateway",
+        permission_classes=(IsAdminUser,),
+    )
+    def gateway(self, request):
+        """
+        Payment gateway backend and circuit breaker state for alerting.
 
-def create_checkout_session(
-        domain_url: str, borrowing_id: int, money_amount: int
-):
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    borrowing = Borrowing.objects.get(pk=borrowing_id)
-    book = Book.objects.get(pk=borrowing.book.id)
-    try:
-        checkout_session = stripe.checkout.Session.create(
-            success_url=domain_url + "success/",
-            cancel_url=domain_url + "cancelled/",
-            payment_method_types=["card"],
-            mode="payment",
-            line_items=[{
-                "price_data": {
-                    "currency": "usd",
-                    "unit_amount": money_amount,
-                    "product_data": {
-                        "name": book.title,
-                        "description": "Book borrowing",
-                    },
-                },
-                "quantity": 1,
-            }],
+        The state and trip count are shared between processes, the call
+        counts and rates are those of the process answering.
+        """
+        return Response(get_gateway().stats())
+
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="export",
+        permission_classes=(IsAdminUser,),
+    )
+    def export(self, request):
+        """Stream payments of borrowings made in a borrow date range"""
+        return export_response(request, "payments")
+
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="webhook",
+        authentication_classes=(),
+        permission_classes=(AllowAny,),
+        throttle_classes=(),
+    )
+    def webhook(self, request):
+        """Receive signed checkout events from Stripe"""
+        try:
+            event = get_gateway().construct_event(
+                request.body, request.META.get("HTTP_STRIPE_SIGNATURE", "")
+            )
+        except WebhookNotConfiguredError as error:
+            logger.error("Webhook rejected: %s", error)
+            return Response(
+                {"detail": "Webhook signing secret is not configured."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except InvalidWebhookError:
+            return Response(
+                {"detail": "Invalid webhook payload or signature."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        processed = handle_webhook_event(event)
+        return Response({"received": True, "duplicate": not processed})
+
+    @action(methods=["GET"], detail=True, url_path="cancelled")
+    def cancel(self, request, pk=None):
+        payment = self.get_object()
+        return Response(
+            {
+                "detail": "You can make your pay until the checkout "
+                "session expires.",
+                "session_expires_at": payment.session_expires_at,
+            }
         )
-        return {
-            "session_id": checkout_session["id"],
-            "session_url": checkout_session["url"]
-        }
-    except Exception as e:
-        return {"error": str(e)}
@@ -1,3 +1,36 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
 
-# Create your tests here.
+CREATE_USER_URL = reverse("user:create")
+MANAGE_USER_URL = reverse("user:manage")
+TOKEN_URL = reverse("user:token_obtain_pair")
+
+
+class UserQueryCountTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test@test.com", "testpass"
+        )
+
+    def test_create_user_queries(self):
+        payload = {"email": "new@test.com", "password": "newpass"}
+        with self.assertNumQueries(2):
+            self.client.post(CREATE_USER_URL, payload)
+
+    def test_retrieve_me_queries(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(0):
+            self.client.get(MANAGE_USER_URL)
+
+    def test_update_me_queries(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(1):
+            self.client.patch(MANAGE_USER_URL, {"first_name": "Test"})
+
+    def test_obtain_token_queries(self):
+        payload = {"email": "test@test.com", "password": "testpass"}
+        with self.assertNumQueries(1):
+            self.client.post(TOKEN_URL, payload)